@@ -0,0 +1,113 @@
+"""
+Benchmark centerline engines.
+
+Compare Voronoi centerline of corridor polygon (algo_centerline.find_centerline)
+with skeleton centerline of corridor raster (algo_centerline.find_centerline_skeleton)
+on segments of the test seed lines, for speed and Hausdorff distance between them.
+
+usage:
+    python bench_centerline.py [segment_length=50] [line_radius=15]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_centerline as algo_centerline
+import beratools.core.algo_common as algo_common
+import beratools.core.algo_dijkstra as algo_dijkstra
+import beratools.core.constants as bt_const
+from beratools.tools.common import cut_line_by_length
+
+DATA_DIR = Path(__file__).resolve().parents[1].joinpath("tests/data")
+IN_CHM = DATA_DIR.joinpath("chm.tif").as_posix()
+IN_LINES = DATA_DIR.joinpath("seed_lines.gpkg").as_posix()
+
+
+def segment_corridors(segment_length, line_radius):
+    """Least cost path and corridor raster of seed line segments, same as SeedLine.compute."""
+    lines = gpd.read_file(IN_LINES)
+    corridors = []
+    for line in lines.geometry:
+        for segment in cut_line_by_length(line, segment_length):
+            cost_clip, out_meta = algo_common.clip_cost_raster(IN_CHM, segment, line_radius)
+            lc_path = algo_dijkstra.find_least_cost_path(cost_clip, out_meta, segment)
+            if not lc_path:
+                continue
+
+            cost_window = algo_common.clip_cost_window(cost_clip, out_meta, lc_path, line_radius * 0.9)
+            if cost_window is None:
+                continue
+
+            cost_clip, out_meta = cost_window
+            transform = out_meta["transform"]
+            transformer = rasterio.transform.AffineTransformer(transform)
+            corridor_thresh = algo_common.corridor_raster(
+                cost_clip,
+                out_meta,
+                [transformer.rowcol(*lc_path.coords[0])],
+                [transformer.rowcol(*lc_path.coords[-1])],
+                (transform[0], -transform[4]),
+                bt_const.FP_CORRIDOR_THRESHOLD,
+            )
+            if corridor_thresh is not None:
+                corridors.append((corridor_thresh, transform, lc_path, lines.crs))
+
+    return corridors
+
+
+def voronoi_centerline(corridor_thresh, transform, lc_path, crs):
+    line_gpd = gpd.GeoDataFrame(geometry=[lc_path], crs=crs)
+    poly_gpd = algo_centerline.find_corridor_polygon(corridor_thresh, transform, line_gpd)
+    return algo_centerline.find_centerline(poly_gpd.geometry.iloc[0], lc_path)
+
+
+def skeleton_centerline(corridor_thresh, transform, lc_path, crs):
+    return algo_centerline.find_centerline_skeleton(corridor_thresh, transform, lc_path)
+
+
+def main(segment_length, line_radius):
+    corridors = segment_corridors(segment_length, line_radius)
+    results = {}
+    for name, engine in (("voronoi", voronoi_centerline), ("skeleton", skeleton_centerline)):
+        start = time.perf_counter()
+        results[name] = [engine(*corridor) for corridor in corridors]
+        results[name + "_time"] = time.perf_counter() - start
+
+    hausdorff = []
+    success = {"voronoi": 0, "skeleton": 0}
+    for (voronoi, v_status), (skeleton, s_status) in zip(results["voronoi"], results["skeleton"]):
+        success["voronoi"] += v_status != algo_centerline.CenterlineStatus.FAILED
+        success["skeleton"] += s_status == algo_centerline.CenterlineStatus.SUCCESS
+        if s_status == algo_centerline.CenterlineStatus.SUCCESS and voronoi:
+            hausdorff.append(voronoi.hausdorff_distance(skeleton))
+
+    count = len(corridors)
+    print(f"{count} segments of {segment_length} m, line radius {line_radius} m")
+    print(f"{'engine':>10} {'time (s)':>10} {'ms/line':>8} {'success':>8}")
+    for name in ("voronoi", "skeleton"):
+        elapsed = results[name + "_time"]
+        print(f"{name:>10} {elapsed:>10.3f} {elapsed / count * 1000:>8.1f} {success[name]:>5}/{count}")
+
+    if hausdorff:
+        print(
+            f"Hausdorff distance between engines: mean {np.mean(hausdorff):.2f} m, "
+            f"median {np.median(hausdorff):.2f} m, max {np.max(hausdorff):.2f} m"
+        )
+
+
+if __name__ == "__main__":
+    in_length = 50.0
+    in_radius = 15.0
+    if len(sys.argv) > 1:
+        in_length = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_radius = float(sys.argv[2])
+
+    main(in_length, in_radius)
@@ -0,0 +1,115 @@
+"""
+Benchmark corridor raster search.
+
+Compare full destination search with the bounded search (algo_common.corridor_raster)
+on random line clips of the test CHM, and check that both give the same corridor.
+
+usage:
+    python bench_corridor.py [buffers=15,30,60] [lines=30]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely.geometry as sh_geom
+from rasterio import mask
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_common as algo_common
+import beratools.core.algo_cost as algo_cost
+import beratools.core.constants as bt_const
+
+IN_CHM = Path(__file__).resolve().parents[1].joinpath("tests/data/chm.tif")
+
+
+def random_lines(bounds, count, seed=0):
+    """Create random straight lines inside raster bounds."""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(count):
+        x = rng.uniform(bounds.left + 50, bounds.right - 50)
+        y = rng.uniform(bounds.bottom + 50, bounds.top - 50)
+        angle = rng.uniform(0, 2 * np.pi)
+        length = rng.uniform(30, 150)
+        lines.append(sh_geom.LineString([(x, y), (x + length * np.cos(angle), y + length * np.sin(angle))]))
+
+    return lines
+
+
+def line_corridor_args(dataset, line, buffer):
+    """Clip cost raster around line, return corridor_raster arguments or None."""
+    clip, transform = mask.mask(dataset, [line.buffer(buffer)], crop=True, nodata=np.nan, filled=True)
+    meta = dataset.meta.copy()
+    meta["transform"] = transform
+    cost_clip, _ = algo_cost.cost_raster(np.ma.masked_invalid(clip), meta)
+
+    source = [dataset.index(*line.coords[0], op=round)]
+    destination = [dataset.index(*line.coords[-1], op=round)]
+    origin = dataset.index(transform.c, transform.f)
+    source = [(row - origin[0], col - origin[1]) for row, col in source]
+    destination = [(row - origin[0], col - origin[1]) for row, col in destination]
+    for row, col in source + destination:
+        if not (0 <= row < cost_clip.shape[0] and 0 <= col < cost_clip.shape[1]):
+            return None
+
+    return cost_clip, meta, source, destination, (transform.a, -transform.e)
+
+
+def main(buffers, line_count):
+    print(f"{'buffer':>8} {'lines':>6} {'full (s)':>10} {'bounded (s)':>12} {'speedup':>8} {'identical':>10}")
+    with rasterio.open(IN_CHM) as dataset:
+        lines = random_lines(dataset.bounds, line_count)
+        for buffer in buffers:
+            t_full = 0.0
+            t_bounded = 0.0
+            identical = True
+            count = 0
+            for line in lines:
+                args = line_corridor_args(dataset, line, buffer)
+                if args is None:
+                    continue
+
+                cost_clip, meta, source, destination, cell_size = args
+                results = []
+                for bounded in (False, True):
+                    start = time.perf_counter()
+                    corridor = algo_common.corridor_raster(
+                        cost_clip.copy(),
+                        meta,
+                        source,
+                        destination,
+                        cell_size,
+                        bt_const.FP_CORRIDOR_THRESHOLD,
+                        bounded=bounded,
+                    )
+                    elapsed = time.perf_counter() - start
+                    if bounded:
+                        t_bounded += elapsed
+                    else:
+                        t_full += elapsed
+                    results.append(corridor)
+
+                identical &= np.array_equal(
+                    np.ma.getmaskarray(results[0]), np.ma.getmaskarray(results[1])
+                ) and np.array_equal(results[0].filled(-1), results[1].filled(-1))
+                count += 1
+
+            print(
+                f"{buffer:>8} {count:>6} {t_full:>10.3f} {t_bounded:>12.3f} "
+                f"{t_full / t_bounded:>8.2f} {str(identical):>10}"
+            )
+
+
+if __name__ == "__main__":
+    in_buffers = [15, 30, 60]
+    in_lines = 30
+    if len(sys.argv) > 1:
+        in_buffers = [float(i) for i in sys.argv[1].split(",")]
+    if len(sys.argv) > 2:
+        in_lines = int(sys.argv[2])
+
+    main(in_buffers, in_lines)
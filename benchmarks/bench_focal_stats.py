@@ -0,0 +1,72 @@
+"""
+Benchmark focal statistics used by cost raster.
+
+Compare the vectorized normalized convolution engine (algo_cost.cost_focal_stats)
+with the per-pixel generic_filter implementation (algo_cost.cost_focal_stats_generic).
+
+usage:
+    python bench_focal_stats.py [sizes=64,128,256,512] [repeat=3]
+"""
+
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_cost as algo_cost
+import beratools.core.constants as bt_const
+
+CELL_SIZE = 0.3
+TREE_RADIUS = 2.5
+
+
+def synthetic_canopy(size, seed=0):
+    """Create canopy raster from random CHM with a nodata block."""
+    rng = np.random.default_rng(seed)
+    chm = rng.gamma(2.0, 1.5, (size, size))
+    chm[: size // 8, : size // 4] = bt_const.BT_NODATA
+    chm = np.ma.masked_where(chm == bt_const.BT_NODATA, chm)
+
+    return algo_cost.dyn_np_cc_map(chm, bt_const.FP_CORRIDOR_THRESHOLD)
+
+
+def best_time(func, repeat, *args):
+    elapsed = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed), result
+
+
+def main(sizes, repeat):
+    warnings.simplefilter("ignore", category=RuntimeWarning)  # all-NaN slices in generic_filter
+    kernel_radius = int(TREE_RADIUS / CELL_SIZE)
+    kernel = algo_cost.circle_kernel_refactor(2 * kernel_radius + 1, kernel_radius)
+
+    print(f"{'clip size':>10} {'generic (s)':>12} {'vectorized (s)':>15} {'speedup':>8} {'max diff':>10}")
+    for size in sizes:
+        canopy = synthetic_canopy(size)
+        t_generic, (std_1, mean_1) = best_time(algo_cost.cost_focal_stats_generic, repeat, canopy, kernel)
+        t_vector, (std_2, mean_2) = best_time(algo_cost.cost_focal_stats, repeat, canopy, kernel)
+        max_diff = max(np.nanmax(np.abs(std_1 - std_2)), np.nanmax(np.abs(mean_1 - mean_2)))
+        print(
+            f"{size:>10} {t_generic:>12.4f} {t_vector:>15.4f} {t_generic / t_vector:>8.1f} {max_diff:>10.2e}"
+        )
+
+
+if __name__ == "__main__":
+    in_sizes = [64, 128, 256, 512]
+    in_repeat = 3
+    if len(sys.argv) > 1:
+        in_sizes = [int(i) for i in sys.argv[1].split(",")]
+    if len(sys.argv) > 2:
+        in_repeat = int(sys.argv[2])
+
+    main(in_sizes, in_repeat)
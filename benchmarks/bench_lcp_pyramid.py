@@ -0,0 +1,98 @@
+"""
+Benchmark coarse to fine least cost path.
+
+Compare algo_dijkstra.route_through_pyramid with full resolution route_through_array
+on long lines of the test CHM with a wide clip, for several downsample factors and
+band widths. Deviation of the pyramid path is reported by pyramid_path_deviation.
+
+usage:
+    python bench_lcp_pyramid.py [lines=8] [line_radius=40] [bands=1,2,4]
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely.geometry as sh_geom
+from rasterio import mask
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_cost as algo_cost
+import beratools.core.algo_dijkstra as algo_dijkstra
+import beratools.core.constants as bt_const
+
+IN_CHM = Path(__file__).resolve().parents[1].joinpath("tests/data/chm.tif")
+LINE_LENGTH = 105
+PYRAMID_FACTORS = [(2,), (4,), (8,), (8, 4, 2)]
+
+
+def line_cost_matrices(line_count, line_radius, seed=0):
+    """Cost matrices and end cells of random diagonal lines, prepared as find_least_cost_path."""
+    rng = np.random.default_rng(seed)
+    cases = []
+    with rasterio.open(IN_CHM) as dataset:
+        bounds = dataset.bounds
+        while len(cases) < line_count:
+            x = rng.uniform(bounds.left + 30, bounds.right - 30 - LINE_LENGTH)
+            y = rng.uniform(bounds.bottom + 30, bounds.top - 30 - LINE_LENGTH)
+            angle = rng.uniform(0, np.pi / 2)
+            line = sh_geom.LineString(
+                [(x, y), (x + LINE_LENGTH * np.cos(angle), y + LINE_LENGTH * np.sin(angle))]
+            )
+
+            clip, transform = mask.mask(dataset, [line.buffer(line_radius)], crop=True, nodata=np.nan)
+            meta = dataset.meta.copy()
+            meta["transform"] = transform
+            cost_clip, _ = algo_cost.cost_raster(np.ma.masked_invalid(clip), meta)
+
+            transformer = rasterio.transform.AffineTransformer(transform)
+            start = transformer.rowcol(*line.coords[0])
+            end = transformer.rowcol(*line.coords[-1])
+            rows, cols = cost_clip.shape
+            if not all(0 <= row < rows and 0 <= col < cols for row, col in (start, end)):
+                continue
+
+            matrix, _ = algo_dijkstra.MinCostPathHelper.block2matrix_numpy(cost_clip, bt_const.BT_NODATA)
+            matrix[start] = 0
+            matrix[end] = 0
+            cases.append((matrix, start, end, transform.a))
+
+    return cases
+
+
+def main(line_count, line_radius, bands):
+    cases = line_cost_matrices(line_count, line_radius)
+    print(f"{line_count} lines, mean clip size {np.mean([case[0].size for case in cases]):.0f} cells")
+    print(
+        f"{'factors':>10} {'band':>5} {'speedup':>8} {'cost +%':>8} {'max +%':>8} "
+        f"{'hausdorff':>10} {'mean dist':>10}"
+    )
+    for factors in PYRAMID_FACTORS:
+        for band in bands:
+            reports = [
+                algo_dijkstra.pyramid_path_deviation(matrix, start, end, factors, band, cell_size)
+                for matrix, start, end, cell_size in cases
+            ]
+            speedup = sum(i["exact_time"] for i in reports) / sum(i["pyramid_time"] for i in reports)
+            cost_increase = [i["cost_increase"] * 100 for i in reports]
+            print(
+                f"{str(factors):>10} {band:>5} {speedup:>8.2f} {np.mean(cost_increase):>8.2f} "
+                f"{np.max(cost_increase):>8.2f} {np.mean([i['hausdorff'] for i in reports]):>10.2f} "
+                f"{np.mean([i['mean_distance'] for i in reports]):>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    in_lines = 8
+    in_radius = 40.0
+    in_bands = [1, 2, 4]
+    if len(sys.argv) > 1:
+        in_lines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_radius = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        in_bands = [int(i) for i in sys.argv[3].split(",")]
+
+    main(in_lines, in_radius, in_bands)
@@ -0,0 +1,85 @@
+"""
+Benchmark least cost path engines.
+
+Run algo_dijkstra.find_least_cost_path with skimage route_through_array, the pure
+Python dijkstra and the heap based A* engine on cost clips of random lines of the
+test CHM, and compare the least cost paths with the skimage ones.
+
+usage:
+    python bench_least_cost_path.py [lines=20] [length=60]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely.geometry as sh_geom
+from rasterio import mask
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_cost as algo_cost
+import beratools.core.algo_dijkstra as algo_dijkstra
+import beratools.core.constants as bt_const
+
+IN_CHM = Path(__file__).resolve().parents[1].joinpath("tests/data/chm.tif")
+LINE_BUFFER = 15
+
+
+def random_lines(bounds, count, length, seed=0):
+    """Create random straight lines inside raster bounds."""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(count):
+        x = rng.uniform(bounds.left + length, bounds.right - length)
+        y = rng.uniform(bounds.bottom + length, bounds.top - length)
+        angle = rng.uniform(0, 2 * np.pi)
+        lines.append(sh_geom.LineString([(x, y), (x + length * np.cos(angle), y + length * np.sin(angle))]))
+
+    return lines
+
+
+def main(line_count, length):
+    engines = list(bt_const.LeastCostPathEngine)
+    elapsed = {engine: 0.0 for engine in engines}
+    same_path = {engine: 0 for engine in engines}
+
+    with rasterio.open(IN_CHM) as dataset:
+        for line in random_lines(dataset.bounds, line_count, length):
+            clip, transform = mask.mask(dataset, [line.buffer(LINE_BUFFER)], crop=True, nodata=np.nan)
+            meta = dataset.meta.copy()
+            meta.update({"transform": transform, "nodata": bt_const.BT_NODATA})
+            cost_clip, _ = algo_cost.cost_raster(np.ma.masked_invalid(clip), meta)
+
+            paths = {}
+            for engine in engines:
+                start = time.perf_counter()
+                paths[engine] = algo_dijkstra.find_least_cost_path(
+                    cost_clip.copy(), meta, line, engine=engine
+                )
+                elapsed[engine] += time.perf_counter() - start
+
+            for engine in engines:
+                if paths[engine] and paths[engine].equals(paths[bt_const.LeastCostPathEngine.SKIMAGE]):
+                    same_path[engine] += 1
+
+    print(f"{'engine':>10} {'time (s)':>10} {'vs skimage':>11} {'same path':>10}")
+    skimage_time = elapsed[bt_const.LeastCostPathEngine.SKIMAGE]
+    for engine in engines:
+        print(
+            f"{engine.name:>10} {elapsed[engine]:>10.3f} {elapsed[engine] / skimage_time:>10.1f}x "
+            f"{same_path[engine]:>6}/{line_count}"
+        )
+
+
+if __name__ == "__main__":
+    in_lines = 20
+    in_length = 60.0
+    if len(sys.argv) > 1:
+        in_lines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_length = float(sys.argv[2])
+
+    main(in_lines, in_length)
@@ -0,0 +1,77 @@
+"""
+Benchmark cost aware load balancing.
+
+Run synthetic tasks with heavy tailed line lengths, each task sleeps for time
+proportional to cells in buffer of its line, so scheduling is measured without
+competing for CPU cores. Longest lines are at the end of
+input, as when lines are sorted by id. Compare execute_multiprocessing without
+cost estimator (input order, one item per chunk) and with estimate_line_cost
+(longest first, chunks sized by remaining cost), and report wall time and
+idle time of workers waiting for the last tasks.
+
+usage:
+    python bench_load_balance.py [lines=1000] [processes=8] [us_per_cell=2]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import shapely.geometry as sh_geom
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.constants as bt_const
+from beratools.core.tool_base import estimate_line_cost, execute_multiprocessing
+
+
+def heavy_tailed_lines(count, seed=0):
+    """Create lines with lognormal lengths, sorted by length so longest lines come last."""
+    rng = np.random.default_rng(seed)
+    lengths = np.sort(rng.lognormal(mean=4.0, sigma=1.5, size=count))
+    return [sh_geom.LineString([(i * 10, 0), (i * 10, length)]) for i, length in enumerate(lengths)]
+
+
+def sleep_line(line, us_per_cell):
+    """Sleep for time proportional to cells in buffer of line."""
+    time.sleep(estimate_line_cost(line) * us_per_cell * 1e-6)
+    return line.length
+
+
+def main(line_count, processes, us_per_cell):
+    lines = heavy_tailed_lines(line_count)
+    costs = np.array([estimate_line_cost(line) for line in lines])
+    print(f"{line_count} lines, {processes} processes")
+    seconds = costs * us_per_cell * 1e-6
+    print(f"Work {seconds.sum():.1f} s, longest task {seconds.max():.2f} s")
+
+    cases = {"input order": None, "longest first": estimate_line_cost}
+    for name, cost_estimator in cases.items():
+        print(f"--- {name}")
+        start = time.perf_counter()
+        execute_multiprocessing(
+            sleep_line,
+            lines,
+            "Bench",
+            processes,
+            mode=bt_const.ParallelMode.MULTIPROCESSING,
+            verbose=False,
+            shared_args={"us_per_cell": us_per_cell},
+            cost_estimator=cost_estimator,
+        )
+        print(f"Wall time {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    in_lines = 1000
+    in_processes = 8
+    in_us_per_cell = 2.0
+    if len(sys.argv) > 1:
+        in_lines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_processes = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        in_us_per_cell = float(sys.argv[3])
+
+    main(in_lines, in_processes, in_us_per_cell)
@@ -0,0 +1,98 @@
+"""
+Benchmark parallel offset lines of canopy threshold relative.
+
+Offset left and right copies of the test lines repeated n times by the former
+per-row approach, which sends whole dfL and dfR to a process pool for each
+row and concatenates single row results, and by copyparallel_lineLRC, which
+offsets all lines by vectorized shapely.offset_curve in main process.
+Check both give the same lines and report time.
+
+usage:
+    python bench_parallel_offset.py [processes=4] [repeat=50]
+"""
+
+import sys
+import time
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+from beratools.core.canopy_threshold_relative import copyparallel_lineLRC
+
+DATA_DIR = Path(__file__).resolve().parents[1].joinpath("tests/data")
+IN_LINES = DATA_DIR.joinpath("seed_lines.gpkg").as_posix()
+LEFT_DIST = 10.0
+RIGHT_DIST = 10.0
+
+
+def offset_row(line_arg):
+    """Offset one row of dfL and dfR, same as the former per-row worker."""
+    dfL, dfR, left_dist, right_dist, item = line_arg
+    if not dfL.loc[item, "geometry"]:
+        return None
+
+    lineL = dfL.loc[item, "geometry"].simplify(tolerance=0.05, preserve_topology=True)
+    lineR = dfR.loc[item, "geometry"].simplify(tolerance=0.05, preserve_topology=True)
+    parallel_lineL = lineL.parallel_offset(
+        distance=left_dist, side="left", join_style=shapely.BufferJoinStyle.mitre
+    )
+    parallel_lineR = lineR.parallel_offset(
+        distance=-right_dist, side="right", join_style=shapely.BufferJoinStyle.mitre
+    )
+
+    if not parallel_lineL.is_empty:
+        dfL.loc[item, "geometry"] = parallel_lineL
+    if not parallel_lineR.is_empty:
+        dfR.loc[item, "geometry"] = parallel_lineR
+
+    return dfL.iloc[[item]], dfR.iloc[[item]]
+
+
+def offset_per_row(dfL, dfR, processes):
+    line_arg = [[dfL, dfR, LEFT_DIST, RIGHT_DIST, item] for item in dfL.index]
+    featuresL = []
+    featuresR = []
+    with Pool(processes=processes) as pool:
+        for result in pool.imap_unordered(offset_row, line_arg):
+            if result:
+                featuresL.append(result[0])
+                featuresR.append(result[1])
+
+    return gpd.GeoDataFrame(pd.concat(featuresL)), gpd.GeoDataFrame(pd.concat(featuresR))
+
+
+def main(processes, repeat):
+    lines = gpd.read_file(IN_LINES).explode(ignore_index=True)
+    lines = gpd.GeoDataFrame(pd.concat([lines] * repeat, ignore_index=True), crs=lines.crs)
+    lines.geometry = lines.geometry.simplify(tolerance=0.5, preserve_topology=True)
+
+    start = time.perf_counter()
+    rowL, rowR = offset_per_row(lines.copy(), lines.copy(), processes)
+    row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vecL, vecR = copyparallel_lineLRC(lines.copy(), lines.copy(), LEFT_DIST, RIGHT_DIST)
+    vec_time = time.perf_counter() - start
+
+    for row_df, vec_df in ((rowL, vecL), (rowR, vecR)):
+        assert shapely.equals_exact(row_df.sort_index().geometry.values, vec_df.geometry.values, 0).all()
+
+    print(f"{'method':>12} {'lines':>6} {'time (s)':>9}")
+    print(f"{'per row':>12} {len(lines):>6} {row_time:>9.3f}")
+    print(f"{'vectorized':>12} {len(lines):>6} {vec_time:>9.3f}")
+
+
+if __name__ == "__main__":
+    in_processes = 4
+    in_repeat = 50
+    if len(sys.argv) > 1:
+        in_processes = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_repeat = int(sys.argv[2])
+
+    main(in_processes, in_repeat)
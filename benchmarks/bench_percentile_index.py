@@ -0,0 +1,104 @@
+"""
+Benchmark approximate zonal percentiles from CHM percentile index.
+
+Write synthetic tiled CHM of size x size cells, build its percentile index
+and compute median of circular zones of increasing radius, exactly from
+raster reads and approximately from block histograms of index. Report
+index build time and size, time of both and max error of approximate
+percentiles.
+
+usage:
+    python bench_percentile_index.py [size=8000] [error=0.05] [block_size=16]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.utility.percentile_index as pct_index
+import beratools.utility.spatial_common as sp_common
+
+CELL_SIZE = 0.5
+ZONE_COUNT = 20
+ZONE_RADII = (5, 25, 100, 400)
+
+
+def write_chm(out_file, size):
+    """Write smooth random heights in range of 0-30 with nodata holes."""
+    rng = np.random.default_rng(0)
+    coarse = rng.random((size // 64 + 2, size // 64 + 2)) * 30
+    heights = np.kron(coarse, np.ones((64, 64)))[:size, :size]
+    heights = (heights + rng.normal(0, 2, (size, size))).clip(0).astype(np.float32)
+    heights[rng.random((size, size)) < 0.01] = np.nan
+
+    meta = {
+        "driver": "GTiff",
+        "height": size,
+        "width": size,
+        "count": 1,
+        "dtype": "float32",
+        "nodata": np.nan,
+        "transform": from_origin(0, size * CELL_SIZE, CELL_SIZE, CELL_SIZE),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+    }
+    with rasterio.open(out_file, "w", **meta) as dst:
+        dst.write(heights, 1)
+
+
+def main(size, error, block_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_chm = Path(tmp_dir).joinpath("chm.tif").as_posix()
+        write_chm(in_chm, size)
+
+        start = time.perf_counter()
+        pct_index.PercentileIndex.build(in_chm, error, block_size).save(in_chm)
+        elapsed = time.perf_counter() - start
+        index = pct_index.PercentileIndex.load(in_chm, error)
+        index_mb = sum(item.stat().st_size for item in pct_index.index_dir(in_chm).iterdir()) / 1024**2
+        raster_mb = Path(in_chm).stat().st_size / 1024**2
+        print(f"index built in {elapsed:.2f} s, {index_mb:.1f} MB of {raster_mb:.1f} MB raster")
+
+        rng = np.random.default_rng(1)
+        extent = size * CELL_SIZE
+        print(f"{'radius':>7} {'exact (s)':>10} {'approx (s)':>11} {'max error':>10}")
+        for radius in ZONE_RADII:
+            centers = rng.uniform(radius, extent - radius, (ZONE_COUNT, 2))
+            zones = shapely.buffer(shapely.points(centers), radius)
+
+            start = time.perf_counter()
+            exact = [sp_common.zonal_percentiles(in_chm, [zone], 50, use_cache=False)[0] for zone in zones]
+            exact_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            approx = [
+                sp_common.zonal_percentiles(in_chm, [zone], 50, use_cache=False, index=index)[0]
+                for zone in zones
+            ]
+            approx_time = time.perf_counter() - start
+
+            max_error = np.nanmax(np.abs(np.concatenate(exact) - np.concatenate(approx)))
+            print(f"{radius:>7} {exact_time:>10.3f} {approx_time:>11.3f} {max_error:>10.4f}")
+
+
+if __name__ == "__main__":
+    in_size = 8000
+    in_error = 0.05
+    in_block_size = 16
+    if len(sys.argv) > 1:
+        in_size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_error = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        in_block_size = int(sys.argv[3])
+
+    main(in_size, in_error, in_block_size)
@@ -0,0 +1,72 @@
+"""
+Benchmark streaming result writer.
+
+Write synthetic corridor polygon results of execute_multiprocessing to GeoPackage,
+collected in memory and written at the end as tools do, or streamed in batches
+by ResultWriter, and compare peak Python memory (tracemalloc) and time.
+
+usage:
+    python bench_result_writer.py [lines=1000,4000] [batch_size=1000]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import shapely.geometry as sh_geom
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.constants as bt_const
+from beratools.core.tool_base import execute_multiprocessing
+from beratools.utility.result_writer import ResultWriter
+
+
+def corridor_result(i):
+    """Corridor polygon of one line, about the size of a 50 m segment."""
+    line = sh_geom.LineString([(i * 100, 0), (i * 100 + 50, 50)])
+    return gpd.GeoDataFrame({"line_id": [i]}, geometry=[line.buffer(10, quad_segs=64)], crs=2956)
+
+
+def in_memory(lines, out_file, batch_size):
+    result = execute_multiprocessing(
+        corridor_result, lines, "Bench", 1, mode=bt_const.ParallelMode.SEQUENTIAL, verbose=True
+    )
+    pd.concat(result, ignore_index=True).to_file(out_file, layer="corridor_polygon")
+
+
+def streaming(lines, out_file, batch_size):
+    writer = ResultWriter(lambda gdf: {(out_file, "corridor_polygon"): gdf}, batch_size)
+    execute_multiprocessing(
+        corridor_result, lines, "Bench", 1, mode=bt_const.ParallelMode.SEQUENTIAL, verbose=True, sink=writer
+    )
+
+
+def main(line_counts, batch_size):
+    print(f"{'lines':>8} {'mode':>10} {'time (s)':>10} {'peak (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in line_counts:
+            for name, func in (("in_memory", in_memory), ("streaming", streaming)):
+                out_file = Path(tmp_dir).joinpath(f"{name}_{count}.gpkg").as_posix()
+                tracemalloc.start()
+                start = time.perf_counter()
+                func(list(range(count)), out_file, batch_size)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"{count:>8} {name:>10} {elapsed:>10.2f} {peak / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    in_counts = [1000, 4000]
+    in_batch_size = bt_const.RESULT_BATCH_SIZE
+    if len(sys.argv) > 1:
+        in_counts = [int(i) for i in sys.argv[1].split(",")]
+    if len(sys.argv) > 2:
+        in_batch_size = int(sys.argv[2])
+
+    main(in_counts, in_batch_size)
@@ -0,0 +1,125 @@
+"""
+Benchmark spatially ordered task scheduling.
+
+Build a large tiled CHM by repeating the test CHM, and a shuffled set of random
+lines over it. Clip CHM around each line by execute_multiprocessing in input
+order and along Z-order and Hilbert curves, and compare time and raster blocks
+read by the worker block caches.
+
+usage:
+    python bench_spatial_order.py [lines=20000] [processes=4] [tiles=6] [cache_mb=32]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely.geometry as sh_geom
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.constants as bt_const
+import beratools.utility.raster_cache as raster_cache
+import beratools.utility.spatial_common as sp_common
+from beratools.core.tool_base import execute_multiprocessing
+
+IN_CHM = Path(__file__).resolve().parents[1].joinpath("tests/data/chm.tif")
+LINE_LENGTH = 50
+LINE_RADIUS = 15
+
+
+def tiled_chm(out_file, tiles):
+    """Repeat test CHM tiles x tiles times into tiled GeoTIFF."""
+    with rasterio.open(IN_CHM) as src:
+        data = src.read(1)
+        meta = src.meta.copy()
+        transform = src.transform
+
+    meta.update(
+        width=data.shape[1] * tiles,
+        height=data.shape[0] * tiles,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    )
+    with rasterio.open(out_file, "w", **meta) as dst:
+        dst.write(np.tile(data, (tiles, tiles)), 1)
+
+    return rasterio.transform.array_bounds(meta["height"], meta["width"], transform)
+
+
+def random_lines(bounds, count, seed=0):
+    """Create shuffled random lines inside bounds (west, south, east, north)."""
+    rng = np.random.default_rng(seed)
+    west, south, east, north = bounds
+    margin = LINE_LENGTH + LINE_RADIUS
+    x = rng.uniform(west + margin, east - margin, count)
+    y = rng.uniform(south + margin, north - margin, count)
+    angle = rng.uniform(0, 2 * np.pi, count)
+    return [
+        sh_geom.LineString([(x0, y0), (x0 + LINE_LENGTH * np.cos(a), y0 + LINE_LENGTH * np.sin(a))])
+        for x0, y0, a in zip(x, y, angle)
+    ]
+
+
+def clip_line(line, in_raster, cache_mb):
+    """Clip raster around line, return worker pid and its cache counters."""
+    raster_cache.set_raster_cache_budget(cache_mb)
+    sp_common.clip_raster(in_raster, line, LINE_RADIUS)
+    stats = raster_cache.raster_cache_stats()
+    return os.getpid(), stats["hits"], stats["misses"]
+
+
+def main(line_count, processes, tiles, cache_mb):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chm_file = Path(tmp_dir).joinpath("chm_tiled.tif").as_posix()
+        bounds = tiled_chm(chm_file, tiles)
+        lines = random_lines(bounds, line_count)
+        print(f"{line_count} lines, {processes} processes, {tiles}x{tiles} test CHM tiles")
+        print(f"Raster block cache {cache_mb} MB per worker")
+        print(f"{'order':>8} {'time (s)':>9} {'blocks read':>12} {'hit rate':>9}")
+
+        for order in bt_const.SpatialOrder:
+            start = time.perf_counter()
+            result = execute_multiprocessing(
+                clip_line,
+                lines,
+                "Bench",
+                processes,
+                mode=bt_const.ParallelMode.MULTIPROCESSING,
+                verbose=True,
+                shared_args={"in_raster": chm_file, "cache_mb": cache_mb},
+                order=order,
+            )
+            elapsed = time.perf_counter() - start
+
+            # counters are cumulative in each worker, keep the last of each pid
+            workers = {}
+            for pid, hits, misses in result:
+                if pid not in workers or hits + misses > sum(workers[pid]):
+                    workers[pid] = (hits, misses)
+            hits = sum(item[0] for item in workers.values())
+            misses = sum(item[1] for item in workers.values())
+            print(f"{order.name:>8} {elapsed:>9.2f} {misses:>12} {hits / (hits + misses):>9.1%}")
+
+
+if __name__ == "__main__":
+    in_lines = 20000
+    in_processes = 4
+    in_tiles = 6
+    in_cache_mb = 32
+    if len(sys.argv) > 1:
+        in_lines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_processes = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        in_tiles = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        in_cache_mb = float(sys.argv[4])
+
+    main(in_lines, in_processes, in_tiles, in_cache_mb)
@@ -0,0 +1,72 @@
+"""
+Benchmark task payload of centerline tool.
+
+Run centerline SeedLines on the test data with raster and parameters carried by
+each SeedLine (per task pickling), and with line only SeedLines and raster and
+parameters sent once per worker by Pool initializer. Report pickled bytes per
+task and per worker, and time.
+
+usage:
+    python bench_task_payload.py [processes=4] [repeat=10]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(Path(__file__).resolve().parents[1].as_posix())
+
+import beratools.core.algo_centerline as algo_centerline
+import beratools.core.algo_common as algo_common
+import beratools.core.constants as bt_const
+import beratools.core.tool_base as bt_base
+from beratools.tools.centerline import process_single_line_class
+
+DATA_DIR = Path(__file__).resolve().parents[1].joinpath("tests/data")
+IN_CHM = DATA_DIR.joinpath("chm.tif").as_posix()
+IN_LINES = DATA_DIR.joinpath("seed_lines.gpkg").as_posix()
+LINE_RADIUS = 15.0
+
+
+def main(processes, repeat):
+    line_table = algo_common.prepare_line_table(IN_LINES, None, True)
+    line_list = [(i, line_table.line_coords(i)) for i in range(len(line_table))] * repeat
+    cases = {
+        "per task": (
+            [algo_centerline.SeedLine(i, coords, IN_CHM, LINE_RADIUS) for i, coords in line_list],
+            None,
+        ),
+        "per worker": (
+            [algo_centerline.SeedLine(i, coords) for i, coords in line_list],
+            {"in_raster": IN_CHM, "line_radius": LINE_RADIUS, "cost_file": None},
+        ),
+    }
+
+    print(f"{'context':>12} {'tasks':>6} {'B/task':>8} {'B/worker':>9} {'time (s)':>9}")
+    for name, (line_classes, shared_args) in cases.items():
+        task_bytes, worker_bytes = bt_base.task_payload_size(
+            process_single_line_class, line_classes, shared_args
+        )
+        start = time.perf_counter()
+        bt_base.execute_multiprocessing(
+            process_single_line_class,
+            line_classes,
+            "Bench",
+            processes,
+            mode=bt_const.ParallelMode.MULTIPROCESSING,
+            verbose=True,
+            shared_args=shared_args,
+        )
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12} {len(line_classes):>6} {task_bytes:>8.0f} {worker_bytes:>9.0f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    in_processes = 4
+    in_repeat = 10
+    if len(sys.argv) > 1:
+        in_processes = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        in_repeat = int(sys.argv[2])
+
+    main(in_processes, in_repeat)
@@ -14,7 +14,6 @@ Description:
     The tool is used to generate the footprint of a line based on relative threshold.
 """
 
-import math
 import time
 from enum import Enum
 
@@ -22,7 +21,6 @@ import geopandas as gpd
 import numpy as np
 import pandas as pd
 import rasterio.features as ras_feat
-import shapely
 import shapely.geometry as sh_geom
 import shapely.ops as sh_ops
 from skimage.graph import MCP_Flexible
@@ -32,6 +30,7 @@ import beratools.core.algo_cost as algo_cost
 import beratools.core.constants as bt_const
 import beratools.core.tool_base as bt_base
 import beratools.tools.common as bt_common
+import beratools.utility.percentile_index as pct_index
 import beratools.utility.spatial_common as sp_common
 
 
@@ -47,47 +46,56 @@ class FootprintCanopy:
 
     def __init__(self, in_geom, in_chm, in_layer=None):
         data = gpd.read_file(in_geom, layer=in_layer)
+        self.data = data
+        self.in_chm = in_chm
         self.lines = []
 
-        for idx in data.index:
-            line = LineInfo(data.iloc[[idx]], in_chm)
+        # rings of all lines are built in one pass
+        line_simp = data.geometry.simplify(tolerance=0.5, preserve_topology=True)
+        rings = algo_common.ring_buffer_table(line_simp.values)
+        bounds = np.searchsorted(rings["line"].to_numpy(), np.arange(len(data) + 1))
+        ring_geoms = rings.geometry.to_numpy()
+        ring_sides = rings["side"].to_numpy()
+
+        for i, idx in enumerate(data.index):
+            line = LineInfo(data.iloc[[idx]])
+            ring_slice = slice(bounds[i], bounds[i + 1])
+            line.set_buffer_rings(ring_geoms[ring_slice], ring_sides[ring_slice])
             self.lines.append(line)
 
     def compute(self, processes, parallel_mode=bt_const.ParallelMode.MULTIPROCESSING):
+        if self.lines:
+            pct_index.open_percentile_index(self.in_chm, build=True)
+
         result = bt_base.execute_multiprocessing(
-            algo_common.process_single_item,
+            process_line_info,
             self.lines,
             "Canopy Footprint",
             processes,
             parallel_mode,
+            shared_args={"in_chm": self.in_chm},
         )
 
-        fp = []
-        percentile = []
         try:
             for item in result:
-                if item.footprint is not None:
-                    fp.append(item.footprint)
-                else:
+                if "footprint" not in item.layers:
                     print("Footprint is None for one of the lines.")
-                    continue  # Skip failed line
 
-            if fp:
-                self.footprints = pd.concat(fp)
+            indices, geoms, columns = bt_base.record_rows(result, "footprint")
+            if len(geoms) > 0:
+                self.footprints = gpd.GeoDataFrame(columns, geometry=list(geoms), crs=self.data.crs)
+                if bt_const.BT_GROUP in self.data.columns:
+                    self.footprints[bt_const.BT_GROUP] = self.data[bt_const.BT_GROUP].loc[indices].to_numpy()
             else:
                 print("No valid footprints to save.")
                 self.footprints = None
 
             for item in result:
-                if item.lines_percentile is not None:
-                    percentile.append(item.lines_percentile)
-                else:
+                if "percentile" not in item.layers:
                     print("lines_percentile is None for one of the lines.")
-                    continue  # Skip failed line
 
-            if percentile:
-                self.lines_percentile = pd.concat(percentile)
-            else:
+            self.lines_percentile = bt_base.records_to_gdf(result, "percentile", crs=self.data.crs)
+            if self.lines_percentile.empty:
                 print("No valid lines_percentile to save.")
                 self.lines_percentile = None
         except Exception as e:
@@ -109,6 +117,8 @@ class FootprintCanopy:
 class BufferRing:
     """Buffer ring class."""
 
+    __slots__ = ("geometry", "side", "percentile", "Dyn_Canopy_Threshold")
+
     def __init__(self, ring_poly, side):
         self.geometry = ring_poly
         self.side = side
@@ -117,22 +127,28 @@ class BufferRing:
 
 
 class LineInfo:
-    """Class to store line information."""
-
-    def __init__(
-        self,
-        line_gdf,
-        in_chm,
-        max_ln_width=32,
-        tree_radius=1.5,
-        max_line_dist=1.5,
-        canopy_avoidance=0.0,
-        exponent=1.0,
-        canopy_thresh_percentage=50,
-    ):
+    """
+    Class to store line information.
+
+    CHM and cost parameters are shared by all lines, class defaults are used
+    until set_context sets them, so they are not sent to workers with each line.
+    """
+
+    in_chm = None
+    max_ln_width = 32
+    tree_radius = 1.5
+    max_line_dist = 1.5
+    canopy_avoidance = 0.0
+    exponent = 1.0
+    canopy_thresh_percentage = 50
+    nodata = -9999
+
+    def __init__(self, line_gdf, in_chm=None, **context):
         self.line = line_gdf
-        self.in_chm = in_chm
+        self.index = line_gdf.index[0]
         self.line_simp = self.line.geometry.simplify(tolerance=0.5, preserve_topology=True)
+        if in_chm is not None:
+            self.set_context(in_chm, **context)
 
         self.canopy_percentile = 50
         self.DynCanTh = np.nan
@@ -144,38 +160,36 @@ class LineInfo:
         self.RDist_Cut = np.nan
         self.LDist_Cut = np.nan
 
-        self.canopy_thresh_percentage = canopy_thresh_percentage
-        self.canopy_avoidance = canopy_avoidance
-        self.exponent = exponent
-        self.max_ln_width = max_ln_width
-        self.max_line_dist = max_line_dist
-        self.tree_radius = tree_radius
-
-        self.nodata = -9999
-        self.dyn_canopy_ndarray = None
-        self.negative_cost_clip = None
-        self.out_meta = None
-
         self.buffer_left = None
         self.buffer_right = None
         self.footprint = None
 
         self.lines_percentile = None
 
-    def compute(self):
-        self.prepare_ring_buffer()
+    def set_context(
+        self,
+        in_chm,
+        max_ln_width=32,
+        tree_radius=1.5,
+        max_line_dist=1.5,
+        canopy_avoidance=0.0,
+        exponent=1.0,
+        canopy_thresh_percentage=50,
+    ):
+        """Set CHM and parameters shared by all lines, in worker when sent once per worker."""
+        self.in_chm = in_chm
+        self.max_ln_width = max_ln_width
+        self.tree_radius = tree_radius
+        self.max_line_dist = max_line_dist
+        self.canopy_avoidance = canopy_avoidance
+        self.exponent = exponent
+        self.canopy_thresh_percentage = canopy_thresh_percentage
 
-        ring_list = []
-        for item in self.buffer_rings:
-            ring = self.cal_percentileRing(item)
-            if ring is not None:
-                ring_list.append(ring)
-            else:
-                # print("Skipping invalid ring.")
-                # TODO: handle None rings appropriately
-                pass
+    def compute(self):
+        if not self.buffer_rings:
+            self.prepare_ring_buffer()
 
-        self.buffer_rings = ring_list
+        self.cal_percentile_rings()
 
         # Aggregate percentiles and geometries for lines_percentile
         percentile_records = []
@@ -235,53 +249,69 @@ class LineInfo:
             self.footprint = None
             return
 
-        # Transfer group value to footprint if present
-        if bt_const.BT_GROUP in self.line.columns:
-            self.footprint[bt_const.BT_GROUP] = self.line[bt_const.BT_GROUP].iloc[0]
+    def to_record(self):
+        """Return ResultRecord of footprint and ring percentiles, with cut heights and distances of line."""
+        record = bt_base.ResultRecord(
+            self.index,
+            attributes={
+                "CL_CutHt": self.CL_CutHt,
+                "CR_CutHt": self.CR_CutHt,
+                "RDist_Cut": self.RDist_Cut,
+                "LDist_Cut": self.LDist_Cut,
+                "DynCanTh": self.DynCanTh,
+            },
+        )
+        if self.footprint is not None:
+            record.add_rows(
+                "footprint", self.footprint.geometry, CorriThresh=self.footprint["CorriThresh"].tolist()
+            )
+
+        if self.lines_percentile is not None:
+            record.add_rows(
+                "percentile",
+                self.lines_percentile.geometry,
+                percentile=list(self.lines_percentile["percentile"].to_numpy()),
+                side=self.lines_percentile["side"].tolist(),
+            )
+
+        return record
+
+    def set_buffer_rings(self, geoms, sides):
+        """Set buffer rings of line from ring geometries and their side values."""
+        self.buffer_rings = [BufferRing(geom, Side(side)) for geom, side in zip(geoms, sides)]
 
     def prepare_ring_buffer(self):
-        nrings = 1
-        ringdist = 15
-        ring_list = self.multi_ring_buffer(self.line_simp, nrings, ringdist)
-        for i in ring_list:
-            if BufferRing(i, Side.left):
-                self.buffer_rings.append(BufferRing(i, Side.left))
-            else:
-                print("Empty buffer ring")
-
-        nrings = -1
-        ringdist = -15
-        ring_list = self.multi_ring_buffer(self.line_simp, nrings, ringdist)
-        for i in ring_list:
-            if BufferRing(i, Side.right):
-                self.buffer_rings.append(BufferRing(i, Side.right))
-            else:
-                print("Empty buffer ring")
+        """Build buffer rings of line when they are not set by FootprintCanopy."""
+        rings = algo_common.ring_buffer_table(self.line_simp.values)
+        self.set_buffer_rings(rings.geometry.to_numpy(), rings["side"].to_numpy())
 
-    def cal_percentileRing(self, ring):
-        line_buffer = None
-        try:
-            line_buffer = ring.geometry
-            if line_buffer.is_empty or shapely.is_missing(line_buffer):
-                return None
-            if line_buffer.has_z:
-                line_buffer = sh_ops.transform(lambda x, y, z=None: (x, y), line_buffer)
+    def cal_percentile_rings(self):
+        """
+        Calculate CHM percentile of all buffer rings from one raster window read, skip empty rings.
 
-        except Exception as e:
-            print(f"cal_percentileRing: {e}")
-            return None
+        Percentiles are approximate when bt_const.PERCENTILE_INDEX_ERROR is set,
+        see beratools.utility.percentile_index.
+        """
+        self.buffer_rings = [
+            ring for ring in self.buffer_rings if ring.geometry is not None and not ring.geometry.is_empty
+        ]
 
-        # TODO: temporary workaround for exception causing not percentile defined
         try:
-            clipped_raster, _ = sp_common.clip_raster(self.in_chm, line_buffer, 0)
-            clipped_raster = np.squeeze(clipped_raster, axis=0)
-
-            # mask all -9999 (nodata) value cells
-            masked_raster = np.ma.masked_where(clipped_raster == bt_const.BT_NODATA, clipped_raster)
-            filled_raster = np.ma.filled(masked_raster, np.nan)
+            percentiles, inside = sp_common.zonal_percentiles(
+                self.in_chm,
+                [ring.geometry for ring in self.buffer_rings],
+                50,
+                index=pct_index.open_percentile_index(self.in_chm),
+            )
+        except Exception as e:
+            print(f"cal_percentile_rings: {e}")
+            print("Default values are used.")
+            return
 
-            # Calculate the percentile
-            percentile = np.nanpercentile(filled_raster, 50)
+        # rings outside of CHM keep default values
+        for ring, percentile, is_inside in zip(self.buffer_rings, percentiles, inside):
+            if not is_inside:
+                continue
 
             if percentile > 1:
                 ring.Dyn_Canopy_Threshold = percentile * (0.3)
@@ -289,11 +319,6 @@ class LineInfo:
                 ring.Dyn_Canopy_Threshold = 1
 
             ring.percentile = percentile
-        except Exception as e:
-            print(e)
-            print("Default values are used.")
-
-        return ring
 
     def get_percentile_array(self, side):
         per_array = []
@@ -307,118 +332,15 @@ class LineInfo:
         return per_array
 
     def rate_of_change(self, percentile_array, side):
-        # Since the x interval is 1 unit, the array 'diff' is the rate of change (slope)
-        diff = np.ediff1d(percentile_array)
-        cut_dist = len(percentile_array) / 5
-
-        median_percentile = np.nanmedian(percentile_array)
-        if not np.isnan(median_percentile):
-            cut_percentile = float(math.floor(median_percentile))
-        else:
-            cut_percentile = 0.5
-
-        found = False
-        changes = 1.50
-        Change = np.insert(diff, 0, 0)
-        scale_down = 1.0
-
-        # test the rate of change is > than 150% (1.5), if it is
-        # no result found then lower to 140% (1.4) until 110% (1.1)
-        try:
-            while not found and changes >= 1.1:
-                for ii in range(0, len(Change) - 1):
-                    if percentile_array[ii] >= 0.5:
-                        if (Change[ii]) >= changes:
-                            cut_dist = (ii + 1) * scale_down
-                            cut_percentile = math.floor(percentile_array[ii])
-
-                            if 0.5 >= cut_percentile:
-                                if cut_dist > 5:
-                                    cut_percentile = 2
-                                    cut_dist = cut_dist * scale_down**3
-                                    # @<0.5  found and modified
-                            elif 0.5 < cut_percentile <= 5.0:
-                                if cut_dist > 6:
-                                    cut_dist = cut_dist * scale_down**3  # 4.0
-                                    # @0.5-5.0  found and modified
-                            elif 5.0 < cut_percentile <= 10.0:
-                                if cut_dist > 8:  # 5
-                                    cut_dist = cut_dist * scale_down**3
-                                    # @5-10  found and modified
-                            elif 10.0 < cut_percentile <= 15:
-                                if cut_dist > 5:
-                                    cut_dist = cut_dist * scale_down**3  # 5.5
-                                    #  @10-15  found and modified
-                            elif 15 < cut_percentile:
-                                if cut_dist > 4:
-                                    cut_dist = cut_dist * scale_down**2
-                                    cut_percentile = 15.5
-                                    #  @>15  found and modified
-                            found = True
-                            # rate of change found
-                            break
-                changes = changes - 0.1
-
-        except IndexError:
-            pass
-
-        # if still no result found, lower to 10% (1.1),
-        # if no result found then default is used
-        if not found:
-            if 0.5 >= median_percentile:
-                cut_dist = 4 * scale_down  # 3
-                cut_percentile = 0.5
-            elif 0.5 < median_percentile <= 5.0:
-                cut_dist = 4.5 * scale_down  # 4.0
-                cut_percentile = math.floor(median_percentile)
-            elif 5.0 < median_percentile <= 10.0:
-                cut_dist = 5.5 * scale_down  # 5
-                cut_percentile = math.floor(median_percentile)
-            elif 10.0 < median_percentile <= 15:
-                cut_dist = 6 * scale_down  # 5.5
-                cut_percentile = math.floor(median_percentile)
-            elif 15 < median_percentile:
-                cut_dist = 5 * scale_down  # 5
-                cut_percentile = 15.5
+        """Set cut distance and height of side from rate of change of its ring percentiles."""
+        cut_dist, cut_percentile = algo_common.rate_of_change_cuts(np.asarray(percentile_array)[np.newaxis])
 
         if side == Side.right:
-            self.RDist_Cut = cut_dist
-            self.CR_CutHt = float(cut_percentile)
+            self.RDist_Cut = float(cut_dist[0])
+            self.CR_CutHt = float(cut_percentile[0])
         elif side == Side.left:
-            self.LDist_Cut = cut_dist
-            self.CL_CutHt = float(cut_percentile)
-
-    def multi_ring_buffer(self, df, nrings, ringdist):
-        """
-        Buffers an input DataFrames geometry nring (number of rings) times.
-
-        Compute with a distance between rings of ringdist and returns
-        a list of non overlapping buffers
-        """
-        rings = []  # A list to hold the individual buffers
-        line = df.geometry.iloc[0]
-        # For each ring (1, 2, 3, ..., nrings)
-        for ring in np.arange(0, ringdist, nrings):
-            big_ring = line.buffer(
-                nrings + ring, single_sided=True, cap_style="flat"
-            )  # Create one big buffer
-            small_ring = line.buffer(ring, single_sided=True, cap_style="flat")  # Create one smaller one
-            the_ring = big_ring.difference(small_ring)  # Difference the big with the small to create a ring
-            if (
-                ~shapely.is_empty(the_ring)
-                or ~shapely.is_missing(the_ring)
-                or not None
-                or ~the_ring.area == 0
-            ):
-                if isinstance(the_ring, sh_geom.MultiPolygon) or isinstance(the_ring, shapely.Polygon):
-                    rings.append(the_ring)  # Append the ring to the rings list
-                else:
-                    if isinstance(the_ring, shapely.GeometryCollection):
-                        for i in range(0, len(the_ring.geoms)):
-                            if not isinstance(the_ring.geoms[i], shapely.LineString):
-                                rings.append(the_ring.geoms[i])
-
-        return rings  # return the list
+            self.LDist_Cut = float(cut_dist[0])
+            self.CL_CutHt = float(cut_percentile[0])
 
     def prepare_line_buffer(self):
         line = self.line.geometry.iloc[0]
@@ -451,19 +373,17 @@ class LineInfo:
         # max_line_dist = self.max_line_dist
         # canopy_avoid = self.canopy_avoidance
         # exponent = self.exponent
-        line_df = self.line
-        out_meta = self.out_meta
 
         canopy_thresh_percentage = self.canopy_thresh_percentage / 100
 
         Cut_Dist = None
         line_buffer = None
         if side == Side.left:
-            canopy_ht_threshold = line_df.CL_CutHt * canopy_thresh_percentage
+            canopy_ht_threshold = self.CL_CutHt * canopy_thresh_percentage
             Cut_Dist = self.LDist_Cut
             line_buffer = self.buffer_left
         elif side == Side.right:
-            canopy_ht_threshold = line_df.CR_CutHt * canopy_thresh_percentage
+            canopy_ht_threshold = self.CR_CutHt * canopy_thresh_percentage
             Cut_Dist = self.RDist_Cut
             line_buffer = self.buffer_right
         else:
@@ -534,8 +454,7 @@ class LineInfo:
             if len(in_cost_r.shape) > 2:
                 in_cost_r = np.squeeze(in_cost_r, axis=0)
 
-            algo_cost.remove_nan_from_array_refactor(in_cost_r)
-            in_cost_r[in_cost_r == no_data] = np.inf
+            algo_cost.normalize_nodata(in_cost_r, no_data)
 
             # generate 1m interval points along line
             distance_delta = 1
@@ -577,6 +496,10 @@ class LineInfo:
 
             corridor_thresh = np.ma.where(corridor_norm >= corridor_th_value, 1.0, 0.0)
             clean_raster = algo_common.morph_raster(corridor_thresh, in_canopy_r, exp_shk_cell, cell_size_x)
+            debug_name = f"footprint_rel_{self.index}_{side.value}"
+            algo_common.save_debug_raster(f"{debug_name}_canopy", in_canopy_r, in_meta)
+            algo_common.save_debug_raster(f"{debug_name}_cost", in_cost_r, in_meta)
+            algo_common.save_debug_raster(f"{debug_name}_corridor", corridor_thresh, in_meta)
 
             # create mask for non-polygon area
             mask = np.where(clean_raster == 1, True, False)
@@ -617,6 +540,14 @@ class LineInfo:
             print("Exception: {}".format(e))
 
 
+def process_line_info(line_info, in_chm=None, **context):
+    """Set CHM and parameters shared by all lines, then process line."""
+    if in_chm is not None:
+        line_info.set_context(in_chm, **context)
+
+    return algo_common.process_single_item(line_info)
+
+
 def line_footprint_rel(
     in_line,
     in_chm,
@@ -15,6 +15,7 @@ Description:
 """
 
 import enum
+import time
 from itertools import compress
 
 import geopandas as gpd
@@ -24,14 +25,15 @@ import rasterio
 import shapely
 import shapely.geometry as sh_geom
 import shapely.ops as sh_ops
+import skimage.graph as sk_graph
+import skimage.morphology as sk_morph
 from label_centerlines import get_centerline
+from scipy import ndimage
 
 import beratools.core.algo_common as algo_common
-import beratools.core.algo_cost as algo_cost
 import beratools.core.algo_dijkstra as bt_dijkstra
 import beratools.core.constants as bt_const
 import beratools.core.tool_base as bt_base
-import beratools.utility.spatial_common as sp_common
 
 
 class CenterlineParams(float, enum.Enum):
@@ -192,6 +194,36 @@ def find_centerline(poly, input_line):
         else:
             return default_return
 
+    centerline = trim_centerline_ends(centerline)
+    if not centerline:
+        return default_return
+
+    centerline = snap_end_to_end(centerline, input_line)
+
+    # Check centerline. If valid, regenerate by splitting polygon into two halves.
+    if not centerline_is_valid(centerline, input_line):
+        try:
+            print("Regenerating line ...")
+            centerline = regenerate_centerline(poly, input_line)
+            return centerline, CenterlineStatus.REGENERATE_SUCCESS
+        except Exception as e:
+            print(f"find_centerline: {e}")
+            return input_line, CenterlineStatus.REGENERATE_FAILED
+
+    return centerline, CenterlineStatus.SUCCESS
+
+
+def trim_centerline_ends(centerline):
+    """
+    Trim centerline at two ends by CenterlineParams.BUFFER_CLIP.
+
+    Args:
+        centerline (sh_geom.LineString): centerline
+
+    Returns:
+    centerline (sh_geom.LineString): None when nothing is left after trimming
+
+    """
     cl_coords = list(centerline.coords)
 
     # trim centerline at two ends
@@ -203,25 +235,97 @@ def find_centerline(poly, input_line):
 
     # No centerline detected, use input line instead.
     if not centerline:
-        return default_return
+        return None
     try:
         # Empty centerline detected, use input line instead.
         if centerline.is_empty:
-            return default_return
+            return None
     except Exception as e:
-        print(f"find_centerline: {e}")
+        print(f"trim_centerline_ends: {e}")
 
-    centerline = snap_end_to_end(centerline, input_line)
+    return centerline
 
-    # Check centerline. If valid, regenerate by splitting polygon into two halves.
+
+def find_centerline_skeleton(corridor_thresh, in_transform, input_line):
+    """
+    Find centerline from skeleton of corridor raster.
+
+    The corridor part crossed by input line is thinned to one cell wide skeleton,
+    then centerline follows the skeleton between cells nearest to the two end points
+    of input line. No polygon or Voronoi diagram is involved.
+
+    Args:
+        corridor_thresh (np.ma.MaskedArray): corridor raster by corridor_raster, 0 is corridor
+        in_transform: raster transform of corridor_thresh
+        input_line (sh_geom.LineString): Least cost path
+
+    Returns:
+    centerline (sh_geom.LineString): Centerline
+    status (CenterlineStatus): Status of centerline generation
+
+    """
+    default_return = input_line, CenterlineStatus.FAILED
+    corridor = np.ma.filled(np.ma.masked_invalid(corridor_thresh) == 0.0, False)
+    if len(corridor.shape) > 2:
+        corridor = np.squeeze(corridor, axis=0)
+
+    labels, count = ndimage.label(corridor, structure=np.ones((3, 3)))
+    if count == 0:
+        print("find_centerline_skeleton: No corridor found")
+        return default_return
+
+    # corridor part crossed by most cells of input line
+    transformer = rasterio.transform.AffineTransformer(in_transform)
+    line_xy = np.array(input_line.coords)[:, :2]
+    line_rows, line_cols = transformer.rowcol(line_xy[:, 0], line_xy[:, 1])
+    line_rows, line_cols = np.asarray(line_rows), np.asarray(line_cols)
+    rows, cols = corridor.shape
+    inside = (line_rows >= 0) & (line_rows < rows) & (line_cols >= 0) & (line_cols < cols)
+    line_labels = labels[line_rows[inside], line_cols[inside]]
+    line_labels = line_labels[line_labels > 0]
+    if len(line_labels) > 0:
+        corridor = labels == np.bincount(line_labels).argmax()
+    else:
+        corridor = labels == np.bincount(labels.ravel())[1:].argmax() + 1
+
+    if bt_const.CenterlineFlags.DELETE_HOLES:
+        corridor = ndimage.binary_fill_holes(corridor)
+
+    skeleton = sk_morph.skeletonize(corridor)
+    skeleton_rows, skeleton_cols = np.nonzero(skeleton)
+    if len(skeleton_rows) < 2:
+        print("find_centerline_skeleton: No skeleton found")
+        return default_return
+
+    # skeleton cells nearest to end points of input line
+    end_cells = []
+    for index in (0, -1):
+        dist = (skeleton_rows - line_rows[index]) ** 2 + (skeleton_cols - line_cols[index]) ** 2
+        end_cells.append((skeleton_rows[np.argmin(dist)], skeleton_cols[np.argmin(dist)]))
+
+    try:
+        path, _ = sk_graph.route_through_array(np.where(skeleton, 1.0, np.inf), end_cells[0], end_cells[1])
+    except ValueError as e:
+        print(f"find_centerline_skeleton: {e}")
+        return default_return
+
+    if len(path) < 2:
+        return default_return
+
+    path = np.array(path)
+    path_x, path_y = transformer.xy(path[:, 0], path[:, 1])
+    centerline = sh_geom.LineString(np.column_stack([path_x, path_y]))
+    centerline = centerline.simplify(CenterlineParams.SIMPLIFY_LENGTH)
+
+    centerline = trim_centerline_ends(centerline)
+    if not centerline:
+        return default_return
+
+    # dense vertices like Voronoi centerline, snapping only moves the end vertices
+    centerline = shapely.segmentize(centerline, CenterlineParams.SEGMENTIZE_LENGTH)
+    centerline = snap_end_to_end(centerline, input_line)
     if not centerline_is_valid(centerline, input_line):
-        try:
-            print("Regenerating line ...")
-            centerline = regenerate_centerline(poly, input_line)
-            return centerline, CenterlineStatus.REGENERATE_SUCCESS
-        except Exception as e:
-            print(f"find_centerline: {e}")
-            return input_line, CenterlineStatus.REGENERATE_FAILED
+        return default_return
 
     return centerline, CenterlineStatus.SUCCESS
 
@@ -395,26 +499,87 @@ def regenerate_centerline(poly, input_line):
     return sh_ops.linemerge(sh_geom.MultiLineString([center_line_1, center_line_2]))
 
 
+def centerline_settings():
+    """
+    Return bt_const and centerline settings changing SeedLine results.
+
+    They are part of checkpoint and result cache parameters of centerline tool,
+    so results computed with other settings are not served.
+    """
+    return {
+        **algo_common.corridor_settings(),
+        "bt_epsilon": bt_const.BT_EPSILON,
+        "fp_corridor_threshold": bt_const.FP_CORRIDOR_THRESHOLD,
+        "lcp_engine": int(bt_const.LCP_ENGINE),
+        "lcp_pyramid_factors": list(bt_const.LCP_PYRAMID_FACTORS),
+        "lcp_pyramid_band": bt_const.LCP_PYRAMID_BAND,
+        "use_skimage_graph": bool(bt_const.CenterlineFlags.USE_SKIMAGE_GRAPH),
+        "use_skeleton_centerline": bool(bt_const.CenterlineFlags.USE_SKELETON_CENTERLINE),
+        "delete_holes": bool(bt_const.CenterlineFlags.DELETE_HOLES),
+        "simplify_polygon": bool(bt_const.CenterlineFlags.SIMPLIFY_POLYGON),
+        "centerline_params": {name: param.value for name, param in CenterlineParams.__members__.items()},
+    }
+
+
 class SeedLine:
-    """Class to store seed line and least cost path."""
+    """
+    Seed line work item, least cost path and centerline of it.
 
-    def __init__(self, line_gdf, ras_file, proc_segments, line_radius):
-        self.line = line_gdf
-        self.raster = ras_file
-        self.line_radius = line_radius
+    Item carries index, ID and coordinates of line in LineTable only. Workers
+    return its ResultRecord of geometries and status, attributes of line
+    are attached to them by LineTable.to_gdf in main process. ID is the
+    checkpoint key of line, see LineTable.line_ids.
+    """
+
+    __slots__ = (
+        "index",
+        "coords",
+        "line_id",
+        "raster",
+        "line_radius",
+        "cost_file",
+        "lc_path",
+        "centerline",
+        "corridor_poly",
+        "status",
+        "timings",
+    )
+
+    def __init__(self, index, coords, ras_file=None, line_radius=None, cost_file=None, line_id=None):
+        self.index = index
+        self.coords = coords
+        self.line_id = line_id
+        self.set_context(ras_file, line_radius, cost_file)
         self.lc_path = None
         self.centerline = None
-        self.corridor_poly_gpd = None
+        self.corridor_poly = None
+        self.status = None
+        self.timings = {}  # seconds spent in each stage of compute
+
+    @property
+    def geometry(self):
+        return sh_geom.LineString(self.coords)
+
+    def set_context(self, ras_file, line_radius, cost_file=None):
+        """Set raster and parameters shared by all lines, in worker when sent once per worker."""
+        self.raster = ras_file
+        self.line_radius = line_radius
+        self.cost_file = cost_file
+
+    def _record_time(self, stage, start):
+        self.timings[stage] = time.perf_counter() - start
+        return time.perf_counter()
 
     def compute(self):
-        line = self.line.geometry[0]
+        line = self.geometry
         line_radius = self.line_radius
         in_raster = self.raster
         seed_line = line  # LineString
         default_return = (seed_line, seed_line, None)
 
-        ras_clip, out_meta = sp_common.clip_raster(in_raster, seed_line, line_radius)
-        cost_clip, _ = algo_cost.cost_raster(ras_clip, out_meta)
+        start = time.perf_counter()
+        cost_clip, out_meta = algo_common.clip_cost_raster(in_raster, seed_line, line_radius, self.cost_file)
+        start = self._record_time("clip_cost", start)
 
         lc_path = line
         try:
@@ -432,17 +597,23 @@ class SeedLine:
             lc_path_coords = []
 
         self.lc_path = lc_path
+        start = self._record_time("least_cost_path", start)
 
         # search for centerline
         if len(lc_path_coords) < 2:
             print("No least cost path detected, use input line.")
-            self.line["cl_status"] = CenterlineStatus.FAILED.value
+            self.status = CenterlineStatus.FAILED.value
             return default_return
 
-        # get corridor raster
+        # get corridor raster, reuse cost of the first clip around least cost path
         lc_path = sh_geom.LineString(lc_path_coords)
-        ras_clip, out_meta = sp_common.clip_raster(in_raster, lc_path, line_radius * 0.9)
-        cost_clip, _ = algo_cost.cost_raster(ras_clip, out_meta)
+        cost_window = algo_common.clip_cost_window(cost_clip, out_meta, lc_path, line_radius * 0.9)
+        if cost_window is None:
+            print("Least cost path is out of cost raster, use input line.")
+            self.status = CenterlineStatus.FAILED.value
+            return default_return
+
+        cost_clip, out_meta = cost_window
 
         out_transform = out_meta["transform"]
         transformer = rasterio.transform.AffineTransformer(out_transform)
@@ -460,17 +631,31 @@ class SeedLine:
             cell_size,
             bt_const.FP_CORRIDOR_THRESHOLD,
         )
+        start = self._record_time("corridor", start)
+        algo_common.save_debug_raster(f"centerline_{self.index}_cost", cost_clip, out_meta)
+        algo_common.save_debug_raster(f"centerline_{self.index}_corridor", corridor_thresh_cl, out_meta)
 
         # find contiguous corridor polygon and extract centerline
         df = gpd.GeoDataFrame(geometry=[seed_line], crs=out_meta["crs"])
         corridor_poly_gpd = find_corridor_polygon(corridor_thresh_cl, out_transform, df)
-        center_line, status = find_centerline(corridor_poly_gpd.geometry.iloc[0], lc_path)
-        self.line["cl_status"] = status.value
-
-        self.lc_path = self.line.copy()
-        self.lc_path.geometry = [lc_path]
-
-        self.centerline = self.line.copy()
-        self.centerline.geometry = [center_line]
+        if bt_const.CenterlineFlags.USE_SKELETON_CENTERLINE:
+            center_line, status = find_centerline_skeleton(corridor_thresh_cl, out_transform, lc_path)
+        else:
+            center_line, status = find_centerline(corridor_poly_gpd.geometry.iloc[0], lc_path)
+        self.status = status.value
+        self._record_time("centerline", start)
 
-        self.corridor_poly_gpd = corridor_poly_gpd
+        self.lc_path = lc_path
+        self.centerline = center_line
+        self.corridor_poly = corridor_poly_gpd.geometry.iloc[0]
+
+    def to_record(self):
+        """Return ResultRecord of centerline, least cost path and corridor polygon, no rows when failed."""
+        record = bt_base.ResultRecord(self.index, attributes={"timings": self.timings})
+        if self.centerline is not None:
+            status = [self.status]
+            record.add_rows("centerline", [self.centerline], cl_status=status)
+            record.add_rows("least_cost_path", [self.lc_path], cl_status=status)
+            record.add_rows("corridor_polygon", [self.corridor_poly])
+
+        return record
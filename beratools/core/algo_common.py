@@ -20,8 +20,11 @@ from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import pyproj
 import rasterio
+import rasterio.features
+import rasterio.windows
 import shapely
 import shapely.affinity as sh_aff
 import shapely.geometry as sh_geom
@@ -32,6 +35,7 @@ from scipy import ndimage
 
 import beratools.core.algo_cost as algo_cost
 import beratools.core.constants as bt_const
+import beratools.utility.spatial_common as sp_common
 
 gpd.options.io_engine = "pyogrio"
 DISTANCE_THRESHOLD = 2  # 1 meter for intersection neighborhood
@@ -42,15 +46,15 @@ def process_single_item(cls_obj):
     Process a class object for universal multiprocessing.
 
     Args:
-        cls_obj: Class object to be processed
+        cls_obj: Class object to be processed, it implements compute and to_record
 
     Returns:
-        cls_obj: Class object after processing
+        ResultRecord: compact result of class object, see tool_base.ResultRecord
 
     """
     try:
         cls_obj.compute()
-        return cls_obj
+        return cls_obj.to_record()
     except Exception as e:
         import traceback
 
@@ -131,45 +135,252 @@ def clean_line_geometries(line_gdf):
     return line_gdf
 
 
-def prepare_lines_gdf(file_path, layer=None, proc_segments=True):
+class LineTable:
     """
-    Split lines at vertices or return original rows.
+    Columnar table of lines, coordinates in one array and attributes in DataFrame.
+
+    Line i has vertices coords[offsets[i]:offsets[i + 1]] and attributes of
+    row rows[i] in attributes. Segments of one input line share its
+    attribute row, so attributes are stored once and attached to outputs
+    by to_gdf in the main process. Work items carry index and coordinates only.
+
+    Args:
+        coords: array of shape (n, 2) or (n, 3) of all vertices
+        offsets: array of line count + 1 start positions of lines in coords
+        rows: attribute row of each line
+        attributes (DataFrame): non-geometry columns of input lines
+        crs: coordinate reference system of lines
+
+    """
+
+    def __init__(self, coords, offsets, rows, attributes, crs=None):
+        self.coords = coords
+        self.offsets = offsets
+        self.rows = rows
+        self.attributes = attributes
+        self.crs = crs
+
+    def __len__(self):
+        """Return number of lines."""
+        return len(self.rows)
+
+    def line_coords(self, i):
+        """Return vertex array of line i."""
+        return self.coords[self.offsets[i] : self.offsets[i + 1]]
+
+    def geometry(self, i):
+        return sh_geom.LineString(self.line_coords(i))
+
+    def line_ids(self, id_columns=("OLnFID", "OLnSEG")):
+        """
+        Return ID of each line, values of id_columns of its attribute row and its part number.
+
+        Part number is position of line among segments of the same input line,
+        0 for whole lines. None when attributes have none of id_columns.
+        """
+        columns = [col for col in id_columns if col in self.attributes.columns]
+        if not columns:
+            return None
+
+        values = self.attributes[columns].to_numpy()[self.rows].tolist()
+        parts = np.arange(len(self)) - np.searchsorted(self.rows, self.rows)
+        return [tuple(value) + (int(part),) for value, part in zip(values, parts)]
+
+    def geometries(self):
+        """Return array of all lines as LineStrings."""
+        index = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return shapely.linestrings(self.coords, indices=index)
+
+    def to_gdf(self, geometries, indices=None, columns=None):
+        """
+        Return GeoDataFrame of geometries with attributes of lines they are generated from.
+
+        Args:
+            geometries: output geometry of each line
+            indices: line index of each geometry, all lines in order when None
+            columns (dict): extra columns of values for each geometry, such as status
+
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+
+        gdf = self.attributes.iloc[self.rows[np.asarray(indices, dtype=np.int64)]].reset_index(drop=True)
+        gdf = gpd.GeoDataFrame(gdf, geometry=list(geometries), crs=self.crs)
+        for col, values in (columns or {}).items():
+            gdf[col] = values
+
+        return gdf
+
+
+def prepare_line_table(file_path, layer=None, proc_segments=True):
+    """
+    Read lines to LineTable, split at vertices into two point segments or keep whole lines.
 
     It handles for MultiLineString.
 
+    Returns:
+        LineTable: None when file can't be read
+
     """
-    # Check if there are any MultiLineString geometries
     gdf = read_geospatial_file(file_path, layer=layer)
+    if gdf is None:
+        return None
 
     # Explode MultiLineStrings into individual LineStrings
     if has_multilinestring(gdf):
         gdf = gdf.explode(index_parts=False)
 
-    split_gdf_list = []
+    geoms = gdf.geometry.values
+    include_z = bool(shapely.has_z(geoms).any())
+    coords, index = shapely.get_coordinates(geoms, include_z=include_z, return_index=True)
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).reset_index(drop=True)
+
+    if proc_segments:
+        # segment from each vertex to next vertex of the same line
+        starts = np.flatnonzero(index[:-1] == index[1:])
+        coords = np.stack([coords[starts], coords[starts + 1]], axis=1).reshape(-1, coords.shape[1])
+        offsets = np.arange(0, 2 * len(starts) + 1, 2)
+        rows = index[starts]
+    else:
+        counts = np.bincount(index, minlength=len(geoms))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        rows = np.arange(len(geoms))
 
-    for row in gdf.itertuples(index=False):  # Use itertuples to iterate
-        line = row.geometry  # Access geometry directly via the named tuple
+    return LineTable(coords, offsets, rows, attributes, gdf.crs)
 
-        # If proc_segment is True, split the line at vertices
-        if proc_segments:
-            coords = list(line.coords)  # Extract the list of coordinates (vertices)
 
-            # For each LineString, split the line into segments by the vertices
-            for i in range(len(coords) - 1):
-                segment = sh_geom.LineString([coords[i], coords[i + 1]])
+def ring_buffer_table(lines, ring_count=15, ring_width=1.0, crs=None):
+    """
+    Build single sided ring buffers on both sides of all lines in one pass.
 
-                # Copy over all non-geometry columns (excluding 'geometry')
-                attributes = {col: getattr(row, col) for col in gdf.columns if col != "geometry"}
-                single_row_gdf = gpd.GeoDataFrame([attributes], geometry=[segment], crs=gdf.crs)
-                split_gdf_list.append(single_row_gdf)
+    Ring i covers distance i * ring_width to (i + 1) * ring_width from line,
+    it is difference of two consecutive buffers, which are built for all
+    lines, sides and distances by one vectorized call. Line parts of ring
+    collections are dropped, other parts are kept as separate rings.
 
-        else:
-            # If not proc_segment, add the original row as a single-row GeoDataFrame
-            attributes = {col: getattr(row, col) for col in gdf.columns if col != "geometry"}
-            single_row_gdf = gpd.GeoDataFrame([attributes], geometry=[line], crs=gdf.crs)
-            split_gdf_list.append(single_row_gdf)
+    Args:
+        lines: array of line geometries
+        ring_count: number of rings on each side
+        ring_width: distance between rings
+        crs: coordinate reference system of lines
+
+    Returns:
+        GeoDataFrame: one row per ring, columns line (position of line in lines),
+            side ("left" or "right"), iRing and geometry, ordered by line, side and iRing
 
-    return split_gdf_list
+    """
+    lines = np.asarray(lines, dtype=object)
+    sides = np.array(["left", "right"])
+
+    # buffer distances of shape (side, ring_count + 1), right side is negative
+    dist = np.outer([ring_width, -ring_width], np.arange(ring_count + 1))
+    buffers = shapely.buffer(
+        lines[:, np.newaxis, np.newaxis], dist, quad_segs=16, cap_style="flat", single_sided=True
+    )
+    rings = shapely.difference(buffers[:, :, 1:], buffers[:, :, :-1]).ravel()
+
+    # keep polygons, split collections into parts without lines
+    type_id = shapely.get_type_id(rings)
+    polygon_types = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+    whole = np.flatnonzero(np.isin(type_id, polygon_types))
+    coll = np.flatnonzero(type_id == shapely.GeometryType.GEOMETRYCOLLECTION)
+    parts, part_index = shapely.get_parts(rings[coll], return_index=True)
+    kept = shapely.get_type_id(parts) != shapely.GeometryType.LINESTRING
+
+    positions = np.concatenate([whole, coll[part_index[kept]]])
+    geoms = np.concatenate([rings[whole], parts[kept]])
+    order = np.argsort(positions, kind="stable")
+    positions = positions[order]
+
+    # rings of one line and side are consecutive, iRing counts kept rings
+    group = positions // ring_count
+    ring_index = np.arange(len(positions)) - np.searchsorted(group, group)
+
+    return gpd.GeoDataFrame(
+        {
+            "line": group // 2,
+            "side": sides[group % 2],
+            "iRing": ring_index,
+        },
+        geometry=geoms[order],
+        crs=crs,
+    )
+
+
+def rate_of_change_cuts(percentiles, ring_counts=None):
+    """
+    Cut distance and height of many line sides from rate of change of their ring percentiles.
+
+    Cut is at first ring whose percentile is at least 0.5 and rises from
+    previous ring by change threshold, which starts at 1.5 and is lowered
+    by 0.1 down to 1.1 until a ring is found. Sides without such ring are
+    estimated from median percentile. Percentiles are compared in their
+    dtype, results are the same as rules applied to each side one by one.
+
+    Args:
+        percentiles: 2D array of sides x rings, rings ordered outwards from line
+        ring_counts: number of rings of each side, rest of row is padding,
+            all columns when None
+
+    Returns:
+        tuple: (cut_dist, cut_percentile) arrays
+
+    """
+    percentiles = np.asarray(percentiles)
+    if not np.issubdtype(percentiles.dtype, np.floating):
+        percentiles = percentiles.astype(np.float64)
+
+    rows, columns = percentiles.shape
+    if ring_counts is None:
+        ring_counts = np.full(rows, columns)
+
+    ring_counts = np.asarray(ring_counts)
+    x = np.full((rows, columns + 1), np.nan, dtype=percentiles.dtype)
+    x[:, :columns] = percentiles
+    ring_index = np.arange(columns + 1)
+    x[ring_index >= ring_counts[:, np.newaxis]] = np.nan
+
+    # median of each row, as numpy.nanmedian does
+    sorted_x = np.sort(x, axis=1)
+    valid_count = np.count_nonzero(~np.isnan(sorted_x), axis=1)
+    row_index = np.arange(rows)
+    lower = sorted_x[row_index, np.maximum(valid_count - 1, 0) // 2]
+    upper = sorted_x[row_index, valid_count // 2]
+    with np.errstate(invalid="ignore"):
+        median = np.where(valid_count % 2 == 1, lower, (lower + upper) / 2)
+
+    # first ring of each row exceeding threshold, thresholds are lowered as in loop
+    change = np.zeros_like(x)
+    change[:, 1:] = x[:, 1:] - x[:, :-1]
+    with np.errstate(invalid="ignore"):
+        candidate = (ring_index < ring_counts[:, np.newaxis] - 1) & (x >= 0.5)
+
+    found = np.zeros(rows, dtype=bool)
+    cut_ring = np.zeros(rows, dtype=np.intp)
+    changes = 1.50
+    while changes >= 1.1:
+        with np.errstate(invalid="ignore"):
+            hit = candidate & (change >= changes) & ~found[:, np.newaxis]
+
+        hit_rows = hit.any(axis=1)
+        cut_ring[hit_rows] = hit[hit_rows].argmax(axis=1)
+        found |= hit_rows
+        changes = changes - 0.1
+
+    found_dist = cut_ring + 1.0
+    found_percentile = np.floor(x[row_index, cut_ring]).astype(np.float64)
+    found_percentile[(found_percentile <= 0.5) & (found_dist > 5)] = 2
+    found_percentile[(found_percentile > 15) & (found_dist > 4)] = 15.5
+
+    # estimate from median when no ring is found
+    bins = [median <= 0.5, median <= 5.0, median <= 10.0, median <= 15, median > 15]
+    est_dist = np.select(bins, [4.0, 4.5, 5.5, 6.0, 5.0], default=ring_counts / 5)
+    est_percentile = np.select([median <= 0.5, median > 15], [0.5, 15.5], default=np.floor(median))
+    est_percentile[np.isnan(median)] = 0.5
+
+    cut_dist = np.where(found, found_dist, est_dist)
+    cut_percentile = np.where(found, found_percentile, est_percentile)
+    return cut_dist, cut_percentile
 
 
 # TODO use function from common
@@ -344,6 +555,38 @@ def save_raster_to_file(in_raster_mem, in_meta, out_raster_file):
         dest.write(in_raster_mem, indexes=1)
 
 
+def save_debug_raster(name, raster, meta):
+    """
+    Save intermediate raster of work item to bt_const.DEBUG_RASTER_DIR as <name>.tif.
+
+    Nothing is saved when bt_const.DEBUG_RASTER_DIR is not set, so workers
+    drop their rasters instead of returning them.
+    """
+    if not bt_const.DEBUG_RASTER_DIR:
+        return
+
+    raster = np.ma.filled(raster, bt_const.BT_NODATA) if np.ma.isMaskedArray(raster) else raster
+    raster = np.squeeze(raster)
+    if raster.dtype == bool:
+        raster = raster.astype(np.uint8)
+
+    out_meta = meta.copy()
+    out_meta.update(
+        driver="GTiff",
+        count=1,
+        dtype=raster.dtype.name,
+        height=raster.shape[0],
+        width=raster.shape[1],
+        nodata=bt_const.BT_NODATA if raster.dtype.kind == "f" else None,
+    )
+    try:
+        out_dir = Path(bt_const.DEBUG_RASTER_DIR)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        save_raster_to_file(raster, out_meta, out_dir.joinpath(f"{name}.tif").as_posix())
+    except Exception as e:
+        print(f"save_debug_raster: {name} not saved: {e}")
+
+
 def generate_perpendicular_line_precise(points, offset=20):
     """
     Generate a perpendicular line to the input line at the given point.
@@ -419,7 +662,29 @@ def _line_angle(point_1, point_2):
     return angle
 
 
-def corridor_raster(raster_clip, out_meta, source, destination, cell_size, corridor_threshold):
+def corridor_settings():
+    """
+    Return bt_const settings changing corridor of line, part of checkpoint and result cache parameters.
+
+    They are read by cost raster, corridor and line table preparation of work items.
+    """
+    return {
+        "bt_nodata": bt_const.BT_NODATA,
+        "bt_nodata_cost": bt_const.BT_NODATA_COST,
+        "small_buffer": bt_const.SMALL_BUFFER,
+        "corridor_bounded_search": bt_const.CORRIDOR_BOUNDED_SEARCH,
+    }
+
+
+def corridor_raster(
+    raster_clip,
+    out_meta,
+    source,
+    destination,
+    cell_size,
+    corridor_threshold,
+    bounded=bt_const.CORRIDOR_BOUNDED_SEARCH,
+):
     """
     Calculate corridor raster.
 
@@ -430,6 +695,8 @@ def corridor_raster(raster_clip, out_meta, source, destination, cell_size, corri
         destination (list of point tuple(s)): end point in row/col
         cell_size (tuple): (cell_size_x, cell_size_y)
         corridor_threshold (double)
+        bounded (bool): limit destination search to the window which can hold
+            corridor cells, result is same as the full search
 
     Returns:
     corridor raster
@@ -440,7 +707,7 @@ def corridor_raster(raster_clip, out_meta, source, destination, cell_size, corri
         if len(raster_clip.shape) > 2:
             raster_clip = np.squeeze(raster_clip, axis=0)
 
-        algo_cost.remove_nan_from_array_refactor(raster_clip)
+        algo_cost.normalize_nodata(raster_clip)
 
         # generate the cost raster to source point
         mcp_source = sk_graph.MCP_Geometric(raster_clip, sampling=cell_size)
@@ -448,8 +715,13 @@ def corridor_raster(raster_clip, out_meta, source, destination, cell_size, corri
         del mcp_source
 
         # # # generate the cost raster to destination point
-        mcp_dest = sk_graph.MCP_Geometric(raster_clip, sampling=cell_size)
-        dest_cost_acc = mcp_dest.find_costs(destination)[0]
+        if bounded:
+            dest_cost_acc = corridor_dest_cost(
+                raster_clip, source_cost_acc, destination, cell_size, corridor_threshold
+            )
+        else:
+            mcp_dest = sk_graph.MCP_Geometric(raster_clip, sampling=cell_size)
+            dest_cost_acc = mcp_dest.find_costs(destination)[0]
 
         # Generate corridor
         corridor = source_cost_acc + dest_cost_acc
@@ -473,6 +745,155 @@ def corridor_raster(raster_clip, out_meta, source, destination, cell_size, corri
     return corridor_thresh_cl
 
 
+def corridor_dest_cost(raster_clip, source_cost_acc, destination, cell_size, corridor_threshold):
+    """
+    Accumulated cost to destination, searched only where corridor can be.
+
+    Corridor cells satisfy source + dest < path_cost + corridor_threshold, and
+    cells on their least cost paths to destination satisfy it too. Since
+    dest >= min_cost * distance, the search is limited to the window of cells with
+    source + min_cost * distance < path_cost + corridor_threshold. Corridor cells
+    get exact costs; other reachable cells get costs no less than the
+    true ones, or a large value outside the window, so they are above threshold.
+
+    Args:
+        raster_clip (np.ndarray): cost raster without nan
+        source_cost_acc (np.ndarray): accumulated cost from source
+        destination (list of point tuple(s)): end point in row/col
+        cell_size (tuple): (cell_size_x, cell_size_y)
+        corridor_threshold (double)
+
+    Returns:
+    accumulated cost raster to destination
+
+    """
+    path_cost = min(source_cost_acc[row, col] for row, col in destination)
+    valid = np.isfinite(raster_clip)
+    if not np.isfinite(path_cost) or not valid.any():
+        return sk_graph.MCP_Geometric(raster_clip, sampling=cell_size).find_costs(destination)[0]
+
+    # lower bound of cost to destination from straight line distance
+    rows, cols = np.indices(raster_clip.shape)
+    dist = np.full(raster_clip.shape, np.inf)
+    for row, col in destination:
+        dist = np.minimum(dist, np.hypot((rows - row) * cell_size[0], (cols - col) * cell_size[1]))
+
+    cost_bound = path_cost + corridor_threshold
+    min_cost = float(np.min(raster_clip[valid]))
+    region = source_cost_acc + min_cost * dist < cost_bound * (1 + 1e-9)
+    region_rows = np.flatnonzero(region.any(axis=1))
+    region_cols = np.flatnonzero(region.any(axis=0))
+    row_0, row_1 = region_rows[0], region_rows[-1] + 1
+    col_0, col_1 = region_cols[0], region_cols[-1] + 1
+    if (row_1 - row_0) * (col_1 - col_0) == raster_clip.size:
+        return sk_graph.MCP_Geometric(raster_clip, sampling=cell_size).find_costs(destination)[0]
+
+    mcp_dest = sk_graph.MCP_Geometric(raster_clip[row_0:row_1, col_0:col_1], sampling=cell_size)
+    window_dest = [(row - row_0, col - col_0) for row, col in destination]
+    dest_cost_acc = np.full(raster_clip.shape, np.inf)
+    dest_cost_acc[row_0:row_1, col_0:col_1] = mcp_dest.find_costs(window_dest)[0]
+
+    # cells reachable from source are reachable from destination too
+    far = np.isfinite(source_cost_acc) & ~np.isfinite(dest_cost_acc)
+    dest_cost_acc[far] = 2 * cost_bound + corridor_threshold
+
+    return dest_cost_acc
+
+
+def clip_cost_raster(in_raster, clip_geom, buffer, cost_file=None):
+    """
+    Clip cost raster around geometry.
+
+    Args:
+        in_raster: CHM raster file
+        clip_geom: shapely geometry used to clip
+        buffer (float): buffer distance of clip_geom
+        cost_file: precomputed cost surface, see algo_cost.cost_raster_tiled.
+            When provided, cost is clipped from it instead of computed from CHM.
+
+    Returns:
+        tuple: (cost array, raster meta)
+
+    """
+    if cost_file:
+        cost_clip, out_meta = sp_common.clip_raster(cost_file, clip_geom, buffer)
+        return algo_cost.cost_clip_from_surface(cost_clip), out_meta
+
+    ras_clip, out_meta = sp_common.clip_raster(in_raster, clip_geom, buffer)
+    cost_clip, _ = algo_cost.cost_raster(ras_clip, out_meta)
+    return cost_clip, out_meta
+
+
+def clip_cost_window(cost_clip, out_meta, clip_geom, buffer):
+    """
+    Clip cost array already in memory around geometry.
+
+    Sub-window of cost_clip covering buffered clip_geom, cells outside the
+    buffer are set to nan. Used to avoid clipping raster and computing cost again.
+
+    Args:
+        cost_clip (np.ndarray): cost array returned by clip_cost_raster
+        out_meta: raster meta of cost_clip
+        clip_geom: shapely geometry used to clip
+        buffer (float): buffer distance of clip_geom
+
+    Returns:
+        tuple: (cost array, raster meta), None when geometry is out of cost_clip
+
+    """
+    if len(cost_clip.shape) > 2:
+        cost_clip = np.squeeze(cost_clip, axis=0)
+
+    outside = rasterio.features.geometry_mask(
+        [clip_geom.buffer(buffer)], out_shape=cost_clip.shape, transform=out_meta["transform"]
+    )
+    rows = np.flatnonzero(~outside.all(axis=1))
+    cols = np.flatnonzero(~outside.all(axis=0))
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+
+    window = rasterio.windows.Window(cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1)
+    row_slice, col_slice = window.toslices()
+    cost_window = np.array(cost_clip[row_slice, col_slice], dtype=float)
+    cost_window[outside[row_slice, col_slice]] = np.nan
+
+    window_meta = out_meta.copy()
+    window_meta.update(
+        {
+            "height": cost_window.shape[0],
+            "width": cost_window.shape[1],
+            "transform": rasterio.windows.transform(window, out_meta["transform"]),
+        }
+    )
+
+    return cost_window, window_meta
+
+
+def prepare_cost_surface(in_raster, out_file, cost_file=None, precompute_cost=False, processes=1):
+    """
+    Prepare precomputed cost surface for tools.
+
+    Args:
+        in_raster: CHM raster file
+        out_file: tool output file, default cost surface is saved beside it
+        cost_file: existing or new cost surface file
+        precompute_cost (bool): compute cost surface from CHM
+        processes (int): number of processes
+
+    Returns:
+        cost surface file, None when cost is computed per line
+
+    """
+    if precompute_cost:
+        if not cost_file:
+            out_path = Path(out_file)
+            cost_file = out_path.with_name(out_path.stem + "_cost.tif").as_posix()
+
+        algo_cost.cost_raster_tiled(in_raster, cost_file, processes=processes)
+
+    return cost_file
+
+
 def remove_holes(geom):
     if geom.geom_type == "Polygon":
         if geom.interiors:
@@ -13,8 +13,13 @@ Description:
     This file hosts cost raster related functions.
 """
 
+import math
+from multiprocessing.pool import Pool
+
 import numpy as np
+import rasterio
 import scipy
+from rasterio.windows import Window
 
 import beratools.core.constants as bt_const
 
@@ -59,9 +64,207 @@ def cost_raster(
     return cost_clip, dyn_canopy_ndarray
 
 
-def remove_nan_from_array_refactor(matrix, replacement_value=bt_const.BT_NODATA_COST):
-    # Use boolean indexing to replace nan values
-    matrix[np.isnan(matrix)] = replacement_value
+def canopy_raster(in_raster, canopy_ht_threshold=2.5):
+    """Canopy raster with NaN as nodata, same as the second output of cost_raster."""
+    if len(in_raster.shape) > 2:
+        in_raster = np.squeeze(in_raster, axis=0)
+
+    dyn_canopy_ndarray = dyn_np_cc_map(in_raster, canopy_ht_threshold)
+    dyn_canopy_ndarray[in_raster == bt_const.BT_NODATA] = np.nan
+
+    return dyn_canopy_ndarray
+
+
+def cost_raster_halo(meta, tree_radius=2.5, max_line_dist=2.5):
+    """
+    Return number of cells cost_raster depends on around each cell.
+
+    Focal statistics reach kernel radius, and smoothed cost is capped at max_line_dist.
+    """
+    cell_x, cell_y = meta["transform"][0], -meta["transform"][4]
+    kernel_radius = int(tree_radius / cell_x)
+    dist_cells = math.ceil(float(max_line_dist) / min(cell_x, cell_y))
+
+    return max(kernel_radius, dist_cells) + 1
+
+
+def _read_chm_tile(dataset, window):
+    """Read CHM window, nodata regulated to BT_NODATA same as clip_raster."""
+    tile = dataset.read(1, window=window, masked=True)
+    tile = np.ma.masked_invalid(tile)
+    tile = tile.astype(float).filled(bt_const.BT_NODATA)
+    tile = np.ma.masked_where(tile == bt_const.BT_NODATA, tile)
+    tile.fill_value = bt_const.BT_NODATA
+
+    return tile
+
+
+def _cost_surface_tile(tile_args):
+    in_chm, window, inner, cost_params = tile_args
+    with rasterio.open(in_chm) as dataset:
+        chm_tile = _read_chm_tile(dataset, window)
+        meta = dataset.meta.copy()
+        meta["transform"] = dataset.window_transform(window)
+
+    cost_tile, _ = cost_raster(chm_tile, meta, **cost_params)
+    row_start, row_stop, col_start, col_stop = inner
+
+    return cost_tile[row_start:row_stop, col_start:col_stop].astype(np.float32)
+
+
+def cost_raster_tiled(
+    in_chm,
+    out_cost,
+    tile_size=bt_const.COST_SURFACE_TILE_SIZE,
+    processes=1,
+    tree_radius=2.5,
+    canopy_ht_threshold=2.5,
+    max_line_dist=2.5,
+    canopy_avoid=0.4,
+    cost_raster_exponent=1.5,
+):
+    """
+    Precompute cost surface for whole CHM tile by tile.
+
+    Each tile is read with a halo wide enough for focal statistics and
+    distance transform, so cost values at tile edges equal those computed
+    from the whole raster. Output is a tiled, compressed float32 GeoTIFF
+    aligned with the CHM, nodata is NaN.
+
+    Args:
+        in_chm: input CHM raster file
+        out_cost: output cost raster file
+        tile_size (int): tile size in cells, without halo
+        processes (int): number of processes computing tiles
+        tree_radius, canopy_ht_threshold, max_line_dist, canopy_avoid,
+        cost_raster_exponent: same as cost_raster
+
+    Returns:
+        out_cost: output cost raster file
+
+    """
+    cost_params = {
+        "tree_radius": tree_radius,
+        "canopy_ht_threshold": canopy_ht_threshold,
+        "max_line_dist": max_line_dist,
+        "canopy_avoid": canopy_avoid,
+        "cost_raster_exponent": cost_raster_exponent,
+    }
+
+    with rasterio.open(in_chm) as dataset:
+        out_meta = dataset.meta.copy()
+        width, height = dataset.width, dataset.height
+
+    halo = cost_raster_halo(out_meta, tree_radius, max_line_dist)
+    tile_size = max(16, int(tile_size) // 16 * 16)  # GeoTIFF blocks are multiples of 16
+    out_meta.update(
+        {
+            "driver": "GTiff",
+            "dtype": "float32",
+            "count": 1,
+            "nodata": np.nan,
+            "tiled": True,
+            "blockxsize": min(256, tile_size),
+            "blockysize": min(256, tile_size),
+            "compress": "deflate",
+            "predictor": 3,
+            "BIGTIFF": "IF_SAFER",
+        }
+    )
+
+    tile_args = []
+    tile_windows = []
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            tile = Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+
+            # tile window with halo, limited to raster extent
+            row_start = max(0, row_off - halo)
+            col_start = max(0, col_off - halo)
+            row_stop = min(height, row_off + tile.height + halo)
+            col_stop = min(width, col_off + tile.width + halo)
+            window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+            inner = (
+                row_off - row_start,
+                row_off - row_start + tile.height,
+                col_off - col_start,
+                col_off - col_start + tile.width,
+            )
+            tile_args.append((in_chm, window, inner, cost_params))
+            tile_windows.append(tile)
+
+    total_steps = len(tile_args)
+    print(f"Computing cost surface in {total_steps} tiles, halo of {halo} cells ...", flush=True)
+    with rasterio.open(out_cost, "w", **out_meta) as dest:
+        if processes > 1:
+            with Pool(processes) as pool:
+                for step, cost_tile in enumerate(pool.imap(_cost_surface_tile, tile_args), start=1):
+                    dest.write(cost_tile, 1, window=tile_windows[step - 1])
+                    print(f" %{step / total_steps * 100} ", flush=True)
+        else:
+            for step, item in enumerate(tile_args, start=1):
+                dest.write(_cost_surface_tile(item), 1, window=tile_windows[step - 1])
+                print(f" %{step / total_steps * 100} ", flush=True)
+
+    print(f"Cost surface saved to {out_cost}", flush=True)
+    return out_cost
+
+
+def cost_clip_from_surface(cost_clip):
+    """
+    Regulate cost clip read from precomputed cost surface.
+
+    clip_raster returns masked array with BT_NODATA, cost_raster returns
+    2D array with NaN as nodata. This converts the former to the latter.
+    """
+    if len(cost_clip.shape) > 2:
+        cost_clip = np.squeeze(cost_clip, axis=0)
+
+    return np.ma.filled(np.ma.masked_invalid(cost_clip).astype(float), np.nan)
+
+
+def nodata_mask(matrix, nodata=None, below_nodata=False):
+    """
+    Boolean mask of NaN and nodata cells.
+
+    Args:
+        matrix (np.ndarray): raster array
+        nodata: nodata value, None when only NaN is nodata
+        below_nodata (bool): cells less than nodata are nodata as well
+
+    """
+    invalid = np.isnan(matrix)
+    if nodata is not None and not np.isnan(nodata):
+        if below_nodata:
+            invalid |= matrix <= nodata
+        else:
+            invalid |= np.isclose(matrix, nodata)
+
+    return invalid
+
+
+def normalize_nodata(
+    matrix, nodata=None, replacement_value=bt_const.BT_NODATA_COST, below_nodata=False
+):
+    """
+    Replace NaN and nodata cells in place, such as nodata to inf for skimage graph.
+
+    Args:
+        matrix (np.ndarray): float raster array, changed in place
+        nodata: nodata value, None when only NaN is nodata
+        replacement_value: new value of NaN and nodata cells
+        below_nodata (bool): cells less than nodata are nodata as well
+
+    Returns:
+        bool: True when valid cells contain negative values
+
+    """
+    invalid = nodata_mask(matrix, nodata, below_nodata)
+    contains_negative = bool(np.any((matrix < 0) & ~invalid))
+    matrix[invalid] = replacement_value
+
+    return contains_negative
 
 
 def dyn_np_cc_map(in_chm, canopy_ht_threshold):
@@ -78,6 +281,117 @@ def dyn_np_cc_map(in_chm, canopy_ht_threshold):
 
 
 def cost_focal_stats(canopy_ndarray, kernel):
+    """
+    Compute focal standard deviation and mean with circular kernel.
+
+    NaN/masked cells are excluded from both statistics, same as np.nanmean/np.nanstd.
+
+    Args:
+        canopy_ndarray (np.ma.MaskedArray): canopy raster
+        kernel (np.ndarray): focal kernel, see circle_kernel_refactor
+
+    Returns:
+        tuple: (std_array, mean_array)
+
+    """
+    mask = canopy_ndarray.mask
+    in_ndarray = np.ma.where(mask, np.nan, canopy_ndarray)
+
+    return focal_std_mean(np.ma.getdata(in_ndarray), kernel)
+
+
+def focal_std_mean(in_ndarray, kernel):
+    """
+    Vectorized focal standard deviation and mean by normalized convolution.
+
+    Sum, sum of squares and valid cell count are accumulated over the kernel
+    footprint, NaN cells contribute nothing to any of them. Edges use the same
+    "nearest" extension as scipy.ndimage.generic_filter, so the results match
+    cost_focal_stats_generic within float tolerance.
+
+    Args:
+        in_ndarray (np.ndarray): 2D array, NaN for nodata
+        kernel (np.ndarray): focal kernel, non-zero cells are in footprint
+
+    Returns:
+        tuple: (std_array, mean_array), NaN where footprint has no valid cell
+
+    """
+    in_ndarray = np.asarray(in_ndarray, dtype=float)
+
+    valid = ~np.isnan(in_ndarray)
+    values = np.where(valid, in_ndarray, 0.0)
+
+    focal_sum = focal_kernel_sum(values, kernel)
+    focal_sum_sq = focal_kernel_sum(values * values, kernel)
+    focal_count = focal_kernel_sum(valid.astype(float), kernel)
+
+    # cell counts are integers, round off accumulated float error
+    focal_count = np.rint(focal_count)
+    has_value = focal_count > 0
+    count = np.where(has_value, focal_count, 1.0)
+
+    mean_array = focal_sum / count
+    var_array = focal_sum_sq / count - mean_array * mean_array
+    var_array[var_array < 0.0] = 0.0  # negative values caused by round-off
+    std_array = np.sqrt(var_array)
+
+    mean_array[~has_value] = np.nan
+    std_array[~has_value] = np.nan
+
+    return std_array, mean_array
+
+
+def focal_kernel_sum(in_ndarray, kernel):
+    """
+    Sum values over kernel footprint for every cell.
+
+    Each kernel row is split into runs of contiguous cells, and every run is
+    summed from horizontal running sums. A circular kernel has one run per row,
+    so the cost is proportional to kernel height instead of kernel area.
+    Same result as scipy.ndimage.correlate(in_ndarray, kernel != 0, mode="nearest").
+
+    Args:
+        in_ndarray (np.ndarray): 2D array without NaN
+        kernel (np.ndarray): focal kernel, non-zero cells are in footprint
+
+    Returns:
+        np.ndarray: focal sum array
+
+    """
+    footprint = np.asarray(kernel) != 0
+    k_rows, k_cols = footprint.shape
+    pad_y, pad_x = k_rows // 2, k_cols // 2
+    padded = np.pad(
+        in_ndarray,
+        ((pad_y, k_rows - 1 - pad_y), (pad_x, k_cols - 1 - pad_x)),
+        mode="edge",
+    )
+
+    # running sum with leading zero column, run sum is run_sum[stop] - run_sum[start]
+    run_sum = np.zeros((padded.shape[0], padded.shape[1] + 1))
+    np.cumsum(padded, axis=1, out=run_sum[:, 1:])
+
+    rows, cols = in_ndarray.shape
+    out_sum = np.zeros((rows, cols))
+    for k_row in range(k_rows):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], footprint[k_row].astype(np.int8), [0]))))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            out_sum += (
+                run_sum[k_row : k_row + rows, stop : stop + cols]
+                - run_sum[k_row : k_row + rows, start : start + cols]
+            )
+
+    return out_sum
+
+
+def cost_focal_stats_generic(canopy_ndarray, kernel):
+    """
+    Compute focal statistics with per-pixel python callbacks.
+
+    This is the original implementation, kept as reference for validating
+    and benchmarking cost_focal_stats. It is slow on large rasters.
+    """
     mask = canopy_ndarray.mask
     in_ndarray = np.ma.where(mask, np.nan, canopy_ndarray)
 
@@ -101,9 +415,12 @@ def cost_norm_dist_transform(canopy_ndarray, max_line_dist, sampling):
     in_ndarray = canopy_ndarray.filled(np.nan)
 
     # Compute the Euclidean distance transform (edt) where the valid values are
-    euc_dist_array = scipy.ndimage.distance_transform_edt(
-        np.logical_not(np.isnan(in_ndarray)), sampling=sampling
-    )
+    valid_cells = np.logical_not(np.isnan(in_ndarray))
+    if valid_cells.all():
+        # no nodata cell to measure distance from, edt is not defined
+        euc_dist_array = np.full(in_ndarray.shape, np.inf)
+    else:
+        euc_dist_array = scipy.ndimage.distance_transform_edt(valid_cells, sampling=sampling)
 
     # Apply the mask back to set the distances to np.nan
     euc_dist_array[canopy_ndarray.mask] = np.nan
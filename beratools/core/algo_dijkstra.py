@@ -19,19 +19,23 @@ the Free Software Foundation; either version 2 of the License, or
 # This will get replaced with a git SHA1 when you do a git archive
 __revision__ = "$Format:%H$"
 
+import heapq
 import math
 import queue
+import time
 from collections import defaultdict
 
 import numpy as np
 import rasterio
+import shapely
 import shapely.geometry as sh_geom
 import skimage.graph as sk_graph
+from scipy import ndimage
 
+import beratools.core.algo_cost as algo_cost
 import beratools.core.constants as bt_const
 
 sqrt2 = math.sqrt(2)
-USE_NUMPY_FOR_DIJKSTRA = True
 
 
 class MinCostPathHelper:
@@ -68,38 +72,18 @@ class MinCostPathHelper:
 
     @staticmethod
     def block2matrix_numpy(block, nodata):
-        contains_negative = False
-        with np.nditer(block, flags=["refs_ok"], op_flags=["readwrite"]) as it:
-            for x in it:
-                # TODO: this speeds up a lot, but need further inspection
-                # if np.isclose(x, nodata) or np.isnan(x):
-                if x <= nodata or np.isnan(x):
-                    x[...] = 9999.0
-                elif x < 0:
-                    contains_negative = True
+        # TODO: nodata is compared by <=, np.isclose needs further inspection
+        contains_negative = algo_cost.normalize_nodata(block, nodata, 9999.0, below_nodata=True)
 
         return block, contains_negative
 
     @staticmethod
     def block2matrix(block, nodata):
-        contains_negative = False
-        width, height = block.shape
-        # TODO: deal with nodata
-        matrix = [
-            [
-                None
-                if np.isclose(block[i][j], nodata) or np.isclose(block[i][j], bt_const.BT_NODATA)
-                else block[i][j]
-                for j in range(height)
-            ]
-            for i in range(width)
-        ]
+        invalid = algo_cost.nodata_mask(block, nodata) | algo_cost.nodata_mask(block, bt_const.BT_NODATA)
+        contains_negative = bool(np.any((block < 0) & ~invalid))
 
-        for row in matrix:
-            for v in row:
-                if v is not None:
-                    if v < 0 and not np.isclose(v, bt_const.BT_NODATA):
-                        contains_negative = True
+        # nested lists with None as impassable cells, used by dijkstra
+        matrix = np.where(invalid, None, block.astype(object)).tolist()
 
         return matrix, contains_negative
 
@@ -247,7 +231,7 @@ def dijkstra(start_tuple, end_tuples, block, find_nearest, feedback=None):
                 costs.append(0.0)
             path.reverse()
             costs.reverse()
-            result.append((path, costs, end_dict[current_node]))
+            result.append((path, costs, end_dict[current_node][0]))
 
             end_row_cols.remove(current_node)
             end_row_col_list.remove(current_node)
@@ -334,7 +318,9 @@ def backtrack(initial_node, desired_node, distances):
     return list(reversed(path))
 
 
-def dijkstra_np(start_tuple, end_tuple, matrix):
+def dijkstra_np(
+    start_tuple, end_tuple, matrix, pyramid_factors=(), pyramid_band=bt_const.LCP_PYRAMID_BAND
+):
     """
     Dijkstra's algorithm for finding the shortest path between two nodes in a graph.
 
@@ -342,6 +328,8 @@ def dijkstra_np(start_tuple, end_tuple, matrix):
         start_node (list): [row,col] coordinates of the initial node
         end_node (list): [row,col] coordinates of the desired node
         matrix (array 2d): numpy array that contains matrix as 1s and free space as 0s
+        pyramid_factors (tuple): downsample factors of route_through_pyramid, empty for full search
+        pyramid_band (int): band of route_through_pyramid
 
     Returns:
         list[list]: list of list of nodes that form the shortest path
@@ -357,7 +345,10 @@ def dijkstra_np(start_tuple, end_tuple, matrix):
         matrix[start_node[0], start_node[1]] = 0
         matrix[end_node[0], end_node[1]] = 0
 
-        path, cost = sk_graph.route_through_array(matrix, start_node, end_node)
+        if pyramid_factors:
+            path, cost = route_through_pyramid(matrix, start_node, end_node, pyramid_factors, pyramid_band)
+        else:
+            path, cost = sk_graph.route_through_array(matrix, start_node, end_node)
         costs = [0.0 for i in range(len(path))]
     except Exception as e:
         print(f"dijkstra_np: {e}")
@@ -366,7 +357,314 @@ def dijkstra_np(start_tuple, end_tuple, matrix):
     return [(path, costs, end_tuple)]
 
 
-def find_least_cost_path(out_image, in_meta, line, find_nearest=True, output_linear_reference=False):
+def astar(cost, start, targets, find_nearest=True):
+    """
+    Find least cost path on flat cost array by A* search.
+
+    Cells are 8-connected and the cost between neighbours is
+    length * (cost_1 + cost_2) / 2, same as skimage MCP_Geometric, so path costs
+    are identical to route_through_array. The heuristic is octile distance to
+    the nearest target scaled by the minimum edge cost per cell length.
+
+    Args:
+        cost (np.ndarray): 2D cost raster, nan, inf and negative cells are impassable
+        start (tuple): start cell (row, col)
+        targets (list of tuple): target cells (row, col)
+        find_nearest (bool): stop at the nearest target, otherwise find paths to all targets
+
+    Returns:
+        list: (path, costs, target) in the order targets are reached. path is a list
+        of (row, col) and costs are accumulated costs along path.
+
+    """
+    cost = np.asarray(cost, dtype=float)
+    rows, cols = cost.shape
+    passable = cost >= 0  # False for nan
+    passable &= np.isfinite(cost)
+
+    # pad with impassable cells, no bounds check for neighbours
+    width = cols + 2
+    flat_cost = np.full((rows + 2, width), np.inf)
+    flat_cost[1:-1, 1:-1] = np.where(passable, cost, np.inf)
+    flat_cost = flat_cost.ravel().tolist()
+
+    start = tuple(int(i) for i in start)
+    start_index = (start[0] + 1) * width + start[1] + 1
+    target_cells = {}
+    for cell in targets:
+        cell = tuple(int(i) for i in cell)
+        if 0 <= cell[0] < rows and 0 <= cell[1] < cols and passable[cell]:
+            target_cells[(cell[0] + 1) * width + cell[1] + 1] = cell
+
+    if not (0 <= start[0] < rows and 0 <= start[1] < cols and passable[start]) or not target_cells:
+        return []
+
+    # edge cost per length is at least min_cost between regular cells, targets may be cheaper
+    regular = passable.copy()
+    regular[start] = False
+    for cell in target_cells.values():
+        regular[cell] = False
+
+    target_cost = min(flat_cost[index] for index in target_cells)
+    min_cost = float(np.min(cost[regular])) if regular.any() else target_cost
+    weight = min(min_cost, 0.5 * (min_cost + target_cost)) * (1 - 1e-9)  # keep admissible after rounding
+
+    heuristic = np.full((rows + 2, width), np.inf)
+    row_index, col_index = np.indices((rows, cols))
+    for row, col in target_cells.values():
+        d_row = np.abs(row_index - row)
+        d_col = np.abs(col_index - col)
+        octile = np.maximum(d_row, d_col) + (sqrt2 - 1) * np.minimum(d_row, d_col)
+        heuristic[1:-1, 1:-1] = np.minimum(heuristic[1:-1, 1:-1], weight * octile)
+    heuristic = heuristic.ravel().tolist()
+
+    neighbours = [
+        (-width - 1, sqrt2),
+        (-width, 1.0),
+        (-width + 1, sqrt2),
+        (-1, 1.0),
+        (1, 1.0),
+        (width - 1, sqrt2),
+        (width, 1.0),
+        (width + 1, sqrt2),
+    ]
+
+    size = len(flat_cost)
+    cost_so_far = [math.inf] * size
+    came_from = [-1] * size
+    closed = bytearray(size)
+    cost_so_far[start_index] = 0.0
+    open_set = [(heuristic[start_index], start_index)]
+
+    result = []
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if closed[current]:
+            continue
+
+        closed[current] = 1
+        if current in target_cells:
+            path = []
+            costs = []
+            node = current
+            while node != -1:
+                path.append((node // width - 1, node % width - 1))
+                costs.append(cost_so_far[node])
+                node = came_from[node]
+
+            path.reverse()
+            costs.reverse()
+            result.append((path, costs, target_cells.pop(current)))
+            if find_nearest or not target_cells:
+                break
+
+        current_cost = flat_cost[current]
+        current_acc = cost_so_far[current]
+        for offset, length in neighbours:
+            nex = current + offset
+            if closed[nex]:
+                continue
+
+            nex_cost = flat_cost[nex]
+            if nex_cost == math.inf:
+                continue
+
+            new_cost = current_acc + length * 0.5 * (current_cost + nex_cost)
+            if new_cost < cost_so_far[nex]:
+                cost_so_far[nex] = new_cost
+                came_from[nex] = current
+                heapq.heappush(open_set, (new_cost + heuristic[nex], nex))
+
+    return result
+
+
+def astar_np(start_tuple, end_tuples, matrix, find_nearest=True):
+    """
+    Run A* on cost matrix, start and end cells are set free like dijkstra_np.
+
+    Returns:
+        list: (path, costs, end_tuple), same as dijkstra
+
+    """
+    start_node = start_tuple[0]
+    try:
+        matrix[start_node[0], start_node[1]] = 0
+        for end_tuple in end_tuples:
+            matrix[end_tuple[0][0], end_tuple[0][1]] = 0
+
+        result = astar(matrix, start_node, [end_tuple[0] for end_tuple in end_tuples], find_nearest)
+    except Exception as e:
+        print(f"astar_np: {e}")
+        return None
+
+    end_dict = {tuple(end_tuple[0]): end_tuple for end_tuple in end_tuples}
+    return [(path, costs, end_dict[target]) for path, costs, target in result]
+
+
+def downsample_cost(cost, factor):
+    """
+    Block mean of passable cells, blocks without passable cells are impassable.
+
+    Args:
+        cost (np.ndarray): 2D cost raster, inf and nan cells are impassable
+        factor (int): block size in cells
+
+    Returns:
+        np.ndarray: cost raster of shape ceil(shape / factor)
+
+    """
+    rows, cols = cost.shape
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    padded = np.full((out_rows * factor, out_cols * factor), np.nan)
+    padded[:rows, :cols] = np.where(np.isfinite(cost), cost, np.nan)
+    blocks = padded.reshape(out_rows, factor, out_cols, factor)
+
+    count = np.sum(~np.isnan(blocks), axis=(1, 3))
+    total = np.nansum(blocks, axis=(1, 3))
+    coarse = np.full(count.shape, np.inf)
+    np.divide(total, count, out=coarse, where=count > 0)
+
+    return coarse
+
+
+def route_through_pyramid(
+    cost, start, end, factors=bt_const.LCP_PYRAMID_FACTORS, band=bt_const.LCP_PYRAMID_BAND
+):
+    """
+    Coarse to fine least cost path, same input and output as route_through_array.
+
+    The path is solved on the cost raster downsampled by the largest factor first.
+    Each finer level, and finally the native resolution, only searches the band
+    of cells within band coarse cells of the path found on the coarser level.
+    Wider band gives paths closer to the exact one, see pyramid_path_deviation.
+
+    Args:
+        cost (np.ndarray): 2D cost raster
+        start (tuple): start cell (row, col)
+        end (tuple): end cell (row, col)
+        factors (tuple): downsample factors, such as (4,) or (8, 4, 2)
+        band (int): half width of search band in cells of coarser level
+
+    Returns:
+        tuple: (path, cost), path is list of (row, col)
+
+    """
+    band_mask = None
+    for factor in sorted(set(factors), reverse=True) + [1]:
+        level_cost = cost if band_mask is None else np.where(band_mask, cost, np.inf)
+        if factor > 1:
+            level_cost = downsample_cost(level_cost, factor)
+
+        level_start = (start[0] // factor, start[1] // factor)
+        level_end = (end[0] // factor, end[1] // factor)
+
+        # search inside bounding box of band only
+        row_0, col_0 = 0, 0
+        row_1, col_1 = level_cost.shape
+        if band_mask is not None:
+            band_rows = np.flatnonzero(band_mask.any(axis=1)) // factor
+            band_cols = np.flatnonzero(band_mask.any(axis=0)) // factor
+            row_0, row_1 = band_rows[0], band_rows[-1] + 1
+            col_0, col_1 = band_cols[0], band_cols[-1] + 1
+
+        try:
+            path, path_cost = sk_graph.route_through_array(
+                level_cost[row_0:row_1, col_0:col_1],
+                (level_start[0] - row_0, level_start[1] - col_0),
+                (level_end[0] - row_0, level_end[1] - col_0),
+            )
+        except ValueError:
+            # no path inside band, search the whole raster
+            return sk_graph.route_through_array(cost, start, end)
+
+        if factor == 1:
+            return [(int(row + row_0), int(col + col_0)) for row, col in path], path_cost
+
+        # band of native cells around coarse path
+        coarse_mask = np.zeros(level_cost.shape, dtype=bool)
+        path = np.array(path) + (row_0, col_0)
+        coarse_mask[path[:, 0], path[:, 1]] = True
+        if band > 0:
+            coarse_mask = ndimage.binary_dilation(coarse_mask, structure=np.ones((3, 3)), iterations=band)
+
+        band_mask = coarse_mask.repeat(factor, axis=0).repeat(factor, axis=1)
+        band_mask = band_mask[: cost.shape[0], : cost.shape[1]]
+
+    return sk_graph.route_through_array(cost, start, end)
+
+
+def pyramid_path_deviation(
+    cost, start, end, factors=bt_const.LCP_PYRAMID_FACTORS, band=bt_const.LCP_PYRAMID_BAND, cell_size=1.0
+):
+    """
+    Compare coarse to fine least cost path with the exact full resolution one.
+
+    Args:
+        cost (np.ndarray): 2D cost raster
+        start (tuple): start cell (row, col)
+        end (tuple): end cell (row, col)
+        factors (tuple): downsample factors of route_through_pyramid
+        band (int): band of route_through_pyramid
+        cell_size (float): cell size to report distances in map units
+
+    Returns:
+        dict: path costs, relative cost increase, Hausdorff and mean distance
+        between paths, and time of both searches in seconds
+
+    """
+    start_time = time.perf_counter()
+    exact_path, exact_cost = sk_graph.route_through_array(cost, start, end)
+    exact_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    pyramid_path, pyramid_cost = route_through_pyramid(cost, start, end, factors, band)
+    pyramid_time = time.perf_counter() - start_time
+
+    # path cells to x, y in cell_size units
+    exact_xy = np.array(exact_path, dtype=float)[:, ::-1] * cell_size
+    pyramid_xy = np.array(pyramid_path, dtype=float)[:, ::-1] * cell_size
+    exact_line = sh_geom.LineString(np.vstack([exact_xy, exact_xy[-1:]]))
+    pyramid_line = sh_geom.LineString(np.vstack([pyramid_xy, pyramid_xy[-1:]]))
+
+    return {
+        "exact_cost": float(exact_cost),
+        "pyramid_cost": float(pyramid_cost),
+        "cost_increase": float(pyramid_cost / exact_cost - 1) if exact_cost > 0 else 0.0,
+        "hausdorff": exact_line.hausdorff_distance(pyramid_line),
+        "mean_distance": float(np.mean(shapely.distance(exact_line, shapely.points(pyramid_xy)))),
+        "exact_time": exact_time,
+        "pyramid_time": pyramid_time,
+    }
+
+
+def find_least_cost_path(
+    out_image,
+    in_meta,
+    line,
+    find_nearest=True,
+    output_linear_reference=False,
+    engine=bt_const.LCP_ENGINE,
+    pyramid_factors=bt_const.LCP_PYRAMID_FACTORS,
+    pyramid_band=bt_const.LCP_PYRAMID_BAND,
+):
+    """
+    Find least cost path between line end points on cost raster.
+
+    Args:
+        out_image: cost raster
+        in_meta: raster meta
+        line: seed line
+        find_nearest (bool): used by dijkstra engine
+        output_linear_reference (bool): not implemented
+        engine (LeastCostPathEngine): search engine
+        pyramid_factors (tuple): coarse to fine search of skimage engine, such as (4,)
+            or (8, 4, 2). Empty for full resolution search, see route_through_pyramid.
+        pyramid_band (int): half width of search band in cells of coarser level
+
+    Returns:
+        LineString of least cost path, None when not found
+
+    """
     default_return = None
     ras_nodata = in_meta["nodata"]
 
@@ -377,10 +675,10 @@ def find_least_cost_path(out_image, in_meta, line, find_nearest=True, output_lin
     if len(out_image.shape) > 2:
         out_image = np.squeeze(out_image, axis=0)
 
-    if USE_NUMPY_FOR_DIJKSTRA:
-        matrix, contains_negative = MinCostPathHelper.block2matrix_numpy(out_image, ras_nodata)
-    else:
+    if engine == bt_const.LeastCostPathEngine.DIJKSTRA:
         matrix, contains_negative = MinCostPathHelper.block2matrix(out_image, ras_nodata)
+    else:
+        matrix, contains_negative = MinCostPathHelper.block2matrix_numpy(out_image, ras_nodata)
 
     if contains_negative:
         print("ERROR: Raster has negative values.")
@@ -419,7 +717,7 @@ def find_least_cost_path(out_image, in_meta, line, find_nearest=True, output_lin
         end_tuple = end_tuples[0]
 
         # regulate end point coords in case they are out of index of matrix
-        mat_size = matrix.shape
+        mat_size = np.shape(matrix)  # matrix is nested list for dijkstra
         mat_size = (mat_size[0] - 1, mat_size[0] - 1)
         start_tuple = (min(start_tuple[0], mat_size), start_tuple[1], start_tuple[2])
         end_tuple = (min(end_tuple[0], mat_size), end_tuple[1], end_tuple[2])
@@ -427,11 +725,13 @@ def find_least_cost_path(out_image, in_meta, line, find_nearest=True, output_lin
     except Exception as e:
         print(f"find_least_cost_path: {e}")
 
-    if USE_NUMPY_FOR_DIJKSTRA:
-        result = dijkstra_np(start_tuple, end_tuple, matrix)
-    else:
+    if engine == bt_const.LeastCostPathEngine.ASTAR:
+        result = astar_np(start_tuple, [end_tuple], matrix, find_nearest)
+    elif engine == bt_const.LeastCostPathEngine.DIJKSTRA:
         # TODO: change end_tuples to end_tuple
         result = dijkstra(start_tuple, end_tuples, matrix, find_nearest)
+    else:
+        result = dijkstra_np(start_tuple, end_tuple, matrix, pyramid_factors, pyramid_band)
 
     if result is None:
         return default_return
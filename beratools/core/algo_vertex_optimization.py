@@ -19,15 +19,12 @@ from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
-import pandas as pd
 import shapely.geometry as sh_geom
 from shapely import STRtree
 
 import beratools.core.algo_common as algo_common
-import beratools.core.algo_cost as algo_cost
 import beratools.core.constants as bt_const
 import beratools.core.tool_base as bt_base
-import beratools.utility.spatial_common as sp_common
 from beratools.core import algo_dijkstra
 
 
@@ -50,9 +47,10 @@ def update_line_end_pt(line, index, new_vertex):
 class _SingleLine:
     """Single line object with anchor point."""
 
-    def __init__(self, line_gdf, line_no, end_no, search_distance):
-        self.line_gdf = line_gdf
-        self.line = self.line_gdf.geometry[0]
+    __slots__ = ("line", "line_no", "end_no", "search_distance", "anchor")
+
+    def __init__(self, line, line_no, end_no, search_distance):
+        self.line = line
         self.line_no = line_no
         self.end_no = end_no
         self.search_distance = search_distance
@@ -114,7 +112,8 @@ class _SingleLine:
 class _Vertex:
     """Vertex object with multiple lines."""
 
-    def __init__(self, line_obj):
+    def __init__(self, line_obj, index=0):
+        self.index = index  # position in vertex group list
         self.vertex = line_obj.get_end_vertex()
         self.search_distance = line_obj.search_distance
 
@@ -123,6 +122,7 @@ class _Vertex:
         self.centerlines = None
         self.anchors = None
         self.in_raster = None
+        self.cost_file = None
         self.line_radius = None
         self.lines = []  # SingleLine objects
 
@@ -251,13 +251,15 @@ class _Vertex:
             if len(self.anchors) == 4:
                 seed_line = sh_geom.LineString(self.anchors[0:2])
 
-                raster_clip, out_meta = sp_common.clip_raster(self.in_raster, seed_line, self.line_radius)
-                raster_clip, _ = algo_cost.cost_raster(raster_clip, out_meta)
+                raster_clip, out_meta = algo_common.clip_cost_raster(
+                    self.in_raster, seed_line, self.line_radius, self.cost_file
+                )
                 centerline_1 = find_lc_path(raster_clip, out_meta, seed_line)
                 seed_line = sh_geom.LineString(self.anchors[2:4])
 
-                raster_clip, out_meta = sp_common.clip_raster(self.in_raster, seed_line, self.line_radius)
-                raster_clip, _ = algo_cost.cost_raster(raster_clip, out_meta)
+                raster_clip, out_meta = algo_common.clip_cost_raster(
+                    self.in_raster, seed_line, self.line_radius, self.cost_file
+                )
                 centerline_2 = find_lc_path(raster_clip, out_meta, seed_line)
 
                 if centerline_1 and centerline_2:
@@ -265,8 +267,9 @@ class _Vertex:
             elif len(self.anchors) == 2:
                 seed_line = sh_geom.LineString(self.anchors)
 
-                raster_clip, out_meta = sp_common.clip_raster(self.in_raster, seed_line, self.line_radius)
-                raster_clip, _ = algo_cost.cost_raster(raster_clip, out_meta)
+                raster_clip, out_meta = algo_common.clip_cost_raster(
+                    self.in_raster, seed_line, self.line_radius, self.cost_file
+                )
                 centerline_1 = find_lc_path(raster_clip, out_meta, seed_line)
 
                 if centerline_1:
@@ -281,6 +284,22 @@ class _Vertex:
         self.centerlines = [centerline_1, centerline_2]
         self.vertex_opt = intersection
 
+    def to_record(self):
+        """Return ResultRecord of optimized vertex, least cost paths and anchors."""
+        record = bt_base.ResultRecord(self.index)
+        if self.vertex_opt is not None:
+            record.add_rows("vertex", [self.vertex_opt])
+        record.add_rows("centerlines", [item for item in self.centerlines or [] if item is not None])
+        record.add_rows("anchors", [item for item in self.anchors or [] if item is not None])
+        return record
+
+    def update(self, record):
+        """Set optimized vertex, least cost paths and anchors from ResultRecord of worker."""
+        vertex = record.geometries("vertex")
+        self.vertex_opt = vertex[0] if len(vertex) > 0 else None
+        self.centerlines = list(record.geometries("centerlines"))
+        self.anchors = list(record.geometries("anchors"))
+
     def get_lines(self):
         lines = [item.line for item in self.lines]
         return lines
@@ -303,9 +322,11 @@ class VertexGrouping:
         verbose,
         in_layer=None,
         out_layer=None,
+        cost_file=None,
     ):
         self.in_line = in_line
         self.in_raster = in_raster
+        self.cost_file = cost_file
         self.line_radius = float(line_radius)
         self.search_distance = float(search_distance)
         self.out_line = out_line
@@ -319,7 +340,8 @@ class VertexGrouping:
         self.vertex_grp = []
         self.sindex = None
 
-        self.line_list = []
+        self.line_table = None
+        self.line_list = []  # line geometries, updated by optimized vertices
         self.line_visited = None
 
         # calculate cost raster footprint
@@ -338,7 +360,7 @@ class VertexGrouping:
         """
         # all end points not added will stay with this vertex
         vertex = line_obj.get_end_vertex()
-        vertex_obj = _Vertex(line_obj)
+        vertex_obj = _Vertex(line_obj, len(self.vertex_grp))
         search = self.sindex.query(vertex.buffer(bt_const.SMALL_BUFFER))
 
         # add more vertices to the new group
@@ -360,14 +382,18 @@ class VertexGrouping:
                     self.line_visited[i][-1] = True
 
         vertex_obj.in_raster = self.in_raster
+        vertex_obj.cost_file = self.cost_file
 
         vertex_obj.line_radius = self.line_radius
         vertex_obj.cost_footprint = self.cost_footprint
         self.vertex_grp.append(vertex_obj)
 
     def create_all_vertex_groups(self):
-        self.line_list = algo_common.prepare_lines_gdf(self.in_line, layer=self.in_layer, proc_segments=True)
-        self.sindex = STRtree([item.geometry[0] for item in self.line_list])
+        self.line_table = algo_common.prepare_line_table(
+            self.in_line, layer=self.in_layer, proc_segments=True
+        )
+        self.line_list = list(self.line_table.geometries())
+        self.sindex = STRtree(self.line_list)
         self.line_visited = [{0: False, -1: False} for _ in range(len(self.line_list))]
 
         i = 0
@@ -400,14 +426,14 @@ class VertexGrouping:
                 if not vertex_obj.vertex_opt:
                     continue
 
-                old_line = self.line_list[line.line_no].geometry[0]
-                self.line_list[line.line_no].geometry = [
-                    update_line_end_pt(old_line, line.end_no, vertex_obj.vertex_opt)
-                ]
+                old_line = self.line_list[line.line_no]
+                self.line_list[line.line_no] = update_line_end_pt(
+                    old_line, line.end_no, vertex_obj.vertex_opt
+                )
 
     def save_all_layers(self, line_file):
         line_file = Path(line_file)
-        lines = pd.concat(self.line_list)
+        lines = self.line_table.to_gdf(self.line_list)
         lines.to_file(line_file, layer=self.out_layer)
         print(f"Saved output to: {line_file}", flush=True)
 
@@ -441,7 +467,7 @@ class VertexGrouping:
             vertices.to_file(aux_file, layer="vertices")
 
     def compute(self):
-        vertex_grp = bt_base.execute_multiprocessing(
+        result = bt_base.execute_multiprocessing(
             algo_common.process_single_item,
             self.vertex_grp,
             "Vertex Optimization",
@@ -450,4 +476,5 @@ class VertexGrouping:
             verbose=self.verbose,
         )
 
-        self.vertex_grp = vertex_grp
+        for record in result or []:
+            self.vertex_grp[record.index].update(record)
@@ -1,6 +1,5 @@
 import argparse
 import json
-import math
 import os.path
 import sys
 import time
@@ -12,8 +11,10 @@ import numpy as np
 import pandas as pd
 import shapely
 
+from beratools.core.algo_common import rate_of_change_cuts, ring_buffer_table
 from beratools.core.constants import *
 from beratools.tools.common import *
+from beratools.utility.percentile_index import open_percentile_index
 from beratools.utility.spatial_common import *
 
 
@@ -89,70 +90,25 @@ def main_canopy_threshold_relative(
 
     print("%{}".format(5))
 
-    worklnbuffer_dfLRing = gpd.GeoDataFrame.copy((workln_dfC),deep=True)
-    worklnbuffer_dfRRing = gpd.GeoDataFrame.copy((workln_dfC),deep=True)
-
     print("Create ring buffer for input line to find the forest edge....")
 
-    def multiringbuffer(df, nrings, ringdist):
-        """
-        Buffers an input dataframes geometry nring (number of rings) times, with a distance between
-        rings of ringdist and returns a list of non overlapping buffers
-        """
-
-        rings = []  # A list to hold the individual buffers
-        for ring in np.arange(0, ringdist, nrings):  # For each ring (1, 2, 3, ..., nrings)
-            big_ring = df["geometry"].buffer(
-                nrings + ring, single_sided=True, cap_style="flat"
-            )  # Create one big buffer
-            small_ring = df["geometry"].buffer(
-                ring, single_sided=True, cap_style="flat"
-            )  # Create one smaller one
-            the_ring = big_ring.difference(small_ring)  # Difference the big with the small to create a ring
-            if (
-                ~shapely.is_empty(the_ring)
-                or ~shapely.is_missing(the_ring)
-                or not None
-                or ~the_ring.area == 0
-            ):
-                if isinstance(the_ring, shapely.MultiPolygon) or isinstance(the_ring, shapely.Polygon):
-                    rings.append(the_ring)  # Append the ring to the rings list
-                else:
-                    if isinstance(the_ring, shapely.GeometryCollection):
-                        for i in range(0, len(the_ring.geoms)):
-                            if not isinstance(the_ring.geoms[i], shapely.LineString):
-                                rings.append(the_ring.geoms[i])
-            print(" %{} ".format((ring / ringdist) * 100))
-
-        return rings  # return the list
-
-    # Create a column with the rings as a list
-
-    worklnbuffer_dfLRing["mgeometry"] = worklnbuffer_dfLRing.apply(
-        lambda x: multiringbuffer(df=x, nrings=1, ringdist=15), axis=1
-    )
-
-    worklnbuffer_dfLRing = worklnbuffer_dfLRing.explode("mgeometry")  # Explode to create a row for each ring
-    worklnbuffer_dfLRing = worklnbuffer_dfLRing.set_geometry("mgeometry")
-    worklnbuffer_dfLRing = (
-        worklnbuffer_dfLRing.drop(columns=["geometry"]).rename_geometry("geometry").set_crs(workln_dfC.crs)
-    )
-    worklnbuffer_dfLRing["iRing"] = worklnbuffer_dfLRing.groupby(["OLnFID", "OLnSEG"]).cumcount()
-    worklnbuffer_dfLRing = worklnbuffer_dfLRing.sort_values(by=["OLnFID", "OLnSEG", "iRing"])
-    worklnbuffer_dfLRing = worklnbuffer_dfLRing.reset_index(drop=True)
+    # rings of both sides of all lines, joined with attributes of lines
+    rings = ring_buffer_table(workln_dfC.geometry.values, ring_count=15, ring_width=1)
+    attributes = pd.DataFrame(workln_dfC.drop(columns=workln_dfC.geometry.name))
+    side_rings = {}
+    for side in ("left", "right"):
+        ring_df = rings[rings["side"] == side]
+        worklnbuffer_df = gpd.GeoDataFrame(
+            attributes.iloc[ring_df["line"].to_numpy()].reset_index(drop=True),
+            geometry=ring_df.geometry.to_numpy(),
+            crs=workln_dfC.crs,
+        )
+        worklnbuffer_df["iRing"] = worklnbuffer_df.groupby(["OLnFID", "OLnSEG"]).cumcount()
+        worklnbuffer_df = worklnbuffer_df.sort_values(by=["OLnFID", "OLnSEG", "iRing"])
+        side_rings[side] = worklnbuffer_df.reset_index(drop=True)
 
-    worklnbuffer_dfRRing["mgeometry"] = worklnbuffer_dfRRing.apply(
-        lambda x: multiringbuffer(df=x, nrings=-1, ringdist=-15), axis=1
-    )
-
-    worklnbuffer_dfRRing = worklnbuffer_dfRRing.explode("mgeometry")  # Explode to create a row for each ring
-    worklnbuffer_dfRRing = worklnbuffer_dfRRing.set_geometry("mgeometry")
-    worklnbuffer_dfRRing = (
-        worklnbuffer_dfRRing.drop(columns=["geometry"]).rename_geometry("geometry").set_crs(workln_dfC.crs)
-    )
-    worklnbuffer_dfRRing["iRing"] = worklnbuffer_dfRRing.groupby(["OLnFID", "OLnSEG"]).cumcount()
-    worklnbuffer_dfRRing = worklnbuffer_dfRRing.sort_values(by=["OLnFID", "OLnSEG", "iRing"])
-    worklnbuffer_dfRRing = worklnbuffer_dfRRing.reset_index(drop=True)
+    worklnbuffer_dfLRing = side_rings["left"]
+    worklnbuffer_dfRRing = side_rings["right"]
 
     print("Task done.")
     print("%{}".format(20))
@@ -165,7 +121,9 @@ def main_canopy_threshold_relative(
     line_seg["LDist_Cut"] = np.nan
     print("%{}".format(80))
 
-    # calculate the Height percentile for each parallel area using CHM
+    # calculate the Height percentile for each parallel area using CHM, index of
+    # approximate percentiles is built before workers start when it is enabled
+    open_percentile_index(in_chm, build=True)
     worklnbuffer_dfLRing = multiprocessing_Percentile(
         worklnbuffer_dfLRing,
         int(canopy_percentile),
@@ -190,7 +148,7 @@ def main_canopy_threshold_relative(
     worklnbuffer_dfRRing = worklnbuffer_dfRRing.sort_values(by=["OLnFID", "OLnSEG", "iRing"])
     worklnbuffer_dfRRing = worklnbuffer_dfRRing.reset_index(drop=True)
 
-    result = multiprocessing_RofC(line_seg, worklnbuffer_dfLRing, worklnbuffer_dfRRing, processes)
+    result = rate_of_change_lines(line_seg, worklnbuffer_dfLRing, worklnbuffer_dfRRing)
     print("%{}".format(40))
     print("Task done.")
 
@@ -204,230 +162,42 @@ def main_canopy_threshold_relative(
     print("%{}".format(100))
 
 
-def rate_of_change(in_arg):  # ,max_chmht):
-    x = in_arg[0]
-    Olnfid = in_arg[1]
-    Olnseg = in_arg[2]
-    side = in_arg[3]
-    df = in_arg[4]
-    index = in_arg[5]
-
-    # Since the x interval is 1 unit, the array 'diff' is the rate of change (slope)
-    diff = np.ediff1d(x)
-    cut_dist = len(x) / 5
+def ring_percentile_array(ring_df, per_col, line_seg):
+    """
+    Arrange ring percentiles into array of lines x rings, rings of each line ordered by iRing.
 
-    median_percentile = np.nanmedian(x)
-    if not np.isnan(median_percentile):
-        cut_percentile = math.floor(median_percentile)
-    else:
-        cut_percentile = 0.5
-    found = False
-    changes = 1.50
-    Change = np.insert(diff, 0, 0)
-    scale_down = 1
-
-    # test the rate of change is > than 150% (1.5), if it is
-    # no result found then lower to 140% (1.4) until 110% (1.1)
-    try:
-        while not found and changes >= 1.1:
-            for ii in range(0, len(Change) - 1):
-                if x[ii] >= 0.5:
-                    if (Change[ii]) >= changes:
-                        cut_dist = (ii + 1) * scale_down
-                        cut_percentile = math.floor(x[ii])
-                        # median_diff=(cut_percentile-median_percentile)
-                        if 0.5 >= cut_percentile:
-                            if cut_dist > 5:
-                                cut_percentile = 2
-                                cut_dist = cut_dist * scale_down**3
-                                print(
-                                    "{}: OLnFID:{}, OLnSEG: {} @<0.5  found and modified".format(
-                                        side, Olnfid, Olnseg
-                                    ),
-                                    flush=True,
-                                )
-                        elif 0.5 < cut_percentile <= 5.0:
-                            if cut_dist > 6:
-                                cut_dist = cut_dist * scale_down**3  # 4.0
-                                print(
-                                    "{}: OLnFID:{}, OLnSEG: {} @0.5-5.0  found and modified".format(
-                                        side, Olnfid, Olnseg
-                                    ),
-                                    flush=True,
-                                )
-                        elif 5.0 < cut_percentile <= 10.0:
-                            if cut_dist > 8:  # 5
-                                cut_dist = cut_dist * scale_down**3
-                                print(
-                                    "{}: OLnFID:{}, OLnSEG: {} @5-10  found and modified".format(
-                                        side, Olnfid, Olnseg
-                                    ),
-                                    flush=True,
-                                )
-                        elif 10.0 < cut_percentile <= 15:
-                            if cut_dist > 5:
-                                cut_dist = cut_dist * scale_down**3  # 5.5
-                                print(
-                                    "{}: OLnFID:{}, OLnSEG: {} @10-15  found and modified".format(
-                                        side, Olnfid, Olnseg
-                                    ),
-                                    flush=True,
-                                )
-                        elif 15 < cut_percentile:
-                            if cut_dist > 4:
-                                cut_dist = cut_dist * scale_down**2
-                                cut_percentile = 15.5
-                                print(
-                                    "{}: OLnFID:{}, OLnSEG: {} @>15  found and modified".format(
-                                        side, Olnfid, Olnseg
-                                    ),
-                                    flush=True,
-                                )
-                        found = True
-                        print(
-                            "{}: OLnFID:{}, OLnSEG: {} rate of change found".format(side, Olnfid, Olnseg),
-                            flush=True,
-                        )
-                        break
-            changes = changes - 0.1
+    Returns:
+        tuple: (percentiles, ring_counts) of lines in line_seg, ring count is 0 for line without rings
 
-    except IndexError:
-        pass
+    """
+    ring_keys = pd.MultiIndex.from_arrays([ring_df["OLnFID"], ring_df["OLnSEG"]])
+    codes, keys = pd.factorize(ring_keys)
+    order = np.lexsort((ring_df["iRing"].to_numpy(), codes))
+    codes = codes[order]
 
-    # if still is no result found, lower to 10% (1.1), if no result found then default is used
-    if not found:
-        if 0.5 >= median_percentile:
-            cut_dist = 4 * scale_down  # 3
-            cut_percentile = 0.5
-        elif 0.5 < median_percentile <= 5.0:
-            cut_dist = 4.5 * scale_down  # 4.0
-            cut_percentile = math.floor(median_percentile)
-        elif 5.0 < median_percentile <= 10.0:
-            cut_dist = 5.5 * scale_down  # 5
-            cut_percentile = math.floor(median_percentile)
-        elif 10.0 < median_percentile <= 15:
-            cut_dist = 6 * scale_down  # 5.5
-            cut_percentile = math.floor(median_percentile)
-        elif 15 < median_percentile:
-            cut_dist = 5 * scale_down  # 5
-            cut_percentile = 15.5
-        print(
-            "{}: OLnFID:{}, OLnSEG: {} Estimated".format(side, Olnfid, Olnseg),
-            flush=True,
-        )
-    if side == "Right":
-        df["RDist_Cut"] = cut_dist
-        df["CR_CutHt"] = cut_percentile
-    elif side == "Left":
-        df["LDist_Cut"] = cut_dist
-        df["CL_CutHt"] = cut_percentile
-
-    return df
-
-
-def multiprocessing_RofC(line_seg, worklnbuffer_dfLRing, worklnbuffer_dfRRing, processes):
-    in_argsL = []
-    in_argsR = []
-
-    for index in line_seg.index:
-        resultsL = []
-        resultsR = []
-        Olnfid = int(line_seg.OLnFID.iloc[index])
-        Olnseg = int(line_seg.OLnSEG.iloc[index])
-        sql_dfL = worklnbuffer_dfLRing.loc[
-            (worklnbuffer_dfLRing["OLnFID"] == Olnfid) & (worklnbuffer_dfLRing["OLnSEG"] == Olnseg)
-        ].sort_values(by=["iRing"])
-        PLRing = list(sql_dfL["Percentile_LRing"])
-        sql_dfR = worklnbuffer_dfRRing.loc[
-            (worklnbuffer_dfRRing["OLnFID"] == Olnfid) & (worklnbuffer_dfRRing["OLnSEG"] == Olnseg)
-        ].sort_values(by=["iRing"])
-        PRRing = list(sql_dfR["Percentile_RRing"])
-        in_argsL.append([PLRing, Olnfid, Olnseg, "Left", line_seg.loc[index], index])
-        in_argsR.append([PRRing, Olnfid, Olnseg, "Right", line_seg.loc[index], index])
-        print(' "PROGRESS_LABEL Preparing grouped buffer areas...." ', flush=True)
-        print(" %{} ".format((index + 1 / len(line_seg)) * 100))
-
-    total_steps = len(in_argsL) + len(in_argsR)
-    featuresL = []
-    featuresR = []
-
-    if PARALLEL_MODE == ParallelMode.MULTIPROCESSING:
-        with Pool(processes=int(processes)) as pool:
-            step = 0
-            # execute tasks in order, process results out of order
-            try:
-                for resultL in pool.imap_unordered(rate_of_change, in_argsL):
-                    if BT_DEBUGGING:
-                        print("Got result: {}".format(resultL), flush=True)
-                    featuresL.append(resultL)
-                    step += 1
-                    print(
-                        ' "PROGRESS_LABEL Calculate Rate of Change In Buffer Area {} of {}" '.format(
-                            step, total_steps
-                        ),
-                        flush=True,
-                    )
-                    print("%{}".format(step / total_steps * 100), flush=True)
-            except Exception:
-                print(Exception)
-                raise
-
-            gpdL = gpd.GeoDataFrame(pd.concat(featuresL, axis=1).T)
-        with Pool(processes=int(processes)) as pool:
-            try:
-                for resultR in pool.imap_unordered(rate_of_change, in_argsR):
-                    if BT_DEBUGGING:
-                        print("Got result: {}".format(resultR), flush=True)
-                    featuresR.append(resultR)
-                    step += 1
-                    print(
-                        ' "PROGRESS_LABEL Calculate Rate of Change Area {} of {}" '.format(
-                            step + len(in_argsL), total_steps
-                        ),
-                        flush=True,
-                    )
-                    print(
-                        "%{}".format((step + len(in_argsL)) / total_steps * 100),
-                        flush=True,
-                    )
-            except Exception:
-                print(Exception)
-                raise
-            gpdR = gpd.GeoDataFrame(pd.concat(featuresR, axis=1).T)
-    else:
-        for rowL in in_argsL:
-            featuresL.append(rate_of_change(rowL))
+    # one row of each line ID, last row is empty for lines without rings
+    ring_counts = np.append(np.bincount(codes, minlength=len(keys)), 0)
+    starts = np.concatenate([[0], np.cumsum(ring_counts)[:-1]])
+    percentiles = np.full((len(ring_counts), max(ring_counts.max(), 1)), np.nan)
+    percentiles[codes, np.arange(len(codes)) - starts[codes]] = ring_df[per_col].to_numpy()[order]
 
-        for rowR in in_argsR:
-            featuresR.append(rate_of_change(rowR))
+    line_rows = keys.get_indexer(pd.MultiIndex.from_arrays([line_seg["OLnFID"], line_seg["OLnSEG"]]))
+    return percentiles[line_rows], ring_counts[line_rows]
 
-        gpdL = gpd.GeoDataFrame(pd.concat(featuresL, axis=1).T)
-        gpdR = gpd.GeoDataFrame(pd.concat(featuresR, axis=1).T)
 
-    for index in line_seg.index:
-        lnfid = line_seg.OLnFID.iloc[index]
-        Olnseg = line_seg.OLnSEG.iloc[index]
-        line_seg.loc[index, "RDist_Cut"] = float(
-            gpdR.loc[(gpdR.OLnFID == lnfid) & (gpdR.OLnSEG == Olnseg)]["RDist_Cut"]
-        )
-        line_seg.loc[index, "LDist_Cut"] = float(
-            gpdL.loc[(gpdL.OLnFID == lnfid) & (gpdL.OLnSEG == Olnseg)]["LDist_Cut"]
-        )
-        line_seg.loc[index, "CL_CutHt"] = float(
-            gpdL.loc[(gpdL.OLnFID == lnfid) & (gpdL.OLnSEG == Olnseg)]["CL_CutHt"]
-        )
-        line_seg.loc[index, "CR_CutHt"] = float(
-            gpdR.loc[(gpdR.OLnFID == lnfid) & (gpdR.OLnSEG == Olnseg)]["CR_CutHt"]
-        )
-        line_seg.loc[index, "DynCanTh"] = (
-            line_seg.loc[index, "CL_CutHt"] + line_seg.loc[index, "CR_CutHt"]
-        ) / 2
-        print(
-            ' "PROGRESS_LABEL Recording ... {} of {}" '.format(index + 1, len(line_seg)),
-            flush=True,
-        )
-        print(" %{} ".format(index + 1 / len(line_seg) * 100), flush=True)
+def rate_of_change_lines(line_seg, worklnbuffer_dfLRing, worklnbuffer_dfRRing):
+    """Find cut distance and height of both sides of all lines by rate of change of ring percentiles."""
+    print("Calculate rate of change in buffer areas ...", flush=True)
+    for ring_df, per_col, dist_col, height_col in (
+        (worklnbuffer_dfLRing, "Percentile_LRing", "LDist_Cut", "CL_CutHt"),
+        (worklnbuffer_dfRRing, "Percentile_RRing", "RDist_Cut", "CR_CutHt"),
+    ):
+        percentiles, ring_counts = ring_percentile_array(ring_df, per_col, line_seg)
+        cut_dist, cut_percentile = rate_of_change_cuts(percentiles, ring_counts)
+        line_seg[dist_col] = cut_dist
+        line_seg[height_col] = cut_percentile
 
+    line_seg["DynCanTh"] = (line_seg["CL_CutHt"] + line_seg["CR_CutHt"]) / 2
     return line_seg
 
 
@@ -455,58 +225,36 @@ def split_into_segments(df):
     return gdf
 
 
-def multiprocessing_copyparallel_lineLRC(dfL, dfR, dfc, processes, left_dis, right_dist, center_dist):
-    try:
-        line_arg = []
-        total_steps = len(dfL)
+def copyparallel_lineLRC(dfL, dfR, left_dist, right_dist):
+    """
+    Offset simplified lines of dfL and dfR by left_dist and right_dist, all lines at once.
 
-        for item in dfL.index:
-            item_list = [dfL, dfR, dfc, left_dis, right_dist, center_dist, item]
-            line_arg.append(item_list)
+    Line keeps its geometry when its offset is empty, rows without geometry
+    in dfL are dropped.
 
-        featuresL = []
-        featuresR = []
-        result = None
-        step = 0
+    Returns:
+        tuple: (dfL, dfR) copies with offset lines
 
-        if PARALLEL_MODE == ParallelMode.MULTIPROCESSING:
-            with Pool(processes=int(processes)) as pool:
-                # execute tasks in order, process results out of order
-                for result in pool.imap_unordered(copyparallel_lineLRC, line_arg):
-                    if BT_DEBUGGING:
-                        print(f"Got result: {result}", flush=True)
-                    if result:
-                        featuresL.append(result[0])  # resultL
-                        featuresR.append(result[1])  # resultR
-                    step += 1
-                    print(f" %{step / total_steps * 100} ")
-
-                return gpd.GeoDataFrame(pd.concat(featuresL)), gpd.GeoDataFrame(
-                    pd.concat(featuresR)
-                )  # ,  gpd.GeoDataFrame(pd.concat(featuresC))
-        elif PARALLEL_MODE == ParallelMode.SEQUENTIAL:
-            for line in line_arg:
-                result = copyparallel_lineLRC(line)
-                if BT_DEBUGGING:
-                    print(f"Got result: {result}", flush=True)
-                if result:
-                    featuresL.append(result[0])  # resultL
-                    featuresR.append(result[1])  # resultR
-                step += 1
-                print(f" %{step / total_steps * 100} ")
+    """
+    keep = ~(dfL.geometry.isna() | dfL.geometry.is_empty).to_numpy()
+    dfL = dfL[keep].copy()
+    dfR = dfR[keep].copy()
 
-            return gpd.GeoDataFrame(pd.concat(featuresL)), gpd.GeoDataFrame(
-                pd.concat(featuresR)
-            )  # , gpd.GeoDataFrame(pd.concat(featuresC))
+    # right lines take positive distance as parallel_offset(-right_dist, side="right") did
+    for df, distance in ((dfL, float(left_dist)), (dfR, float(right_dist))):
+        lines = shapely.simplify(df.geometry.values, tolerance=0.05, preserve_topology=True)
+        offset_lines = shapely.offset_curve(
+            lines, distance, quad_segs=16, join_style=shapely.BufferJoinStyle.mitre
+        )
+        offset_lines = np.where(shapely.is_empty(offset_lines), df.geometry.values, offset_lines)
+        df.geometry = gpd.GeoSeries(offset_lines, index=df.index, crs=df.crs)
 
-    except OperationCancelledException:
-        print("Operation cancelled")
+    return dfL, dfR
 
 
 def multiprocessing_Percentile(df, CanPercentile, CanThrPercentage, in_CHM, processes, side):
     try:
         line_arg = []
-        total_steps = len(df)
         cal_percentile = cal_percentileLR
         which_side = side
         if side == "left":
@@ -528,22 +276,31 @@ def multiprocessing_Percentile(df, CanPercentile, CanThrPercentage, in_CHM, proc
 
         print("Calculating surrounding ({}) forest population for buffer area ...".format(which_side))
 
-        for item in df.index:
+        if cal_percentile == cal_percentileRing:
+            # rings of one line are processed together by one raster read
+            items = list(df.groupby(["OLnFID", "OLnSEG"], sort=False).indices.values())
+            row_indices = [df.index[item] for item in items]
+        else:
+            items = [[item] for item in range(len(df))]
+            row_indices = df.index
+
+        for item in range(len(items)):
             item_list = [
-                df.iloc[[item]],
+                df.iloc[items[item]],
                 CanPercentile,
                 CanThrPercentage,
                 in_CHM,
-                item,
+                row_indices[item],
                 PerCol,
             ]
             line_arg.append(item_list)
             print(
-                ' "PROGRESS_LABEL Preparing... {} of {}" '.format(item + 1, len(df)),
+                ' "PROGRESS_LABEL Preparing... {} of {}" '.format(item + 1, len(items)),
                 flush=True,
             )
-            print(" %{} ".format(item / len(df) * 100), flush=True)
+            print(" %{} ".format(item / len(items) * 100), flush=True)
 
+        total_steps = len(line_arg)
         features = []
         # chunksize = math.ceil(total_steps / processes)
         # PARALLEL_MODE=False
@@ -652,56 +409,30 @@ def cal_percentileLR(line_arg):
 
 
 def cal_percentileRing(line_arg):
-    from shapely import ops
-
-    try:
-        df = line_arg[0]
-        CanPercentile = line_arg[1]
-        CanThrPercentage = line_arg[2]
-        in_CHM = line_arg[3]
-        row_index = line_arg[4]
-        PerCol = line_arg[5]
-
-        line_buffer = df.loc[row_index, "geometry"]
-        if line_buffer.is_empty or shapely.is_missing(line_buffer):
-            return None
-        if line_buffer.has_z:
-            line_buffer = ops.transform(lambda x, y, z=None: (x, y), line_buffer)
-
-    except Exception as e:
-        print(e)
-        print("Assigning variable on index:{} Error: ".format(line_arg) + sys.exc_info())
-        exit()
+    df = line_arg[0]
+    in_CHM = line_arg[3]
+    row_index = line_arg[4]
+    PerCol = line_arg[5]
+
+    # rings of one line, empty rings are dropped
+    ring_geoms = df.loc[row_index, "geometry"]
+    row_index = row_index[~(shapely.is_missing(ring_geoms) | shapely.is_empty(ring_geoms))]
+    df = df.loc[row_index]
+    if df.empty:
+        return None
 
     # TODO: temporary workaround for exception causing not percentile defined
-    percentile = 0.5
-    Dyn_Canopy_Threshold = 0.05
+    percentile = np.full(len(df), 0.5)
+    Dyn_Canopy_Threshold = np.full(len(df), 0.05)
     try:
-        # with rasterio.open(in_CHM) as raster:
-        # clipped_raster, out_transform = rasterio.mask.mask(raster, [line_buffer], crop=True,
-        #                                                    nodata=BT_NODATA, filled=True)
-        clipped_raster, out_meta = clip_raster(in_CHM, line_buffer, 0)
-        clipped_raster = np.squeeze(clipped_raster, axis=0)
-
-        # mask all -9999 (nodata) value cells
-        masked_raster = np.ma.masked_where(clipped_raster == BT_NODATA, clipped_raster)
-        filled_raster = np.ma.filled(masked_raster, np.nan)
-
-        # Calculate the percentile
-        # masked_mean = np.ma.mean(masked_raster)
-        percentile = np.nanpercentile(filled_raster, 50)  # CanPercentile)#,method='hazen')
-
-        if percentile > 1:  # (percentile+median)>0.0:
-            Dyn_Canopy_Threshold = percentile * (0.3)
-        else:
-            Dyn_Canopy_Threshold = 1
-
-        del clipped_raster, out_meta
-        # del raster
-    # return the generated value
+        # percentile of all rings from one raster read, rings outside of CHM keep default values
+        index = open_percentile_index(in_CHM)
+        ring_percentile, inside = zonal_percentiles(in_CHM, df.geometry.values, 50, index=index)
+        ring_percentile = ring_percentile[inside]
+        percentile[inside] = ring_percentile
+        Dyn_Canopy_Threshold[inside] = np.where(ring_percentile > 1, ring_percentile * (0.3), 1)
     except Exception as e:
         print(e)
-        # print('Something wrong in ID:{}'.format(row_index))
         print("Default values are used.")
 
     finally:
@@ -710,42 +441,6 @@ def cal_percentileRing(line_arg):
         return df
 
 
-def copyparallel_lineLRC(line_arg):
-    dfL = line_arg[0]
-    dfR = line_arg[1]
-
-    # Simplify input center lines
-    geom = dfL.loc[line_arg[6], "geometry"]
-    if not geom:
-        return None
-
-    lineL = dfL.loc[line_arg[6], "geometry"].simplify(tolerance=0.05, preserve_topology=True)
-    lineR = dfR.loc[line_arg[6], "geometry"].simplify(tolerance=0.05, preserve_topology=True)
-    # lineC = dfC.loc[line_arg[6], 'geometry'].simplify(tolerance=0.05, preserve_topology=True)
-    offset_distL = float(line_arg[3])
-    offset_distR = float(line_arg[4])
-
-    # Older alternative method to the offset_curve() method,
-    # but uses resolution instead of quad_segs and a side keyword (‘left’ or ‘right’) instead
-    # of sign of the distance. This method is kept for backwards compatibility for now,
-    # but it is recommended to use offset_curve() instead.
-    # (ref: https://shapely.readthedocs.io/en/stable/manual.html#object.offset_curve)
-    parallel_lineL = lineL.parallel_offset(
-        distance=offset_distL, side="left", join_style=shapely.BufferJoinStyle.mitre
-    )
-
-    parallel_lineR = lineR.parallel_offset(
-        distance=-offset_distR, side="right", join_style=shapely.BufferJoinStyle.mitre
-    )
-
-    if not parallel_lineL.is_empty:
-        dfL.loc[line_arg[6], "geometry"] = parallel_lineL
-    if not parallel_lineR.is_empty:
-        dfR.loc[line_arg[6], "geometry"] = parallel_lineR
-
-    return dfL.iloc[[line_arg[6]]], dfR.iloc[[line_arg[6]]]  # ,dfC.iloc[[line_arg[6]]]
-
-
 if __name__ == "__main__":
     start_time = time.time()
     print(
@@ -14,6 +14,7 @@ Description:
 """
 
 import enum
+import os
 
 NADDatum = ["NAD83 Canadian Spatial Reference System", "North American Datum 1983"]
 
@@ -28,13 +29,46 @@ BT_NODATA = -9999
 
 LP_SEGMENT_LENGTH = 500
 FP_CORRIDOR_THRESHOLD = 2.5
+CORRIDOR_BOUNDED_SEARCH = True  # search destination cost only where corridor can be
 SMALL_BUFFER = 1e-3
 
+# process-local raster block cache used by clip_raster, budget is per worker
+RASTER_CACHE_ENABLED = True
+RASTER_CACHE_BUDGET_MB = float(os.environ.get("BT_RASTER_CACHE_MB", 256))
+RASTER_CACHE_MAX_HANDLES = 8
+RASTER_CACHE_MIN_BLOCK_SIZE = 256
+
+# rows buffered per output layer by ResultWriter before they are appended to file
+RESULT_BATCH_SIZE = 1000
+
+# stored results of resumed items are read from checkpoint in batches of keys
+CHECKPOINT_READ_BATCH = 500
+
+# results pickled again by execute_multiprocessing to report bytes sent back per task
+RESULT_SIZE_SAMPLE = 100
+
+# intermediate rasters of work items are saved here for debugging, not saved when not set
+DEBUG_RASTER_DIR = os.environ.get("BT_DEBUG_RASTER_DIR")
+
+# persistent result cache of tools, disabled when directory is not set. Least
+# recently used results are evicted when cache is larger than RESULT_CACHE_MB.
+RESULT_CACHE_DIR = os.environ.get("BT_RESULT_CACHE_DIR")
+RESULT_CACHE_MB = float(os.environ.get("BT_RESULT_CACHE_MB", 2048))
+
+# approximate CHM percentiles of rings from per-block histograms saved next to raster,
+# max error in raster units (half of bin width), exact percentiles when not set
+PERCENTILE_INDEX_ERROR = float(os.environ.get("BT_PERCENTILE_INDEX_ERROR", 0)) or None
+PERCENTILE_INDEX_BLOCK_SIZE = int(os.environ.get("BT_PERCENTILE_INDEX_BLOCK", 16))
+
+# tile size in cells for precomputed cost surface
+COST_SURFACE_TILE_SIZE = 1024
+
 
 class CenterlineFlags(enum.Flag):
     """Flags for the centerline algorithm."""
 
     USE_SKIMAGE_GRAPH = False
+    USE_SKELETON_CENTERLINE = False  # skeleton of corridor raster instead of Voronoi of polygon
     DELETE_HOLES = True
     SIMPLIFY_POLYGON = True
 
@@ -52,3 +86,65 @@ class ParallelMode(enum.IntEnum):
 
 
 PARALLEL_MODE = ParallelMode.MULTIPROCESSING
+
+
+@enum.unique
+class SpatialOrder(enum.IntEnum):
+    """Defines the order of work items sent to workers by execute_multiprocessing."""
+
+    NONE = 0  # input order
+    HILBERT = 1  # Hilbert curve of item location
+    ZORDER = 2  # Z-order (Morton) curve of item location
+
+
+# spatially ordered items are sent to pool workers in contiguous chunks,
+# SPATIAL_CHUNKS_PER_WORKER chunks of each worker balance long and short tasks,
+# chunks hold at most SPATIAL_MAX_CHUNK_ITEMS items, results of chunk are sent back at once.
+SPATIAL_ORDER = SpatialOrder.NONE
+SPATIAL_CHUNKS_PER_WORKER = 4
+SPATIAL_MAX_CHUNK_ITEMS = 64
+
+# longest first load balancing, default cost estimate of work item is
+# (line length + buffer width) * buffer width / cell area. Each chunk sent to
+# pool workers holds at most 1 / (processes * factor) of remaining cost and at
+# most LOAD_BALANCE_MAX_CHUNK_ITEMS items, results of chunk are sent back at once.
+COST_BUFFER_WIDTH = 30.0
+COST_CELL_AREA = 1.0
+LOAD_BALANCE_CHUNK_FACTOR = 2
+LOAD_BALANCE_MAX_CHUNK_ITEMS = 16
+
+# wall clock limit in seconds of each item in multiprocessing and concurrent modes,
+# None for no limit. Worker running an item longer is killed and replaced, the item
+# is reported as failed with items raising exceptions, results of others are kept.
+TASK_TIMEOUT = float(os.environ["BT_TASK_TIMEOUT"]) if os.environ.get("BT_TASK_TIMEOUT") else None
+TASK_POLL_INTERVAL = 1.0
+
+# Dask mode connects to scheduler address, or starts LocalCluster when it is not set.
+# Tasks are submitted in batches, next batch is submitted when one batch of tasks is done.
+DASK_SCHEDULER_ADDRESS = os.environ.get("BT_DASK_SCHEDULER")
+DASK_BATCH_SIZE = 256
+
+# SLURM mode splits items into shards of SLURM_SHARD_SIZE, one job array task per shard.
+# Work directory must be on file system shared by nodes, current directory when not set.
+# SLURM_SBATCH can be replaced by fake sbatch command to run array tasks locally.
+SLURM_SHARD_SIZE = int(os.environ.get("BT_SLURM_SHARD_SIZE", 2000))
+SLURM_WORK_DIR = os.environ.get("BT_SLURM_WORK_DIR")
+SLURM_SBATCH = os.environ.get("BT_SBATCH", "sbatch")
+SLURM_SBATCH_OPTIONS = os.environ.get("BT_SBATCH_OPTIONS", "")  # such as "--time=4:00:00 --mem=32G"
+
+
+@enum.unique
+class LeastCostPathEngine(enum.IntEnum):
+    """Defines the engine used by algo_dijkstra.find_least_cost_path."""
+
+    SKIMAGE = 1  # skimage.graph.route_through_array
+    DIJKSTRA = 2  # pure Python dijkstra
+    ASTAR = 3  # heap based A* on flat arrays
+
+
+LCP_ENGINE = LeastCostPathEngine.SKIMAGE
+
+# coarse to fine least cost path, downsample factors such as (4,) or (8, 4, 2),
+# empty for full resolution search. Band is half width in cells of coarser level.
+LCP_PYRAMID_FACTORS = ()
+LCP_PYRAMID_BAND = 2
@@ -42,26 +42,22 @@ from beratools.core.algo_centerline import *
 from beratools.core.constants import *
 from beratools.core.tool_base import *
 from beratools.tools.common import *
+from beratools.utility.checkpoint import CheckpointStore, checkpoint_file, file_fingerprint
+from beratools.utility.result_cache import raster_fingerprint
 from beratools.utility.spatial_common import *
 
 
-def dyn_canopy_cost_raster(args):
-    # raster_obj = args[0]
-    in_chm_raster = args[0]
-    DynCanTh = args[1]
-    tree_radius = args[2]
-    max_line_dist = args[3]
-    canopy_avoid = args[4]
-    exponent = args[5]
-    res = args[6]
-    nodata = args[7]
-    line_df = args[8]
-    out_meta = args[9]
-    line_id = args[10]
-    Cut_Dist = args[11]
-    Side = args[12]
-    canopy_thresh_percentage = float(args[13]) / 100
-    line_buffer = args[14]
+def dyn_canopy_cost_raster(
+    args, in_chm_raster, tree_radius, max_line_dist, canopy_avoid, exponent, canopy_thresh_percentage
+):
+    DynCanTh = args[0]
+    line_df = args[1]
+    line_id = args[2]
+    Cut_Dist = args[3]
+    Side = args[4]
+    line_buffer = args[5]
+    nodata = BT_NODATA
+    canopy_thresh_percentage = float(canopy_thresh_percentage) / 100
 
     if Side == "Left":
         canopy_ht_threshold = line_df.CL_CutHt * canopy_thresh_percentage
@@ -430,19 +426,24 @@ def find_corridor_threshold(raster):
     return corridor_threshold
 
 
-def process_single_line_relative(segment):
-    # in_chm = rasterio.open(segment[0])
-
-    # segment[0] = in_chm
-    # DynCanTh = segment[1]
-
-    # Segment args from mulitprocessing:
-    # [clipped_chm, float(work_in_bufferR.loc[record, 'DynCanTh']), float(tree_radius),
-    # float(max_line_dist), float(canopy_avoidance), float(exponent), raster.res, nodata,
-    # line_seg.iloc[[record]], out_meta, line_id,RCut,Side,canopy_thresh_percentage,line_buffer]
+def process_single_line_relative(
+    segment,
+    in_chm=None,
+    tree_radius=None,
+    max_line_dist=None,
+    canopy_avoidance=None,
+    exponent=None,
+    canopy_thresh_percentage=None,
+):
+    # Segment args from generate_line_args_DFP_NoClip:
+    # [float(work_in_bufferR.loc[record, 'DynCanTh']), line_seg.iloc[[record]],
+    # line_id, RCut, Side, line_buffer]
+    # CHM and cost parameters are shared args sent once per worker
 
     # this will change segment content, and parameters will be changed
-    segment = dyn_canopy_cost_raster(segment)
+    segment = dyn_canopy_cost_raster(
+        segment, in_chm, tree_radius, max_line_dist, canopy_avoidance, exponent, canopy_thresh_percentage
+    )
     if segment is None:
         return None
     # Segement after Clipped Canopy and Cost Raster
@@ -493,8 +494,7 @@ def process_single_line_relative(segment):
         # change all nan to BT_NODATA_COST for workaround
         if len(in_cost_r.shape) > 2:
             in_cost_r = np.squeeze(in_cost_r, axis=0)
-        remove_nan_from_array(in_cost_r)
-        in_cost_r[in_cost_r == no_data] = np.inf
+        remove_nan_from_array(in_cost_r, no_data)
 
         # generate 1m interval points along line
         distance_delta = 1
@@ -606,30 +606,22 @@ def process_single_line_relative(segment):
         print("Exception: {}".format(e))
 
 
-def multiprocessing_footprint_relative(line_args, processes):
-    try:
-        total_steps = len(line_args)
-
-        feats = []
-        # chunksize = math.ceil(total_steps / processes)
-        with Pool(processes=processes) as pool:
-            step = 0
-            # execute tasks in order, process results out of order
-            for result in pool.imap_unordered(process_single_line_relative, line_args):
-                if BT_DEBUGGING:
-                    print("Got result: {}".format(result), flush=True)
-                if result != None:
-                    feats.append(result)
-                step += 1
-                print(
-                    ' "PROGRESS_LABEL Dynamic Segment Line Footprint {} of {}" '.format(step, total_steps),
-                    flush=True,
-                )
-                print(" %{} ".format(step / total_steps * 100), flush=True)
-        return feats
-    except OperationCancelledException:
-        print("Operation cancelled")
-        return None
+def multiprocessing_footprint_relative(line_args, processes, shared_args, checkpoint=None):
+    """
+    Process line arguments by process pool, results are appended to checkpoint when it is given.
+
+    CHM and cost parameters in shared_args are sent once per worker.
+    """
+    return execute_multiprocessing(
+        process_single_line_relative,
+        line_args,
+        "Dynamic Segment Line Footprint",
+        processes,
+        mode=ParallelMode.MULTIPROCESSING,
+        verbose=True,
+        shared_args=shared_args,
+        checkpoint=checkpoint,
+    )
 
 
 def main_line_footprint_relative(
@@ -648,6 +640,7 @@ def main_line_footprint_relative(
     canopy_thresh_percentage,
     processes,
     verbose,
+    resume=False,
 ):
     # use_corridor_th_col = True
     line_seg = GeoDataFrame.from_file(in_line)
@@ -676,132 +669,139 @@ def main_line_footprint_relative(
     print("%{}".format(10))
 
     # check coordinate systems between line and raster features
-    with rasterio.open(in_chm) as raster:
-        line_args = []
-
-        if compare_crs(vector_crs(in_line), raster_crs(in_chm)):
-            proc_segments = False
-            if proc_segments:
-                print("Splitting lines into segments...")
-                line_seg_split = split_into_segments(line_seg)
-                print("Splitting lines into segments...Done")
+    line_args = []
+
+    if compare_crs(vector_crs(in_line), raster_crs(in_chm)):
+        proc_segments = False
+        if proc_segments:
+            print("Splitting lines into segments...")
+            line_seg_split = split_into_segments(line_seg)
+            print("Splitting lines into segments...Done")
+        else:
+            if full_step:
+                print("Tool runs on input lines......")
+                line_seg_split = line_seg
             else:
-                if full_step:
-                    print("Tool runs on input lines......")
-                    line_seg_split = line_seg
-                else:
-                    print("Tool runs on input segment lines......")
-                    line_seg_split = split_into_equal_Nth_segments(line_seg, 250)
-
-            print("%{}".format(20))
-
-            work_in_bufferL1 = GeoDataFrame.copy(line_seg_split)
-            work_in_bufferL2 = GeoDataFrame.copy(line_seg_split)
-            work_in_bufferR1 = GeoDataFrame.copy(line_seg_split)
-            work_in_bufferR2 = GeoDataFrame.copy(line_seg_split)
-            work_in_bufferC = GeoDataFrame.copy(line_seg_split)
-            work_in_bufferL1["geometry"] = buffer(
-                work_in_bufferL1["geometry"],
-                distance=float(max_ln_width) + 1,
-                cap_style=3,
-                single_sided=True,
-            )
+                print("Tool runs on input segment lines......")
+                line_seg_split = split_into_equal_Nth_segments(line_seg, 250)
+
+        print("%{}".format(20))
+
+        work_in_bufferL1 = GeoDataFrame.copy(line_seg_split)
+        work_in_bufferL2 = GeoDataFrame.copy(line_seg_split)
+        work_in_bufferR1 = GeoDataFrame.copy(line_seg_split)
+        work_in_bufferR2 = GeoDataFrame.copy(line_seg_split)
+        work_in_bufferC = GeoDataFrame.copy(line_seg_split)
+        work_in_bufferL1["geometry"] = buffer(
+            work_in_bufferL1["geometry"],
+            distance=float(max_ln_width) + 1,
+            cap_style=3,
+            single_sided=True,
+        )
 
-            work_in_bufferL2["geometry"] = buffer(
-                work_in_bufferL2["geometry"],
-                distance=-1,
-                cap_style=3,
-                single_sided=True,
-            )
+        work_in_bufferL2["geometry"] = buffer(
+            work_in_bufferL2["geometry"],
+            distance=-1,
+            cap_style=3,
+            single_sided=True,
+        )
 
-            work_in_bufferL = GeoDataFrame(pd.concat([work_in_bufferL1, work_in_bufferL2]))
-            work_in_bufferL = work_in_bufferL.dissolve(by=["OLnFID", "OLnSEG"], as_index=False)
+        work_in_bufferL = GeoDataFrame(pd.concat([work_in_bufferL1, work_in_bufferL2]))
+        work_in_bufferL = work_in_bufferL.dissolve(by=["OLnFID", "OLnSEG"], as_index=False)
 
-            work_in_bufferR1["geometry"] = buffer(
-                work_in_bufferR1["geometry"],
-                distance=-float(max_ln_width) - 1,
-                cap_style=3,
-                single_sided=True,
-            )
-            work_in_bufferR2["geometry"] = buffer(
-                work_in_bufferR2["geometry"], distance=1, cap_style=3, single_sided=True
-            )
+        work_in_bufferR1["geometry"] = buffer(
+            work_in_bufferR1["geometry"],
+            distance=-float(max_ln_width) - 1,
+            cap_style=3,
+            single_sided=True,
+        )
+        work_in_bufferR2["geometry"] = buffer(
+            work_in_bufferR2["geometry"], distance=1, cap_style=3, single_sided=True
+        )
 
-            work_in_bufferR = GeoDataFrame(pd.concat([work_in_bufferR1, work_in_bufferR2]))
-            work_in_bufferR = work_in_bufferR.dissolve(by=["OLnFID", "OLnSEG"], as_index=False)
+        work_in_bufferR = GeoDataFrame(pd.concat([work_in_bufferR1, work_in_bufferR2]))
+        work_in_bufferR = work_in_bufferR.dissolve(by=["OLnFID", "OLnSEG"], as_index=False)
 
-            work_in_bufferC["geometry"] = buffer(
-                work_in_bufferC["geometry"],
-                distance=float(max_ln_width),
-                cap_style=3,
-                single_sided=False,
+        work_in_bufferC["geometry"] = buffer(
+            work_in_bufferC["geometry"],
+            distance=float(max_ln_width),
+            cap_style=3,
+            single_sided=False,
+        )
+        print("Prepare arguments for Dynamic FP ...")
+
+        line_argsL, line_argsR, line_argsC = generate_line_args_DFP_NoClip(
+            line_seg_split, work_in_bufferL, work_in_bufferC, work_in_bufferR
+        )
+        shared_args = {
+            "in_chm": in_chm,
+            "tree_radius": float(tree_radius),
+            "max_line_dist": float(max_line_dist),
+            "canopy_avoidance": float(canopy_avoidance),
+            "exponent": float(exponent),
+            "canopy_thresh_percentage": canopy_thresh_percentage,
+        }
+
+    else:
+        print("Line and canopy raster spatial references are not same, please check.")
+        exit()
+    # pass center lines for footprint
+    print("Generating Dynamic footprint ...")
+
+    feat_listL = []
+    feat_listR = []
+    feat_listC = []
+    poly_listL = []
+    poly_listR = []
+    footprint_listL = []
+    footprint_listR = []
+    footprint_listC = []
+    checkpoint = None
+    # PARALLEL_MODE = ParallelMode.SEQUENTIAL
+    if PARALLEL_MODE == ParallelMode.MULTIPROCESSING:
+        # results of each side are kept in checkpoint beside out_footprint until it is saved
+        params = {
+            "in_line": file_fingerprint(in_line),
+            "in_chm": raster_fingerprint(in_chm),
+            "max_ln_width": max_ln_width,
+            "tree_radius": tree_radius,
+            "max_line_dist": max_line_dist,
+            "canopy_avoidance": canopy_avoidance,
+            "exponent": exponent,
+            "full_step": full_step,
+            "canopy_thresh_percentage": canopy_thresh_percentage,
+        }
+        checkpoint = CheckpointStore(checkpoint_file(out_footprint), {**params, "side": "Left"}, resume)
+        feat_listL = multiprocessing_footprint_relative(line_argsL, processes, shared_args, checkpoint) or []
+        checkpoint.close()
+        checkpoint = CheckpointStore(checkpoint_file(out_footprint), {**params, "side": "Right"}, resume)
+        feat_listR = multiprocessing_footprint_relative(line_argsR, processes, shared_args, checkpoint) or []
+        checkpoint.close()
+
+    elif PARALLEL_MODE == ParallelMode.SEQUENTIAL:
+        step = 1
+        total_steps = len(line_argsL)
+        print("There are {} result to process.".format(total_steps))
+        for row in line_argsL:
+            feat_listL.append(process_single_line_relative(row, **shared_args))
+            print("Footprint (left side) for line {} is done".format(step))
+            print(
+                ' "PROGRESS_LABEL Dynamic Line Footprint {} of {}" '.format(step, total_steps),
+                flush=True,
             )
-            print("Prepare arguments for Dynamic FP ...")
-            # line_argsL, line_argsR,line_argsC= generate_line_args(line_seg_split, work_in_bufferL,work_in_bufferC,
-            #                                                       raster, tree_radius, max_line_dist,
-            #                                                       canopy_avoidance, exponent, work_in_bufferR,
-            #                                                       canopy_thresh_percentage)
-
-            line_argsL, line_argsR, line_argsC = generate_line_args_DFP_NoClip(
-                line_seg_split,
-                work_in_bufferL,
-                work_in_bufferC,
-                raster,
-                in_chm,
-                tree_radius,
-                max_line_dist,
-                canopy_avoidance,
-                exponent,
-                work_in_bufferR,
-                canopy_thresh_percentage,
+            print(" %{} ".format((step / total_steps) * 100))
+            step += 1
+        step = 1
+        total_steps = len(line_argsR)
+        for row in line_argsR:
+            feat_listR.append(process_single_line_relative(row, **shared_args))
+            print("Footprint for (right side) line {} is done".format(step))
+            print(
+                ' "PROGRESS_LABEL Dynamic Line Footprint {} of {}" '.format(step, total_steps),
+                flush=True,
             )
-
-        else:
-            print("Line and canopy raster spatial references are not same, please check.")
-            exit()
-        # pass center lines for footprint
-        print("Generating Dynamic footprint ...")
-
-        feat_listL = []
-        feat_listR = []
-        feat_listC = []
-        poly_listL = []
-        poly_listR = []
-        footprint_listL = []
-        footprint_listR = []
-        footprint_listC = []
-        # PARALLEL_MODE = ParallelMode.SEQUENTIAL
-        if PARALLEL_MODE == ParallelMode.MULTIPROCESSING:
-            # feat_listC = multiprocessing_footprint_relative(line_argsC, processes)
-            feat_listL = multiprocessing_footprint_relative(line_argsL, processes)
-            # feat_listL = execute_multiprocessing(process_single_line_relative,'Footprint',line_argsL, processes)
-            feat_listR = multiprocessing_footprint_relative(line_argsR, processes)
-            # feat_listR = execute_multiprocessing(process_single_line_relative, 'Footprint', line_argsR, processes)
-
-        elif PARALLEL_MODE == ParallelMode.SEQUENTIAL:
-            step = 1
-            total_steps = len(line_argsL)
-            print("There are {} result to process.".format(total_steps))
-            for row in line_argsL:
-                feat_listL.append(process_single_line_relative(row))
-                print("Footprint (left side) for line {} is done".format(step))
-                print(
-                    ' "PROGRESS_LABEL Dynamic Line Footprint {} of {}" '.format(step, total_steps),
-                    flush=True,
-                )
-                print(" %{} ".format((step / total_steps) * 100))
-                step += 1
-            step = 1
-            total_steps = len(line_argsR)
-            for row in line_argsR:
-                feat_listR.append(process_single_line_relative(row))
-                print("Footprint for (right side) line {} is done".format(step))
-                print(
-                    ' "PROGRESS_LABEL Dynamic Line Footprint {} of {}" '.format(step, total_steps),
-                    flush=True,
-                )
-                print(" %{} ".format((step / total_steps) * 100))
-                step += 1
+            print(" %{} ".format((step / total_steps) * 100))
+            step += 1
 
     print("%{}".format(80))
     print("Task done.")
@@ -833,6 +833,8 @@ def main_line_footprint_relative(
     print("Saving output ...")
     dissolved_results.to_file(out_footprint)
     print("Footprint file saved")
+    if checkpoint is not None:
+        checkpoint.remove()
 
     # dissolved polygon group by column 'OLnFID'
     print("Generating centerlines from corridor polygons ...")
@@ -14,14 +14,27 @@ Description:
 """
 
 import concurrent.futures as con_futures
+import functools
+import itertools
+import os
+import pickle
+import time
 import warnings
+from collections import defaultdict
+from dataclasses import dataclass, field
 from multiprocessing.pool import Pool
+from pathlib import Path
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
+import shapely.geometry as sh_geom
+import shapely.geometry.base as sh_base
 from tqdm.auto import tqdm
 
 import beratools.core.constants as bt_const
+import beratools.utility.raster_cache as raster_cache
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
@@ -36,6 +49,84 @@ class ToolBase(object):
         pass
 
 
+@dataclass
+class TaskFailure:
+    """Work item which raised exception or timed out, kept instead of its result."""
+
+    item: object
+    reason: str  # "error", "timeout" or "crash"
+    message: str
+    elapsed: float
+
+
+@dataclass
+class ResultRecord:
+    """
+    Compact result of one work item, returned by workers instead of the item.
+
+    Output rows are grouped by layer, each layer is a dict of column lists
+    with geometries as WKB in "geometry" column. Scalars of the item, such as
+    status and stage times, are in attributes. Rasters and other intermediate
+    data of the item are not sent back.
+    """
+
+    index: int  # position of the item in its tool's input, such as LineTable row
+    layers: dict = field(default_factory=dict)
+    attributes: dict = field(default_factory=dict)
+
+    def add_rows(self, layer, geometries, **columns):
+        """Append geometries and their column values to layer, all rows of a layer have same columns."""
+        rows = self.layers.setdefault(layer, {"geometry": []})
+        rows["geometry"].extend(shapely.to_wkb(np.array(geometries, dtype=object)).tolist())
+        for col, values in columns.items():
+            rows.setdefault(col, []).extend(values)
+
+    def geometries(self, layer):
+        """Return array of geometries of layer, empty when layer has no rows."""
+        rows = self.layers.get(layer, {"geometry": []})
+        return shapely.from_wkb(np.array(rows["geometry"], dtype=object))
+
+
+def record_rows(records, layer):
+    """
+    Return rows of layer of all records.
+
+    Returns:
+        tuple: item index of each row, array of geometries, dict of column lists
+
+    """
+    indices = []
+    wkb = []
+    columns = defaultdict(list)
+    for record in records:
+        rows = record.layers.get(layer)
+        if not rows:
+            continue
+
+        indices.extend([record.index] * len(rows["geometry"]))
+        wkb.extend(rows["geometry"])
+        for col, values in rows.items():
+            if col != "geometry":
+                columns[col].extend(values)
+
+    geometries = shapely.from_wkb(np.array(wkb, dtype=object))
+    return np.array(indices, dtype=np.int64), geometries, dict(columns)
+
+
+def records_to_gdf(records, layer, crs=None, line_table=None):
+    """
+    Return GeoDataFrame of layer rows of all records.
+
+    Attributes of input lines are attached by line_table.to_gdf when
+    line_table is given, see algo_common.LineTable.
+    """
+    indices, geometries, columns = record_rows(records, layer)
+    if line_table is not None:
+        return line_table.to_gdf(geometries, indices, columns)
+
+    return gpd.GeoDataFrame(columns, geometry=list(geometries), crs=crs)
+
+
 def result_is_valid(result):
     if type(result) is list or type(result) is tuple:
         if len(result) > 0:
@@ -59,6 +150,484 @@ def print_msg(app_name, step, total_steps):
     print(f" %{step / total_steps * 100} ", flush=True)
 
 
+def item_geometry(item, depth=2):
+    """
+    Return first geometry found in work item, None when not found.
+
+    Geometries are searched in item itself, geometry property of work items,
+    and in elements of tuple, list and dict or attributes of objects up to
+    depth levels down. Geometries of GeoDataFrame or GeoSeries with more
+    than one row are returned as collection.
+    """
+    if isinstance(item, sh_base.BaseGeometry):
+        return None if item.is_empty else item
+
+    geom = getattr(item, "geometry", None)
+    if isinstance(geom, sh_base.BaseGeometry):
+        return None if geom.is_empty else geom
+
+    if isinstance(item, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        geoms = item.geometry if isinstance(item, gpd.GeoDataFrame) else item
+        geoms = [geom for geom in geoms if geom is not None and not geom.is_empty]
+        if not geoms:
+            return None
+        return geoms[0] if len(geoms) == 1 else sh_geom.GeometryCollection(geoms)
+
+    if depth == 0:
+        return None
+
+    if isinstance(item, (list, tuple)):
+        values = item
+    elif isinstance(item, dict):
+        values = item.values()
+    elif hasattr(item, "__dict__"):
+        values = vars(item).values()
+    else:
+        return None
+
+    for value in values:
+        geom = item_geometry(value, depth - 1)
+        if geom is not None:
+            return geom
+
+    return None
+
+
+def item_location(item, depth=2):
+    """Return (x, y) center of first geometry found in work item, None when not found."""
+    geom = item_geometry(item, depth)
+    if geom is None:
+        return None
+
+    minx, miny, maxx, maxy = geom.bounds
+    return (minx + maxx) / 2, (miny + maxy) / 2
+
+
+def estimate_line_cost(item, buffer_width=bt_const.COST_BUFFER_WIDTH, cell_area=bt_const.COST_CELL_AREA):
+    """
+    Estimate cost of work item as raster cells around its line.
+
+    Cost is (line length + buffer width) * buffer width / cell area, cells
+    in buffer of the line with round ends. Item without geometry has cost
+    of zero length line.
+    """
+    geom = item_geometry(item)
+    length = geom.length if geom is not None else 0.0
+    return (length + buffer_width) * buffer_width / cell_area
+
+
+def curve_index(points, order=bt_const.SpatialOrder.HILBERT, bits=16):
+    """
+    Return index of points along space filling curve.
+
+    Points are snapped to square grid of 2**bits cells on each side covering them.
+
+    Args:
+        points: array of shape (n, 2)
+        order (SpatialOrder): HILBERT or ZORDER curve
+
+    Returns:
+        np.ndarray: int64 curve index of each point
+
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    side = 1 << bits
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    origin = points.min(axis=0)
+    span = (points.max(axis=0) - origin).max()
+    cells = np.zeros(points.shape, dtype=np.int64)
+    if span > 0:
+        cells = np.floor((points - origin) / span * (side - 1)).astype(np.int64)
+    x, y = cells[:, 0], cells[:, 1]
+
+    index = np.zeros(len(points), dtype=np.int64)
+    if order == bt_const.SpatialOrder.ZORDER:
+        for bit in range(bits):
+            index |= ((x >> bit) & 1) << (2 * bit)
+            index |= ((y >> bit) & 1) << (2 * bit + 1)
+        return index
+
+    # Hilbert curve, xy2d of each point at once
+    s = side >> 1
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        index += s * s * ((3 * rx) ^ ry)
+
+        # rotate quadrant
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+
+    return index
+
+
+def spatial_order(in_data, order=bt_const.SpatialOrder.HILBERT):
+    """
+    Return indices of work items sorted along space filling curve of item locations.
+
+    Items without location are placed at the end in input order.
+    """
+    locations = [item_location(item) for item in in_data]
+    located = [i for i, loc in enumerate(locations) if loc is not None]
+    unlocated = [i for i, loc in enumerate(locations) if loc is None]
+    if not located:
+        return list(range(len(in_data)))
+
+    index = curve_index([locations[i] for i in located], order)
+    return [located[i] for i in np.argsort(index, kind="stable")] + unlocated
+
+
+def task_chunks(in_data, processes, order=bt_const.SpatialOrder.NONE, cost_estimator=None):
+    """
+    Split indices of work items into chunks, which are sent to workers in list order.
+
+    With cost_estimator, items are sorted by descending estimated cost and
+    each chunk holds at most 1 / (processes * LOAD_BALANCE_CHUNK_FACTOR) of
+    remaining cost and at most LOAD_BALANCE_MAX_CHUNK_ITEMS items. Expensive
+    items are sent first and chunks get smaller as remaining cost drops, so
+    workers finish at about the same time.
+
+    With cost_estimator and spatial order, chunks sized the same way are cut
+    from contiguous runs of spatially ordered items and sent by descending
+    chunk cost. Nearby items stay in one chunk for raster cache hits, while
+    expensive chunks are still sent first.
+
+    Without cost_estimator, chunks are single items in input order, or
+    SPATIAL_CHUNKS_PER_WORKER contiguous chunks of each worker in spatial order,
+    at most SPATIAL_MAX_CHUNK_ITEMS items each.
+    """
+    count = len(in_data)
+    indices = list(range(count))
+    if order != bt_const.SpatialOrder.NONE:
+        indices = spatial_order(in_data, order)
+
+    if cost_estimator is None:
+        size = 1
+        if order != bt_const.SpatialOrder.NONE:
+            size = max(1, count // (max(1, processes) * bt_const.SPATIAL_CHUNKS_PER_WORKER))
+            size = min(size, bt_const.SPATIAL_MAX_CHUNK_ITEMS)
+        return [indices[i : i + size] for i in range(0, count, size)]
+
+    costs = [float(cost_estimator(item)) for item in in_data]
+    if order == bt_const.SpatialOrder.NONE:
+        indices = sorted(indices, key=lambda k: -costs[k])
+
+    chunks = []
+    chunk = []
+    chunk_cost = 0.0
+    remaining = sum(costs)
+    divisor = max(1, processes) * bt_const.LOAD_BALANCE_CHUNK_FACTOR
+    max_items = bt_const.LOAD_BALANCE_MAX_CHUNK_ITEMS
+    for i in indices:
+        chunk.append(i)
+        chunk_cost += costs[i]
+        if chunk_cost >= remaining / divisor or len(chunk) >= max_items:
+            chunks.append((chunk_cost, chunk))
+            remaining -= chunk_cost
+            chunk = []
+            chunk_cost = 0.0
+
+    if chunk:
+        chunks.append((chunk_cost, chunk))
+
+    if order != bt_const.SpatialOrder.NONE:
+        chunks.sort(key=lambda item: -item[0])
+
+    return [chunk for _, chunk in chunks]
+
+
+def print_idle_time(worker_ends, start, processes):
+    """
+    Print idle time of workers waiting for the last task.
+
+    Args:
+        worker_ends (dict): pid of worker -> time its last chunk finished
+        start: time processing started
+        processes: number of workers
+
+    """
+    if not worker_ends:
+        return
+
+    end = max(worker_ends.values())
+    ends = list(worker_ends.values()) + [start] * max(0, processes - len(worker_ends))
+    idle = sum(end - item for item in ends)
+    total = processes * (end - start)
+    print(
+        f"Tail idle time: {idle:.1f} core-seconds ({idle / total:.1%} of {total:.1f}), "
+        f"last worker finished {end - min(ends):.1f} s after first",
+        flush=True,
+    )
+
+
+def cache_lookups(stats):
+    """Return count of block lookups in raster cache stats."""
+    return stats["hits"] + stats["misses"]
+
+
+def print_raster_cache_stats(worker_stats):
+    """
+    Print raster block cache hit rate of all workers.
+
+    Args:
+        worker_stats (dict): pid of worker -> cache stats returned with its last chunk
+
+    """
+    hits = sum(stats["hits"] for stats in worker_stats.values())
+    lookups = sum(cache_lookups(stats) for stats in worker_stats.values())
+    if lookups == 0:
+        return
+
+    print(
+        f"Raster cache: {hits} hits, {lookups - hits} misses ({hits / lookups:.1%} hit rate) "
+        f"in {len(worker_stats)} workers",
+        flush=True,
+    )
+
+
+# function and shared arguments of worker process, set once by init_worker
+_worker_func = None
+_worker_args = {}
+
+
+def init_worker(in_func, shared_args):
+    """
+    Pool initializer, keep in_func and shared arguments in worker process.
+
+    Rasters in shared arguments are opened in process-local raster pool, so
+    tasks clipping them reuse the opened handles.
+    """
+    global _worker_func, _worker_args
+
+    _worker_func = in_func
+    _worker_args = shared_args
+    if not bt_const.RASTER_CACHE_ENABLED:
+        return
+
+    for value in shared_args.values():
+        if isinstance(value, str) and Path(value).suffix.lower() in (".tif", ".tiff", ".vrt"):
+            if Path(value).exists():
+                raster_cache.get_raster_cache().open(value)
+
+
+def run_task(item, in_func, **kwargs):
+    """Call in_func with item and keyword arguments, return TaskFailure when it raises exception."""
+    start = time.time()
+    try:
+        return in_func(item, **kwargs)
+    except Exception as e:
+        return TaskFailure(item, "error", f"{type(e).__name__}: {e}", time.time() - start)
+
+
+def call_task(item):
+    """Call worker function with item and shared arguments set by init_worker."""
+    return run_task(item, _worker_func, **_worker_args)
+
+
+def call_worker_chunk(items):
+    """
+    Call worker function with each item of chunk.
+
+    Returns:
+        tuple: (pid, start, end, raster cache stats, results), cache counters
+            are cumulative over chunks of the worker.
+
+    """
+    start = time.time()
+    results = [call_task(item) for item in items]
+    return os.getpid(), start, time.time(), raster_cache.raster_cache_stats(), results
+
+
+def reindex_result(result, item):
+    """Set index of stored ResultRecord to index of current item, line positions change between runs."""
+    index = getattr(item, "index", None)
+    if isinstance(result, ResultRecord) and isinstance(index, (int, np.integer)):
+        result.index = index
+
+    return result
+
+
+class StoreTask(object):
+    """
+    Picklable task function calling in_func with (keys, item) and appending result to store writers.
+
+    Results of items raising exception or returning None are not stored.
+    """
+
+    def __init__(self, in_func, writers):
+        self.in_func = in_func
+        self.writers = writers
+
+    def __call__(self, keyed_item, **kwargs):
+        keys, item = keyed_item
+        result = self.in_func(item, **kwargs)
+        if result is None:  # failed item is processed again by next run
+            return result
+
+        for writer, key in zip(self.writers, keys):
+            writer.append(key, result)
+
+        return result
+
+
+def pool_results(in_func, chunk_items, processes, shared_args):
+    """Run chunks by multiprocessing Pool, yield (pid, end time, cache stats, result) of each item."""
+    with Pool(processes, initializer=init_worker, initargs=(in_func, shared_args)) as pool:
+        for pid, _, end, stats, results in pool.imap_unordered(call_worker_chunk, chunk_items):
+            for result in results:
+                yield pid, end, stats, result
+
+        pool.close()
+        pool.join()
+
+
+def executor_results(in_func, chunk_items, processes, shared_args):
+    """Run chunks by ProcessPoolExecutor, yield (pid, end time, cache stats, result) of each item."""
+    with con_futures.ProcessPoolExecutor(
+        max_workers=processes, initializer=init_worker, initargs=(in_func, shared_args)
+    ) as executor:
+        futures = [executor.submit(call_worker_chunk, items) for items in chunk_items]
+        for future in con_futures.as_completed(futures):
+            pid, _, end, stats, results = future.result()
+            for result in results:
+                yield pid, end, stats, result
+
+
+def print_failures(failures):
+    """Print count of failed items by reason and first messages."""
+    if not failures:
+        return
+
+    reasons = {}
+    for failure in failures:
+        reasons[failure.reason] = reasons.get(failure.reason, 0) + 1
+
+    counts = ", ".join(f"{count} {reason}" for reason, count in reasons.items())
+    print(f"{len(failures)} items failed ({counts}), results of other items are kept", flush=True)
+    for failure in failures[:5]:
+        print(f"    {failure.reason}: {failure.message} ({failure.elapsed:.1f} s)", flush=True)
+
+
+def save_failures(failures, out_file, layer, crs=None):
+    """
+    Save failed items to side layer with geometry, reason, message and elapsed seconds.
+
+    Layer is written to GeoParquet when out_file is .parquet, to out_file layer otherwise.
+    """
+    if not failures:
+        return
+
+    failed = gpd.GeoDataFrame(
+        {
+            "reason": [item.reason for item in failures],
+            "message": [item.message for item in failures],
+            "elapsed": [item.elapsed for item in failures],
+        },
+        geometry=[item_geometry(item.item) for item in failures],
+        crs=crs,
+    )
+    if Path(out_file).suffix == ".parquet":
+        failed.to_parquet(out_file)
+    else:
+        failed.to_file(out_file, layer=layer)
+
+    print(f"Saved {len(failed)} failed items to: {out_file}", flush=True)
+
+
+def task_payload_size(in_func, in_data, shared_args=None, sample_size=100):
+    """
+    Return pickled bytes sent per task and per worker for shared arguments.
+
+    Task size is mean of up to sample_size items evenly spaced in in_data.
+    """
+    if len(in_data) == 0:
+        return 0.0, 0
+
+    step = max(1, len(in_data) // sample_size)
+    items = in_data[::step][:sample_size]
+    task_bytes = sum(len(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)) for item in items) / len(items)
+    worker_bytes = len(pickle.dumps((in_func, shared_args or {}), protocol=pickle.HIGHEST_PROTOCOL))
+
+    return task_bytes, worker_bytes
+
+
+def print_result_size(result_bytes):
+    """Print mean pickled bytes of results sent back by workers, measured on first results."""
+    if not result_bytes:
+        return
+
+    print(
+        f"Result payload: {sum(result_bytes) / len(result_bytes) / 1024:.1f} KB per task "
+        f"(mean of {len(result_bytes)} results)",
+        flush=True,
+    )
+
+
+def print_payload_size(in_func, in_data, shared_args=None):
+    task_bytes, worker_bytes = task_payload_size(in_func, in_data, shared_args)
+    print(
+        f"Task payload: {task_bytes / 1024:.1f} KB per task, "
+        f"shared context: {worker_bytes / 1024:.1f} KB per worker",
+        flush=True,
+    )
+
+
+def dask_results(in_func, in_data, processes, shared_args=None, batch_size=bt_const.DASK_BATCH_SIZE):
+    """
+    Run in_func on Dask distributed workers, yield results as tasks complete.
+
+    Connects to bt_const.DASK_SCHEDULER_ADDRESS, or starts LocalCluster of
+    processes single threaded workers when it is not set. At most two
+    batches of tasks are queued on scheduler at a time.
+
+    Args:
+        shared_args (dict): read-only keyword arguments of in_func, scattered
+            to all workers once instead of sent with each task
+
+    """
+    from dask.distributed import Client, LocalCluster, as_completed
+
+    if bt_const.DASK_SCHEDULER_ADDRESS:
+        cluster = None
+        client = Client(bt_const.DASK_SCHEDULER_ADDRESS)
+    else:
+        cluster = LocalCluster(n_workers=processes, threads_per_worker=1, processes=True)
+        client = Client(cluster)
+
+    try:
+        print(f"Dask dashboard: {client.dashboard_link}", flush=True)
+        shared = client.scatter(shared_args, broadcast=True) if shared_args else {}
+        items = iter(in_data)
+        pending = as_completed()
+
+        def submit_batch():
+            batch = list(itertools.islice(items, batch_size))
+            if batch:
+                pending.update(client.map(run_task, batch, in_func=in_func, pure=False, **shared))
+
+        submit_batch()
+        submit_batch()
+        done = 0
+        for future in pending:
+            result = future.result()
+            future.release()
+            done += 1
+            if done % batch_size == 0:
+                submit_batch()
+
+            yield result
+    finally:
+        client.close()
+        if cluster is not None:
+            cluster.close()
+
+
 def execute_multiprocessing(
     in_func,
     in_data,
@@ -66,61 +635,212 @@ def execute_multiprocessing(
     processes,
     mode=bt_const.PARALLEL_MODE,
     verbose=False,
+    sink=None,
+    shared_args=None,
+    order=bt_const.SPATIAL_ORDER,
+    cost_estimator=None,
+    failures=None,
+    task_timeout=bt_const.TASK_TIMEOUT,
+    checkpoint=None,
+    result_cache=None,
 ):
+    """
+    Run in_func on each item of in_data and collect valid results.
+
+    Args:
+        sink: ResultWriter, valid results are passed to sink.add as they
+            arrive instead of collected in list, sink is closed when processing
+            ends, also on failure. Returned list is empty then.
+        shared_args (dict): read-only keyword arguments passed to in_func with
+            each item. They are sent once per worker by Pool initializer, scattered
+            once in Dask mode and saved once with SLURM job.
+        order (SpatialOrder): send items to workers along space filling curve of
+            their locations, Pool workers get contiguous chunks of nearby items,
+            so their raster reads hit cached blocks. SLURM shards are spatial already.
+        cost_estimator: callable returning estimated cost of item, such as
+            estimate_line_cost. Items are sent to workers by descending cost in
+            chunks sized by remaining cost, see task_chunks. None, the default,
+            sends items in input or spatial order, estimate_line_cost fits only
+            items holding lines whose cost grows with raster cells around them.
+        failures (list): TaskFailure of each item which raised exception or
+            timed out is appended, results of other items are kept.
+        task_timeout: seconds, item running longer in multiprocessing or
+            concurrent mode is reported as failed, its worker is killed and
+            replaced by supervised pool. None for no limit.
+        checkpoint: CheckpointStore, result of each item is appended to it by
+            worker as item finishes. Items found in it are skipped and their
+            stored results are collected first.
+        result_cache: ResultCache, used as checkpoint but keyed by item content,
+            so unchanged items of later runs are skipped. It is closed, which
+            evicts least recently used results, when processing ends.
+
+    Returns:
+        list: valid results, None on failure
+
+    """
     out_result = []
     step = 0
-    total_steps = len(in_data)
+    stores = [store for store in (checkpoint, result_cache) if store is not None]
+    failed = failures if failures is not None else []
+    result_bytes = []
+
+    def collect(result_item, measure=False):
+        if measure and len(result_bytes) < bt_const.RESULT_SIZE_SAMPLE:
+            result_bytes.append(len(pickle.dumps(result_item, protocol=pickle.HIGHEST_PROTOCOL)))
+
+        if isinstance(result_item, TaskFailure):
+            if stores:
+                result_item.item = result_item.item[1]
+
+            failed.append(result_item)
+            return
+
+        if not result_is_valid(result_item):
+            return
+
+        if sink is None:
+            out_result.append(result_item)
+        else:
+            sink.add(result_item)
 
     try:
-        if mode == bt_const.ParallelMode.MULTIPROCESSING:
-            print("Multiprocessing started...", flush=True)
+        if stores:
+            store_keys = [store.item_keys(in_data) for store in stores]
+            found = [store.contains(keys) for store, keys in zip(stores, store_keys)]
+            todo = []
+            stored = [[] for _ in stores]  # indices of items found in each store
+            for i in range(len(in_data)):
+                for j, keys in enumerate(store_keys):
+                    if keys[i] in found[j]:
+                        stored[j].append(i)
+                        break
+                else:
+                    todo.append(i)
+
+            # stored results are read and collected one at a time, unreadable ones are processed again
+            for store, keys, indices in zip(stores, store_keys, stored):
+                if not indices:
+                    continue
+
+                print(f"{len(indices)} of {len(in_data)} items found in {store.name}", flush=True)
+                for i, result_item in zip(indices, store.results([keys[i] for i in indices])):
+                    if result_item is None:
+                        todo.append(i)
+                    else:
+                        collect(reindex_result(result_item, in_data[i]))
+
+            todo.sort()
+            in_data = [in_data[i] for i in todo]
+            keys = [tuple(item[i] for item in store_keys) for i in todo]
+
+        total_steps = len(in_data)
+        shared_args = shared_args or {}
+        chunks = []
+        order_index = None
+        if mode in (bt_const.ParallelMode.MULTIPROCESSING, bt_const.ParallelMode.CONCURRENT):
+            chunks = task_chunks(in_data, processes, order, cost_estimator)
+        elif mode == bt_const.ParallelMode.DASK:
+            # dask schedules items itself, submit them longest first
+            chunks = task_chunks(in_data, processes, order, cost_estimator)
+            order_index = [i for chunk in chunks for i in chunk]
+        elif mode == bt_const.ParallelMode.SEQUENTIAL and order != bt_const.SpatialOrder.NONE:
+            order_index = spatial_order(in_data, order)
+
+        if order_index is not None:
+            in_data = [in_data[i] for i in order_index]
+
+        if stores:
+            # items carry their keys, so workers append results to stores
+            if order_index is not None:
+                keys = [keys[i] for i in order_index]
+
+            in_data = list(zip(keys, in_data))
+            in_func = StoreTask(in_func, [store.writer() for store in stores])
+
+        if mode in (bt_const.ParallelMode.MULTIPROCESSING, bt_const.ParallelMode.CONCURRENT):
+            if mode == bt_const.ParallelMode.MULTIPROCESSING:
+                print("Multiprocessing started...", flush=True)
+                pool_func = pool_results
+            else:
+                print("Concurrent processing started...", flush=True)
+                pool_func = executor_results
+
             print("Using {} CPU cores".format(processes), flush=True)
+            print_payload_size(in_func, in_data, shared_args)
+            if task_timeout:
+                from beratools.utility.task_pool import supervised_results
 
-            with Pool(processes) as pool:
-                with tqdm(total=total_steps, disable=verbose) as pbar:
-                    for result in pool.imap_unordered(in_func, in_data):
-                        if result_is_valid(result):
-                            out_result.append(result)
+                print(f"Task timeout: {task_timeout} s", flush=True)
+                pool_func = functools.partial(supervised_results, task_timeout=task_timeout)
 
-                        step += 1
-                        if verbose:
-                            print_msg(app_name, step, total_steps)
-                        else:
-                            pbar.update()
+            start = time.time()
+            worker_ends = {}
+            worker_stats = {}
+            chunk_items = ([in_data[i] for i in chunk] for chunk in chunks)
+            with tqdm(total=total_steps, disable=verbose) as pbar:
+                for pid, end, stats, result in pool_func(in_func, chunk_items, processes, shared_args):
+                    worker_ends[pid] = max(end, worker_ends.get(pid, end))
+                    if stats:  # counters are cumulative, keep the latest
+                        worker_stats[pid] = max(stats, worker_stats.get(pid, stats), key=cache_lookups)
+                    collect(result, measure=True)
 
-            pool.close()
-            pool.join()
+                    step += 1
+                    if verbose:
+                        print_msg(app_name, step, total_steps)
+                    else:
+                        pbar.update()
+
+            print_idle_time(worker_ends, start, processes)
+            print_raster_cache_stats(worker_stats)
         elif mode == bt_const.ParallelMode.SEQUENTIAL:
             print("Sequential processing started...", flush=True)
             with tqdm(total=total_steps, disable=verbose) as pbar:
                 for line in in_data:
-                    result_item = in_func(line)
-                    if result_is_valid(result_item):
-                        out_result.append(result_item)
+                    collect(run_task(line, in_func, **shared_args))
 
                     step += 1
                     if verbose:
                         print_msg(app_name, step, total_steps)
                     else:
                         pbar.update()
-        elif mode == bt_const.ParallelMode.CONCURRENT:
-            print("Concurrent processing started...", flush=True)
-            print("Using {} CPU cores".format(processes), flush=True)
-            with con_futures.ProcessPoolExecutor(max_workers=processes) as executor:
-                futures = [executor.submit(in_func, line) for line in in_data]
-                with tqdm(total=total_steps, disable=verbose) as pbar:
-                    for future in con_futures.as_completed(futures):
-                        result_item = future.result()
-                        if result_is_valid(result_item):
-                            out_result.append(result_item)
-
-                        step += 1
-                        if verbose:
-                            print_msg(app_name, step, total_steps)
-                        else:
-                            pbar.update()
+        elif mode == bt_const.ParallelMode.DASK:
+            print("Dask processing started...", flush=True)
+            print("Using {} Dask workers".format(processes), flush=True)
+            with tqdm(total=total_steps, disable=verbose) as pbar:
+                for result_item in dask_results(in_func, in_data, processes, shared_args):
+                    collect(result_item, measure=True)
+
+                    step += 1
+                    if verbose:
+                        print_msg(app_name, step, total_steps)
+                    else:
+                        pbar.update()
+        elif mode == bt_const.ParallelMode.SLURM:
+            print("SLURM job array started...", flush=True)
+            print("Using {} CPU cores per array task".format(processes), flush=True)
+            from beratools.utility.slurm_array import slurm_results
+
+            results = slurm_results(in_func, in_data, app_name, processes, shared_args, task_timeout)
+            for result_item in results:
+                collect(result_item, measure=True)
+
+            if verbose:
+                print_msg(app_name, total_steps, total_steps)
+
+        print_result_size(result_bytes)
+        print_failures(failed)
     except Exception as e:
         print(e)
         return None
+    finally:
+        # results written so far are kept when processing fails
+        if sink is not None:
+            sink.close()
+
+        for store in stores:
+            store.close()
+
+        # rasters pooled by sequential mode are not kept open after tool finishes
+        raster_cache.clear_raster_cache()
 
     return out_result
@@ -13,16 +13,17 @@ Description:
     The purpose of this script is to provide main interface for canopy footprint tool.
     The tool is used to generate the footprint of a line based on absolute threshold.
 """
+import functools
 import logging
 import time
+from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
-import pandas as pd
 import rasterio
 from rasterio import features
 from rasterio.transform import rowcol
-from shapely.geometry import MultiPolygon, Polygon, shape
+from shapely.geometry import LineString, MultiPolygon, shape
 
 import beratools.core.algo_centerline as algo_cl
 import beratools.core.algo_common as algo_common
@@ -31,6 +32,7 @@ import beratools.core.constants as bt_const
 import beratools.core.tool_base as bt_base
 import beratools.utility.spatial_common as sp_common
 from beratools.core.logger import Logger
+from beratools.utility.result_cache import open_result_cache, raster_fingerprint
 
 log = Logger("canopy_footprint_abs", file_level=logging.INFO)
 logger = log.get_logger()
@@ -38,31 +40,64 @@ print = log.print
 
 
 class FootprintAbsolute:
-    """Class to compute the footprint of a line based on absolute threshold."""
+    """
+    Line work item to compute the footprint of a line based on absolute threshold.
+
+    Item carries index, ID and coordinates of line in LineTable only. Workers
+    return its ResultRecord, footprint GeoDataFrame is assembled from
+    records in main process.
+    """
+
+    __slots__ = (
+        "index",
+        "coords",
+        "line_id",
+        "in_chm",
+        "corridor_thresh",
+        "max_ln_width",
+        "exp_shk_cell",
+        "cost_file",
+        "footprint",
+        "corridor_poly",
+        "centerline",
+    )
 
     def __init__(
         self,
-        line_seg,
-        in_chm,
-        corridor_thresh,
-        max_ln_width,
-        exp_shk_cell,
+        index,
+        coords,
+        in_chm=None,
+        corridor_thresh=None,
+        max_ln_width=None,
+        exp_shk_cell=None,
+        cost_file=None,
+        line_id=None,
     ):
-        self.line_seg = line_seg
+        self.index = index
+        self.coords = coords
+        self.line_id = line_id
+        self.set_context(in_chm, corridor_thresh, max_ln_width, exp_shk_cell, cost_file)
+
+        self.footprint = None
+        self.corridor_poly = None
+        self.centerline = None
+
+    @property
+    def geometry(self):
+        return LineString(self.coords)
+
+    def set_context(self, in_chm, corridor_thresh, max_ln_width, exp_shk_cell, cost_file=None):
+        """Set raster and parameters shared by all lines, in worker when sent once per worker."""
         self.in_chm = in_chm
         self.corridor_thresh = corridor_thresh
         self.max_ln_width = max_ln_width
         self.exp_shk_cell = exp_shk_cell
-
-        self.footprint = None
-        self.corridor_poly_gpd = None
-        self.centerline = None
+        self.cost_file = cost_file
 
     def compute(self):
         """Generate line footprint."""
         in_chm = self.in_chm
         corridor_thresh = self.corridor_thresh
-        line_gpd = self.line_seg
         max_ln_width = self.max_ln_width
         exp_shk_cell = self.exp_shk_cell
 
@@ -77,7 +112,7 @@ class FootprintAbsolute:
             print(f"FootprintAbsolute.compute: exception {e}")
 
         segment_list = []
-        feat = self.line_seg.geometry[0]
+        feat = self.geometry
         for coord in feat.coords:
             segment_list.append(coord)
 
@@ -87,12 +122,17 @@ class FootprintAbsolute:
 
         # Buffer around line and clip cost raster and canopy raster
         # TODO: deal with NODATA
-        clip_cost, out_meta = sp_common.clip_raster(in_chm, feat, max_ln_width)
+        clip_chm, out_meta = sp_common.clip_raster(in_chm, feat, max_ln_width)
         out_transform = out_meta["transform"]
         cell_size_x = out_transform[0]
         cell_size_y = -out_transform[4]
 
-        clip_cost, clip_canopy = algo_cost.cost_raster(clip_cost, out_meta)
+        if self.cost_file:
+            # cost from precomputed surface, canopy from CHM clip of the same window
+            clip_cost, _ = algo_common.clip_cost_raster(in_chm, feat, max_ln_width, self.cost_file)
+            clip_canopy = algo_cost.canopy_raster(clip_chm)
+        else:
+            clip_cost, clip_canopy = algo_cost.cost_raster(clip_chm, out_meta)
 
         # Work out the corridor from both end of the centerline
         if len(clip_canopy.shape) > 2:
@@ -111,6 +151,8 @@ class FootprintAbsolute:
         )
 
         clean_raster = algo_common.morph_raster(corridor_thresh, clip_canopy, exp_shk_cell, cell_size_x)
+        algo_common.save_debug_raster(f"footprint_abs_{self.index}_corridor", corridor_thresh, out_meta)
+        algo_common.save_debug_raster(f"footprint_abs_{self.index}_clean", clean_raster, out_meta)
 
         # create mask for non-polygon area
         msk = np.where(clean_raster == 1, True, False)
@@ -126,65 +168,52 @@ class FootprintAbsolute:
             multi_polygon.append(shape(shp))
         poly = MultiPolygon(multi_polygon)
 
-        # create a pandas dataframe for the footprint
-        # Ensure CRS is a string
-        crs_str = None
-        if hasattr(self.line_seg, "crs") and self.line_seg.crs:
-            if hasattr(self.line_seg.crs, "to_string"):
-                crs_str = self.line_seg.crs.to_string()
-            else:
-                crs_str = str(self.line_seg.crs)
-        else:
-            crs_str = "EPSG:4326"
-        # Ensure poly is a valid shapely geometry
-        if not isinstance(poly, (Polygon, MultiPolygon)):
-            poly = MultiPolygon([poly]) if poly else None
-
-        # Fallback CRS if invalid
-        if not crs_str or not isinstance(crs_str, str) or not crs_str.startswith("EPSG"):
-            crs_str = "EPSG:4326"
-
-        # Only create GeoDataFrame if poly is not None
-        if poly is not None and isinstance(poly, (Polygon, MultiPolygon)):
-            geometry_list = [poly]
-        else:
-            geometry_list = []
-
-        import pandas as pd
-        self.footprint = gpd.GeoDataFrame({"geometry": geometry_list})
-        self.footprint.set_crs(crs_str, inplace=True)
+        # footprint GeoDataFrame is created in main process
+        self.footprint = poly
 
         # find contiguous corridor polygon for centerline
-        corridor_poly_gpd = algo_cl.find_corridor_polygon(corridor_thresh, out_transform, line_gpd)
+        df = gpd.GeoDataFrame(geometry=[feat])
+        corridor_poly_gpd = algo_cl.find_corridor_polygon(corridor_thresh, out_transform, df)
         centerline, status = algo_cl.find_centerline(corridor_poly_gpd.geometry.iloc[0], feat)
 
-        self.corridor_poly_gpd = corridor_poly_gpd
+        self.corridor_poly = corridor_poly_gpd.geometry.iloc[0]
         self.centerline = centerline
 
+    def to_record(self):
+        """Return ResultRecord of footprint, corridor polygon and centerline are not sent back."""
+        record = bt_base.ResultRecord(self.index)
+        if self.footprint is not None:
+            record.add_rows("footprint", [self.footprint])
 
-def process_single_line(line_footprint):
-    try:
-        line_footprint.compute()
-    except Exception as e:
-        print(f"process_single_line: exception {e}")
-    return line_footprint
+        return record
 
 
-def generate_line_class_list(
-    in_line,
-    in_chm,
-    corridor_thresh,
-    max_ln_width,
-    exp_shk_cell,
-    in_layer=None,
-):
-    line_classes = []
-    line_list = algo_common.prepare_lines_gdf(in_line, in_layer, proc_segments=False)
+def process_single_line(line_footprint, in_chm=None, **context):
+    # exception is reported as failed item by execute_multiprocessing, so it is not cached
+    if in_chm is not None:
+        line_footprint.set_context(in_chm, **context)
+    line_footprint.compute()
+    return line_footprint.to_record()
+
+
+def generate_line_class_list(line_table):
+    """Create FootprintAbsolute of each line, raster and parameters are sent to workers separately."""
+    line_ids = line_table.line_ids() or [None] * len(line_table)
+    return [
+        FootprintAbsolute(i, line_table.line_coords(i), line_id=line_ids[i]) for i in range(len(line_table))
+    ]
+
+
+def footprint_crs(crs):
+    """Return EPSG string of line CRS for footprint, EPSG:4326 when it has no EPSG code."""
+    crs_str = None
+    if crs:
+        crs_str = crs.to_string() if hasattr(crs, "to_string") else str(crs)
 
-    for line in line_list:
-        line_classes.append(FootprintAbsolute(line, in_chm, corridor_thresh, max_ln_width, exp_shk_cell))
+    if not crs_str or not crs_str.startswith("EPSG"):
+        crs_str = "EPSG:4326"
 
-    return line_classes
+    return crs_str
 
 
 def canopy_footprint_abs(
@@ -199,17 +228,50 @@ def canopy_footprint_abs(
     in_layer=None,
     out_layer=None,
     parallel_mode=bt_const.ParallelMode.MULTIPROCESSING,
+    cost_file=None,
+    precompute_cost=False,
 ):
+    """
+    Generate line footprint based on absolute threshold.
+
+    Args:
+        cost_file: precomputed cost surface, cost is clipped from it instead
+            of computed from CHM for each line
+        precompute_cost (bool): compute cost surface for the whole CHM first.
+            It is saved to cost_file, or beside out_footprint when cost_file is None.
+
+    Unchanged lines are served from result cache when bt_const.RESULT_CACHE_DIR is set.
+
+    """
     max_ln_width = float(max_ln_width)
     exp_shk_cell = int(exp_shk_cell)
 
-    footprint_list = []
-    poly_list = []
-
-    line_class_list = generate_line_class_list(
-        in_line, in_chm, corridor_thresh, max_ln_width, exp_shk_cell, in_layer
+    cost_file = algo_common.prepare_cost_surface(in_chm, out_footprint, cost_file, precompute_cost, processes)
+    line_table = algo_common.prepare_line_table(in_line, in_layer, proc_segments=False)
+    if line_table is None:
+        return
+
+    line_class_list = generate_line_class_list(line_table)
+    shared_args = {
+        "in_chm": in_chm,
+        "corridor_thresh": corridor_thresh,
+        "max_ln_width": max_ln_width,
+        "exp_shk_cell": exp_shk_cell,
+        "cost_file": cost_file,
+    }
+
+    result_cache = open_result_cache(
+        {
+            "tool": "canopy_footprint_abs",
+            "corridor_thresh": corridor_thresh,
+            "max_ln_width": max_ln_width,
+            "exp_shk_cell": exp_shk_cell,
+            "in_chm": raster_fingerprint(in_chm),
+            "cost_file": raster_fingerprint(cost_file),
+            **algo_common.corridor_settings(),
+        }
     )
-
+    failures = []
     feat_list = bt_base.execute_multiprocessing(
         process_single_line,
         line_class_list,
@@ -217,24 +279,26 @@ def canopy_footprint_abs(
         processes,
         parallel_mode,
         verbose=verbose,
+        shared_args=shared_args,
+        cost_estimator=functools.partial(bt_base.estimate_line_cost, buffer_width=2 * max_ln_width),
+        failures=failures,
+        result_cache=result_cache,
     )
 
-    if feat_list:
-        for i in feat_list:
-            if i.footprint is not None:
-                footprint_list.append(i.footprint)
-            if i.corridor_poly_gpd is not None:
-                poly_list.append(i.corridor_poly_gpd)
-
-    if footprint_list:
-        results = gpd.GeoDataFrame(pd.concat(footprint_list))
-        results = results.reset_index(drop=True)
+    footprints = bt_base.records_to_gdf(feat_list or [], "footprint", crs=footprint_crs(line_table.crs))
+    if not footprints.empty:
         layer_name = out_layer if out_layer else "canopy_footprint"
-        results.to_file(out_footprint, layer=layer_name)
+        footprints.to_file(out_footprint, layer=layer_name)
         print(f"Saved footprint to {out_footprint} (layer: {layer_name})")
     else:
         print("Warning: No footprints generated. Output file not written.")
 
+    # failed lines go to out_footprint when it is GeoPackage, beside it otherwise
+    failed_file = Path(out_footprint)
+    if failed_file.suffix != ".gpkg":
+        failed_file = failed_file.with_name(failed_file.stem + "_failed.gpkg")
+    bt_base.save_failures(failures, failed_file.as_posix(), "failed_lines", crs=line_table.crs)
+
 
 if __name__ == "__main__":
     start_time = time.time()
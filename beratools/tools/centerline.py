@@ -13,37 +13,91 @@ Description:
     The purpose of this script is to provide main interface for centerline tool.
 """
 
+import functools
 import logging
 import time
 from pathlib import Path
 
-import pandas as pd
-
 import beratools.core.algo_centerline as algo_centerline
 import beratools.core.algo_common as algo_common
 import beratools.core.constants as bt_const
 import beratools.utility.spatial_common as sp_common
 from beratools.core.logger import Logger
-from beratools.core.tool_base import execute_multiprocessing
+from beratools.core.tool_base import (
+    estimate_line_cost,
+    execute_multiprocessing,
+    records_to_gdf,
+    save_failures,
+)
+from beratools.utility.checkpoint import CheckpointStore, checkpoint_file, file_fingerprint
+from beratools.utility.result_cache import open_result_cache, raster_fingerprint
+from beratools.utility.result_writer import ResultWriter
 
 log = Logger("centerline", file_level=logging.INFO)
 logger = log.get_logger()
 print = log.print
 
 
-def generate_line_class_list(in_vector, in_raster, line_radius, layer=None, proc_segments=True) -> list:
-    line_classes = []
-    line_list = algo_common.prepare_lines_gdf(in_vector, layer, proc_segments)
+def generate_line_class_list(line_table) -> list:
+    """Create SeedLine of each line, raster and parameters are sent to workers separately."""
+    line_ids = line_table.line_ids() or [None] * len(line_table)
+    return [
+        algo_centerline.SeedLine(i, line_table.line_coords(i), line_id=line_ids[i])
+        for i in range(len(line_table))
+    ]
+
+
+def layer_gdf(line_table, records, layer):
+    """Return GeoDataFrame of layer of result records, with line attributes except corridor polygon."""
+    if layer == "corridor_polygon":
+        return records_to_gdf(records, layer, crs=line_table.crs)
 
-    for item in line_list:
-        line_classes.append(algo_centerline.SeedLine(item, in_raster, proc_segments, line_radius))
+    return records_to_gdf(records, layer, line_table=line_table)
 
-    return line_classes
 
+def process_single_line_class(seed_line, in_raster=None, line_radius=None, cost_file=None):
+    if in_raster is not None:
+        seed_line.set_context(in_raster, line_radius, cost_file)
 
-def process_single_line_class(seed_line):
     seed_line.compute()
-    return seed_line
+    return seed_line.to_record()
+
+
+def add_stage_timings(stage_times, record):
+    """Add SeedLine stage times of result record to running (total seconds, line count) of each stage."""
+    for stage, seconds in record.attributes.get("timings", {}).items():
+        total, count = stage_times.get(stage, (0.0, 0))
+        stage_times[stage] = (total + seconds, count + 1)
+
+
+def report_stage_timings(stage_times):
+    """Print time spent in each SeedLine stage, summed over all lines."""
+    for stage, (total, count) in stage_times.items():
+        print(
+            f"Stage {stage}: {total:.2f} s in total, "
+            f"{total / count * 1000:.1f} ms per line ({count} lines)"
+        )
+
+
+def output_layers(out_line, out_layer):
+    """
+    Return output (file, layer) of centerline, least cost path, corridor polygon and failed lines.
+
+    Auxiliary layers go to out_line when it is GeoPackage, to <stem>_aux.gpkg
+    beside shapefile and to <stem>_<layer>.parquet beside GeoParquet.
+    """
+    out_line_path = Path(out_line)
+    layers = {"centerline": (out_line, out_layer)}
+    for layer in ("least_cost_path", "corridor_polygon", "failed_lines"):
+        if out_line_path.suffix == ".shp":
+            aux_file = out_line_path.with_name(out_line_path.stem + "_aux.gpkg").as_posix()
+        elif out_line_path.suffix == ".parquet":
+            aux_file = out_line_path.with_name(f"{out_line_path.stem}_{layer}.parquet").as_posix()
+        else:
+            aux_file = out_line  # continue using out_line (gpkg)
+        layers[layer] = (aux_file, layer)
+
+    return layers
 
 
 def centerline(
@@ -57,67 +111,170 @@ def centerline(
     in_layer=None,
     out_layer=None,
     parallel_mode=bt_const.ParallelMode.MULTIPROCESSING,
+    cost_file=None,
+    precompute_cost=False,
+    stream_output=False,
+    resume=False,
 ):
+    """
+    Generate centerlines from seed lines and CHM.
+
+    Args:
+        cost_file: precomputed cost surface, cost is clipped from it instead
+            of computed from CHM for each line
+        precompute_cost (bool): compute cost surface for the whole CHM first.
+            It is saved to cost_file, or beside out_line when cost_file is None.
+        stream_output (bool): append results to output files in batches as lines
+            finish, instead of keeping all of them in memory until the end.
+            out_line can be GeoPackage, shapefile or GeoParquet (.parquet).
+        resume (bool): skip lines completed by previous run with same parameters,
+            their results are read from checkpoint file beside out_line.
+            Unchanged lines are also served from result cache when
+            bt_const.RESULT_CACHE_DIR is set, whether resumed or not.
+
+    """
     if not sp_common.compare_crs(sp_common.vector_crs(in_line), sp_common.raster_crs(in_raster)):
         print("Line and CHM have different spatial references, please check.")
         return
 
-    line_class_list = generate_line_class_list(
-        in_line,
-        in_raster,
-        line_radius=float(line_radius),
-        layer=in_layer,
-        proc_segments=proc_segments,
+    cost_file = algo_common.prepare_cost_surface(in_raster, out_line, cost_file, precompute_cost, processes)
+    line_table = algo_common.prepare_line_table(in_line, layer=in_layer, proc_segments=proc_segments)
+    if line_table is None:
+        return
+
+    line_class_list = generate_line_class_list(line_table)
+    shared_args = {"in_raster": in_raster, "line_radius": float(line_radius), "cost_file": cost_file}
+    cost_estimator = functools.partial(estimate_line_cost, buffer_width=2 * float(line_radius))
+    crs = line_table.crs
+    # input files are identified by fingerprint, so results of edited files are not resumed
+    params = {
+        **shared_args,
+        "in_line": file_fingerprint(in_line),
+        "in_layer": in_layer,
+        "proc_segments": proc_segments,
+        "in_raster": raster_fingerprint(in_raster),
+        "cost_file": raster_fingerprint(cost_file),
+        **algo_centerline.centerline_settings(),
+    }
+    checkpoint = CheckpointStore(checkpoint_file(out_line), params, resume)
+    result_cache = open_result_cache(
+        {
+            "tool": "centerline",
+            "line_radius": float(line_radius),
+            "proc_segments": proc_segments,
+            "in_raster": raster_fingerprint(in_raster),
+            "cost_file": raster_fingerprint(cost_file),
+            **algo_centerline.centerline_settings(),
+        }
     )
+    execute_args = {
+        "processes": processes,
+        "verbose": verbose,
+        "mode": parallel_mode,
+        "shared_args": shared_args,
+        "cost_estimator": cost_estimator,
+        "checkpoint": checkpoint,
+        "result_cache": result_cache,
+    }
 
     print("{} lines to be processed.".format(len(line_class_list)))
 
-    lc_path_list = []
-    centerline_list = []
-    corridor_poly_list = []
+    layers = output_layers(out_line, out_layer)
+    if stream_output:
+        failures = stream_results(line_table, line_class_list, layers, **execute_args)
+        finish_checkpoint(checkpoint, failures, layers, crs)
+        return
+
+    failures = []
     result = execute_multiprocessing(
-        process_single_line_class,
-        line_class_list,
-        "Centerline",
-        processes,
-        verbose=verbose,
-        mode=parallel_mode,
+        process_single_line_class, line_class_list, "Centerline", failures=failures, **execute_args
     )
     if not result:
+        finish_checkpoint(checkpoint, failures if result is not None else None, layers, crs)
         print("No centerlines found.")
         return
 
+    stage_times = {}
     for item in result:
-        lc_path_list.append(item.lc_path)
-        centerline_list.append(item.centerline)
-        corridor_poly_list.append(item.corridor_poly_gpd)
+        add_stage_timings(stage_times, item)
 
-    # Concatenate the lists of GeoDataFrames into single GeoDataFrames
-    if len(lc_path_list) == 0 or len(centerline_list) == 0 or len(corridor_poly_list) == 0:
+    report_stage_timings(stage_times)
+
+    centerline_list = layer_gdf(line_table, result, "centerline")
+    lc_path_list = layer_gdf(line_table, result, "least_cost_path")
+    corridor_polys = layer_gdf(line_table, result, "corridor_polygon")
+    if centerline_list.empty:
+        finish_checkpoint(checkpoint, failures, layers, crs)
         print("No centerline generated.")
         return 1
 
-    lc_path_list = pd.concat(lc_path_list, ignore_index=True)
-    centerline_list = pd.concat(centerline_list, ignore_index=True)
-    corridor_polys = pd.concat(corridor_poly_list, ignore_index=True)
-
-    # Save the concatenated GeoDataFrames to the shapefile/gpkg
+    # Save the GeoDataFrames to the shapefile/gpkg
     centerline_list.to_file(out_line, layer=out_layer)
     print(f"Saved centerlines to: {out_line}")
 
-    # Check if the output file is a shapefile
-    out_line_path = Path(out_line)
-
-    if out_line_path.suffix == ".shp":
-        # Generate the new file name for the GeoPackage with '_aux' appended
-        aux_file = out_line_path.with_name(out_line_path.stem + "_aux.gpkg")
+    aux_file = layers["least_cost_path"][0]
+    if aux_file != out_line:
         print(f"Saved auxiliary data to: {aux_file}")
-    else:
-        aux_file = out_line  # continue using out_line (gpkg)
 
     # Save lc_path_list and corridor_polys to the new GeoPackage with '_aux' suffix
     lc_path_list.to_file(aux_file, layer="least_cost_path")
     corridor_polys.to_file(aux_file, layer="corridor_polygon")
+    finish_checkpoint(checkpoint, failures, layers, crs)
+
+
+def finish_checkpoint(checkpoint, failures, layers, crs):
+    """Save failed lines, remove checkpoint when all lines are done or keep it to resume failed lines."""
+    checkpoint.close()
+    if failures is None:
+        return
+
+    save_failures(failures, *layers["failed_lines"], crs=crs)
+    if failures:
+        print(f"Checkpoint kept to retry failed lines with resume: {checkpoint.path}")
+    else:
+        checkpoint.remove()
+
+
+def stream_results(line_table, line_class_list, layers, **execute_args):
+    """
+    Process seed lines and append their results to output layers in batches.
+
+    Returns:
+        list: TaskFailure of failed lines, None on failure
+
+    """
+    stage_times = {}
+
+    def to_layers(record):
+        add_stage_timings(stage_times, record)
+        return {
+            layers[layer]: layer_gdf(line_table, [record], layer)
+            for layer in ("centerline", "least_cost_path", "corridor_polygon")
+        }
+
+    writer = ResultWriter(to_layers)
+    failures = []
+    result = execute_multiprocessing(
+        process_single_line_class,
+        line_class_list,
+        "Centerline",
+        sink=writer,
+        failures=failures,
+        **execute_args,
+    )
+    if result is None:
+        return None
+
+    report_stage_timings(stage_times)
+    if writer.rows[layers["centerline"]] == 0:
+        print("No centerlines found.")
+        return failures
+
+    for layer, key in layers.items():
+        if key in writer.rows:
+            print(f"Saved {writer.rows[key]} {layer} features to: {key[0]}")
+
+    return failures
 
 
 # TODO: fix geometries when job done
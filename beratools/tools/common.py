@@ -21,15 +21,14 @@ import xarray as xr
 import xrspatial
 from scipy import ndimage
 
-import beratools.core.constants as bt_const
+import beratools.core.algo_cost as algo_cost
+
+
+def remove_nan_from_array(matrix, nodata=None):
+    """Replace NaN and nodata cells with BT_NODATA_COST in place."""
+    algo_cost.normalize_nodata(matrix, nodata)
 
 
-def remove_nan_from_array(matrix):
-    with np.nditer(matrix, op_flags=["readwrite"]) as it:
-        for x in it:
-            if np.isnan(x[...]):
-                x[...] = bt_const.BT_NODATA_COST
-                
 def split_into_equal_Nth_segments(df, seg_length):
     odf = df
     crs = odf.crs
@@ -204,19 +203,14 @@ def dyn_np_cc_map(in_chm, canopy_ht_threshold, nodata):
     return canopy_ndarray
 
 
-def generate_line_args_DFP_NoClip(
-    line_seg,
-    work_in_bufferL,
-    work_in_bufferC,
-    in_chm_obj,
-    in_chm,
-    tree_radius,
-    max_line_dist,
-    canopy_avoidance,
-    exponent,
-    work_in_bufferR,
-    canopy_thresh_percentage,
-):
+def generate_line_args_DFP_NoClip(line_seg, work_in_bufferL, work_in_bufferC, work_in_bufferR):
+    """
+    Return arguments of each line of left, right and center sides.
+
+    Each item is [DynCanTh, line, line_id, cut distance, side, line buffer], CHM and
+    cost parameters are shared by all lines and sent to workers once, see
+    line_footprint_functions.process_single_line_relative.
+    """
     line_argsL = []
     line_argsR = []
     line_argsC = []
@@ -226,43 +220,24 @@ def generate_line_args_DFP_NoClip(
         line_bufferC = work_in_bufferC.loc[record, "geometry"]
         LCut = work_in_bufferL.loc[record, "LDist_Cut"]
 
-        nodata = bt_const.BT_NODATA
         line_argsL.append(
             [
-                in_chm,
                 float(work_in_bufferL.loc[record, "DynCanTh"]),
-                float(tree_radius),
-                float(max_line_dist),
-                float(canopy_avoidance),
-                float(exponent),
-                in_chm_obj.res,
-                nodata,
                 line_seg.iloc[[record]],
-                in_chm_obj.meta.copy(),
                 line_id,
                 LCut,
                 "Left",
-                canopy_thresh_percentage,
                 line_bufferL,
             ]
         )
 
         line_argsC.append(
             [
-                in_chm,
                 float(work_in_bufferC.loc[record, "DynCanTh"]),
-                float(tree_radius),
-                float(max_line_dist),
-                float(canopy_avoidance),
-                float(exponent),
-                in_chm_obj.res,
-                nodata,
                 line_seg.iloc[[record]],
-                in_chm_obj.meta.copy(),
                 line_id,
                 10,
                 "Center",
-                canopy_thresh_percentage,
                 line_bufferC,
             ]
         )
@@ -273,27 +248,16 @@ def generate_line_args_DFP_NoClip(
     for record in range(0, len(work_in_bufferR)):
         line_bufferR = work_in_bufferR.loc[record, "geometry"]
         RCut = work_in_bufferR.loc[record, "RDist_Cut"]
-        line_bufferC = work_in_bufferC.loc[record, "geometry"]
 
-        nodata = bt_const.BT_NODATA
         # TODO deal with inherited nodata and BT_NODATA_COST
         # TODO convert nodata to BT_NODATA_COST
         line_argsR.append(
             [
-                in_chm,
                 float(work_in_bufferR.loc[record, "DynCanTh"]),
-                float(tree_radius),
-                float(max_line_dist),
-                float(canopy_avoidance),
-                float(exponent),
-                in_chm_obj.res,
-                nodata,
                 line_seg.iloc[[record]],
-                in_chm_obj.meta.copy(),
                 line_id,
                 RCut,
                 "Right",
-                canopy_thresh_percentage,
                 line_bufferR,
             ]
         )
@@ -16,6 +16,7 @@ Description:
 import logging
 import time
 
+import beratools.core.algo_common as algo_common
 import beratools.core.algo_vertex_optimization as bt_vo
 import beratools.utility.spatial_common as sp_common
 from beratools.core.logger import Logger
@@ -34,10 +35,23 @@ def vertex_optimization(
     verbose,
     in_layer=None,
     out_layer=None,
+    cost_file=None,
+    precompute_cost=False,
 ):
+    """
+    Move line vertices onto seismic line courses.
+
+    Args:
+        cost_file: precomputed cost surface, cost is clipped from it instead
+            of computed from CHM for each vertex
+        precompute_cost (bool): compute cost surface for the whole CHM first.
+            It is saved to cost_file, or beside out_line when cost_file is None.
+
+    """
     if not sp_common.compare_crs(sp_common.vector_crs(in_line), sp_common.raster_crs(in_raster)):
         return
 
+    cost_file = algo_common.prepare_cost_surface(in_raster, out_line, cost_file, precompute_cost, processes)
     vg = bt_vo.VertexGrouping(
         in_line,
         in_raster,
@@ -48,6 +62,7 @@ def vertex_optimization(
         verbose,
         in_layer,
         out_layer,
+        cost_file,
     )
     vg.create_all_vertex_groups()
     vg.compute()
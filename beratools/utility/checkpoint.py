@@ -0,0 +1,228 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the checkpoint store of execute_multiprocessing.
+    Result of each work item is appended to SQLite sidecar file by the
+    worker as soon as it finishes, keyed by tool parameters and line ID.
+    Tool run with resume=True skips items found in the store and merges
+    their stored results into output.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+
+import geopandas as gpd
+
+import beratools.core.constants as bt_const
+
+# SQLite connection of each checkpoint file in worker process
+_connections = {}
+
+
+def connect(path):
+    """Open SQLite checkpoint file for concurrent appends by worker processes."""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results "
+        "(params TEXT, key TEXT, result BLOB, PRIMARY KEY (params, key))"
+    )
+    conn.commit()
+    return conn
+
+
+def file_fingerprint(in_file):
+    """
+    Return path, modification time and size of file, None when in_file is None.
+
+    Shapefile includes its attribute and index files, so editing attributes
+    of lines gives new fingerprint.
+    """
+    if not in_file:
+        return None
+
+    in_path = Path(in_file)
+    files = [in_path]
+    if in_path.suffix.lower() == ".shp":
+        files += [in_path.with_suffix(suffix) for suffix in (".dbf", ".shx")]
+
+    fingerprint = [in_path.resolve().as_posix()]
+    for item in files:
+        if item.exists():
+            stat = item.stat()
+            fingerprint += [stat.st_mtime_ns, stat.st_size]
+
+    return fingerprint
+
+
+def checkpoint_file(out_file):
+    """Return checkpoint sidecar path of output file, such as out.gpkg -> out.checkpoint.sqlite."""
+    out_path = Path(out_file)
+    return out_path.with_name(out_path.stem + ".checkpoint.sqlite").as_posix()
+
+
+def line_ids(item, id_columns, depth=2):
+    """
+    Return line ID found in item, None when not found.
+
+    ID is line_id of work item, such as SeedLine, or values of id_columns
+    of single row GeoDataFrame.
+    """
+    if isinstance(item, gpd.GeoDataFrame):
+        columns = [col for col in id_columns if col in item.columns]
+        if len(item) != 1 or not columns:
+            return None
+        return tuple(item[col].iloc[0] for col in columns)
+
+    if getattr(item, "line_id", None) is not None:
+        return tuple(item.line_id)
+
+    if depth == 0:
+        return None
+
+    if isinstance(item, (list, tuple)):
+        values = item
+    elif isinstance(item, dict):
+        values = item.values()
+    elif hasattr(item, "__dict__"):
+        values = vars(item).values()
+    else:
+        return None
+
+    for value in values:
+        ids = line_ids(value, id_columns, depth - 1)
+        if ids is not None:
+            return ids
+
+    return None
+
+
+def item_keys(in_data, id_columns=("OLnFID", "OLnSEG")):
+    """
+    Return checkpoint key of each work item.
+
+    Keys are line IDs (line_id of work items, or OLnFID and OLnSEG) of
+    items when all items have unique IDs, row index of items in in_data
+    otherwise.
+    """
+    ids = [line_ids(item, id_columns) for item in in_data]
+    if all(item is not None for item in ids) and len(set(ids)) == len(ids):
+        return ["/".join(str(value) for value in item) for item in ids]
+
+    return [str(i) for i in range(len(in_data))]
+
+
+def append_result(path, params, key, result):
+    """Append result of one item to checkpoint file, called in worker process."""
+    conn = _connections.get((os.getpid(), path))
+    if conn is None:
+        conn = connect(path)
+        _connections[(os.getpid(), path)] = conn
+
+    blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (params, key, blob))
+
+
+def close_connection(path):
+    """Close cached connection of checkpoint file in this process."""
+    conn = _connections.pop((os.getpid(), path), None)
+    if conn is not None:
+        conn.close()
+
+
+class CheckpointStore(object):
+    """
+    Checkpoint of work item results in SQLite file.
+
+    Args:
+        path: SQLite file, see checkpoint_file
+        params (dict): tool parameters, results of other parameters are not resumed
+        resume (bool): keep results of previous run with same parameters,
+            they are cleared otherwise. Stores of different parameters can
+            share one file, such as left and right side of lines.
+
+    """
+
+    name = "checkpoint"
+
+    def __init__(self, path, params, resume=False):
+        self.path = Path(path).as_posix()
+        self.params = json.dumps(params, sort_keys=True, default=str)
+        self.conn = connect(self.path)
+        if not resume:
+            with self.conn:
+                self.conn.execute("DELETE FROM results WHERE params = ?", (self.params,))
+
+    def keys(self):
+        """Return keys of items completed with current parameters."""
+        rows = self.conn.execute("SELECT key FROM results WHERE params = ?", (self.params,))
+        return {row[0] for row in rows}
+
+    def item_keys(self, in_data):
+        return item_keys(in_data)
+
+    def contains(self, keys):
+        """Return keys found in checkpoint."""
+        return self.keys() & set(keys)
+
+    def results(self, keys, batch_size=bt_const.CHECKPOINT_READ_BATCH):
+        """
+        Yield stored results of keys in order of keys, keys are found by contains.
+
+        Results are selected in batches of keys and unpickled one at a time,
+        None is yielded for result not found or not unpickled.
+        """
+        keys = list(keys)
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start : start + batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, result FROM results WHERE params = ? AND key IN ({placeholders})",
+                (self.params, *batch),
+            )
+            blobs = dict(rows)
+            for key in batch:
+                try:
+                    yield pickle.loads(blobs[key])
+                except (KeyError, EOFError, pickle.UnpicklingError) as e:
+                    print(f"CheckpointStore: result of {key} not read: {e}")
+                    yield None
+
+    def writer(self):
+        """Return picklable writer appending results in worker processes."""
+        return CheckpointWriter(self.path, self.params)
+
+    def close(self):
+        self.conn.close()
+        close_connection(self.path)
+
+    def remove(self):
+        """Remove checkpoint file with results of all parameters, called when tool output is saved."""
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(self.path + suffix).unlink(missing_ok=True)
+
+
+class CheckpointWriter(object):
+    """Append results to checkpoint file of one set of parameters."""
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+
+    def append(self, key, result):
+        append_result(self.path, self.params, key, result)
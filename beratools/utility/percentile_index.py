@@ -0,0 +1,273 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the approximate percentile index of rasters such as CHM.
+    Valid cells of each block of block_size x block_size cells are counted
+    in bins of fixed width, histograms are saved to a directory next to the
+    raster. Percentile of zone is computed from histograms of blocks fully
+    covered by zone and exact values of its edge blocks, cells of covered
+    blocks are never read. Each histogram cell takes center of its bin as
+    value, so percentiles differ from exact ones by no more than half of
+    bin width, which is the error bound of index.
+"""
+
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+import beratools.core.constants as bt_const
+from beratools.utility.result_cache import raster_fingerprint
+from beratools.utility.spatial_common import invalid_cells
+
+INDEX_FILE = "index.json"
+
+# loaded index of each raster and error bound in this process
+_indexes = {}
+
+
+def index_dir(in_raster):
+    """Return index directory of raster, such as chm.tif -> chm.pct_index."""
+    raster_path = Path(in_raster)
+    return raster_path.with_name(raster_path.stem + ".pct_index")
+
+
+def open_percentile_index(in_raster, error=None, build=False):
+    """
+    Return PercentileIndex of raster, None when approximate percentiles are disabled.
+
+    Index is loaded once per process. Missing or outdated index is built when
+    build is True, it is only done in main process before work items are sent
+    to workers. Workers without index use exact percentiles.
+
+    Args:
+        in_raster: raster file path
+        error (float): max error of percentiles in raster units,
+            bt_const.PERCENTILE_INDEX_ERROR when None
+        build (bool): build and save index when it is not found
+
+    """
+    error = bt_const.PERCENTILE_INDEX_ERROR if error is None else error
+    if not in_raster or not error:
+        return None
+
+    key = (Path(in_raster).resolve().as_posix(), error)
+    if key in _indexes and (_indexes[key] is not None or not build):
+        return _indexes[key]
+
+    index = PercentileIndex.load(in_raster, error)
+    if index is None and build:
+        print(f"PercentileIndex: building index of {in_raster} with error {error}")
+        PercentileIndex.build(in_raster, error).save(in_raster)
+        index = PercentileIndex.load(in_raster, error)
+    elif index is None:
+        print(f"PercentileIndex: no index of {in_raster} with error {error}, exact percentiles are used")
+
+    _indexes[key] = index
+    return index
+
+
+class PercentileIndex(object):
+    """
+    Histograms of valid raster cells of each block, stored in compressed sparse rows.
+
+    Args:
+        offsets: start of each block in bins and counts, block of raster row
+            r and column c is r * block columns + c, last item is total length
+        bins: bin of each non-empty histogram entry
+        counts: cell count of each non-empty histogram entry
+        bin_min: lower edge of first bin
+        bin_width: bin width, twice the error bound
+        block_size: block width and height in cells
+        shape: (height, width) of raster
+
+    """
+
+    def __init__(self, offsets, bins, counts, bin_min, bin_width, block_size, shape):
+        self.offsets = offsets
+        self.bins = bins
+        self.counts = counts
+        self.bin_min = bin_min
+        self.bin_width = bin_width
+        self.block_size = block_size
+        self.shape = tuple(shape)
+        self.block_cols = -(-self.shape[1] // block_size)
+
+    @property
+    def error(self):
+        return self.bin_width / 2
+
+    @classmethod
+    def build(cls, in_raster, error, block_size=None, default_nodata=bt_const.BT_NODATA):
+        """
+        Count valid cells of each block of raster by bin, raster is read by strips of block rows twice.
+
+        Args:
+            in_raster: raster file path, first band is used
+            error (float): max error of percentiles in raster units
+            block_size (int): block width and height in cells,
+                bt_const.PERCENTILE_INDEX_BLOCK_SIZE when None
+            default_nodata: nodata value of raster without nodata
+
+        """
+        block_size = block_size or bt_const.PERCENTILE_INDEX_BLOCK_SIZE
+        bin_width = 2.0 * error
+        with rasterio.open(in_raster) as src:
+            nodata = src.nodata if src.nodata is not None else default_nodata
+            shape = (src.height, src.width)
+            block_cols = -(-src.width // block_size)
+            strips = [
+                Window(0, row, src.width, min(block_size, src.height - row))
+                for row in range(0, src.height, block_size)
+            ]
+
+            def strip_values(window):
+                image = src.read(1, window=window, masked=True)
+                valid = ~invalid_cells(image, nodata, default_nodata)
+                return np.nonzero(valid)[1], np.ma.getdata(image)[valid].astype(np.float64)
+
+            # value range gives bins
+            value_min, value_max = np.inf, -np.inf
+            for window in strips:
+                _, values = strip_values(window)
+                if len(values) > 0:
+                    value_min = min(value_min, values.min())
+                    value_max = max(value_max, values.max())
+
+            if value_min > value_max:
+                value_min = value_max = 0.0
+
+            bin_min = np.floor(value_min / bin_width) * bin_width
+            bin_count = int((value_max - bin_min) // bin_width) + 1
+
+            offsets = [np.zeros(1, dtype=np.int64)]
+            bins, counts = [], []
+            for window in strips:
+                cols, values = strip_values(window)
+                value_bins = np.clip((values - bin_min) // bin_width, 0, bin_count - 1).astype(np.int64)
+                keys = (cols // block_size) * bin_count + value_bins
+                keys, key_counts = np.unique(keys, return_counts=True)
+                block_lengths = np.bincount(keys // bin_count, minlength=block_cols)
+                offsets.append(offsets[-1][-1] + np.cumsum(block_lengths))
+                bins.append(keys % bin_count)
+                counts.append(key_counts)
+
+        count_dtype = np.uint16 if block_size * block_size < 2**16 else np.uint32
+        return cls(
+            np.concatenate(offsets),
+            np.concatenate(bins).astype(np.uint16 if bin_count < 2**16 else np.uint32),
+            np.concatenate(counts).astype(count_dtype),
+            float(bin_min),
+            bin_width,
+            block_size,
+            shape,
+        )
+
+    def save(self, in_raster):
+        """Save arrays to raw files and metadata with raster fingerprint to index directory of raster."""
+        out_dir = index_dir(in_raster)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        out_dir.mkdir(parents=True)
+        arrays = {"offsets": self.offsets, "bins": self.bins, "counts": self.counts}
+        for name, array in arrays.items():
+            array.tofile(out_dir.joinpath(name + ".bin"))
+
+        meta = {
+            "fingerprint": raster_fingerprint(in_raster),
+            "bin_min": self.bin_min,
+            "bin_width": self.bin_width,
+            "block_size": self.block_size,
+            "shape": self.shape,
+            "dtypes": {name: array.dtype.str for name, array in arrays.items()},
+        }
+
+        # metadata is written last, index without it is never loaded
+        out_dir.joinpath(INDEX_FILE).write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, in_raster, error):
+        """Memory map index of raster, None when index is missing, outdated or of larger error."""
+        in_dir = index_dir(in_raster)
+        try:
+            meta = json.loads(in_dir.joinpath(INDEX_FILE).read_text())
+        except (OSError, ValueError):
+            return None
+
+        if meta["fingerprint"] != json.loads(json.dumps(raster_fingerprint(in_raster))):
+            return None
+        if meta["bin_width"] / 2 > error:
+            return None
+
+        arrays = {
+            name: np.memmap(in_dir.joinpath(name + ".bin"), dtype=dtype, mode="r")
+            if in_dir.joinpath(name + ".bin").stat().st_size > 0
+            else np.zeros(0, dtype=dtype)
+            for name, dtype in meta["dtypes"].items()
+        }
+
+        return cls(
+            arrays["offsets"],
+            arrays["bins"],
+            arrays["counts"],
+            meta["bin_min"],
+            meta["bin_width"],
+            meta["block_size"],
+            meta["shape"],
+        )
+
+    def summarize(self, labels, row_off, col_off):
+        """
+        Histograms of blocks fully covered by one label of label array.
+
+        Args:
+            labels: label array of raster window, 0 for cells without label
+            row_off, col_off: offset of window in raster
+
+        Returns:
+            tuple: (covered, hist_labels, hist_values, hist_counts), covered is
+                boolean array of cells of covered blocks, others are label,
+                bin center and cell count of each histogram entry
+
+        """
+        height, width = labels.shape
+        block_size = self.block_size
+        block_rows = (row_off + np.arange(height)) // block_size
+        block_cols = (col_off + np.arange(width)) // block_size
+        local_cols = block_cols[-1] - block_cols[0] + 1
+        local_count = (block_rows[-1] - block_rows[0] + 1) * local_cols
+        cell_blocks = (block_rows - block_rows[0])[:, np.newaxis] * local_cols + (block_cols - block_cols[0])
+
+        labeled = labels > 0
+        keys = labels[labeled].astype(np.int64) * local_count + cell_blocks[labeled]
+        keys_found, cell_counts = np.unique(keys, return_counts=True)
+        rows = block_rows[0] + keys_found % local_count // local_cols
+        cols = block_cols[0] + keys_found % local_count % local_cols
+
+        # blocks at raster edge have fewer cells
+        block_cells = np.minimum(block_size, self.shape[0] - rows * block_size) * np.minimum(
+            block_size, self.shape[1] - cols * block_size
+        )
+        full = cell_counts == block_cells
+        covered = np.zeros(labels.shape, dtype=bool)
+        covered[labeled] = np.isin(keys, keys_found[full])
+
+        blocks = rows[full] * self.block_cols + cols[full]
+        starts = np.asarray(self.offsets[blocks], dtype=np.int64)
+        lengths = np.asarray(self.offsets[blocks + 1], dtype=np.int64) - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        hist_labels = np.repeat(keys_found[full] // local_count, lengths)
+        hist_values = self.bin_min + (self.bins[entries] + 0.5) * self.bin_width
+
+        return covered, hist_labels, hist_values, np.asarray(self.counts[entries], dtype=np.int64)
@@ -0,0 +1,251 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the process-local raster handle pool and block cache
+    used by clip_raster. Each worker process keeps its own opened datasets
+    and an LRU cache of decoded raster blocks limited by a memory budget,
+    so repeated and overlapping clips are served from memory. Handles and
+    blocks are keyed by raster path with its modification time and size, so
+    rewritten rasters are opened and read again.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+import beratools.core.constants as bt_const
+
+
+class RasterBlockCache:
+    """
+    Dataset handle pool and LRU cache of decoded raster blocks.
+
+    Cache blocks are aligned to the native GeoTIFF blocks and are at least
+    min_block_size cells on each side, so striped rasters are not cached
+    row by row. Blocks keep all bands as masked arrays, same as
+    dataset.read(masked=True).
+    """
+
+    def __init__(
+        self,
+        budget_mb=bt_const.RASTER_CACHE_BUDGET_MB,
+        max_handles=bt_const.RASTER_CACHE_MAX_HANDLES,
+        min_block_size=bt_const.RASTER_CACHE_MIN_BLOCK_SIZE,
+    ):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.max_handles = max(1, int(max_handles))
+        self.min_block_size = int(min_block_size)
+
+        self._handles = OrderedDict()  # path -> (version, opened dataset)
+        self._blocks = OrderedDict()  # (path, version, block_row, block_col) -> masked array
+        self._block_shapes = {}  # path -> (block_height, block_width)
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.opens = 0
+
+    def open(self, raster_file):
+        """Return opened dataset from pool, open it when not present or raster is changed."""
+        key = os.fspath(raster_file)
+        version = file_version(key)
+        if key in self._handles:
+            pooled_version, dataset = self._handles[key]
+            if pooled_version == version and not dataset.closed:
+                self._handles.move_to_end(key)
+                return dataset
+
+            # raster is rewritten since it was opened
+            del self._handles[key]
+            dataset.close()
+            self._drop_blocks(key)
+
+        dataset = rasterio.open(key)
+        self.opens += 1
+        self._handles[key] = (version, dataset)
+        while len(self._handles) > self.max_handles:
+            old_key, (_, old_dataset) = self._handles.popitem(last=False)
+            old_dataset.close()
+            self._drop_blocks(old_key)
+
+        return dataset
+
+    def block_shape(self, dataset):
+        key = dataset.name
+        if key not in self._block_shapes:
+            native_h, native_w = dataset.block_shapes[0]
+            native_h = max(1, min(native_h, dataset.height))
+            native_w = max(1, min(native_w, dataset.width))
+            block_h = native_h * int(np.ceil(self.min_block_size / native_h))
+            block_w = native_w * int(np.ceil(self.min_block_size / native_w))
+            self._block_shapes[key] = (block_h, block_w)
+
+        return self._block_shapes[key]
+
+    def read(self, dataset, window):
+        """
+        Read window of all bands as masked array from cached blocks.
+
+        Args:
+            dataset: dataset opened by self.open
+            window (Window): window inside dataset bounds
+
+        Returns:
+            np.ma.MaskedArray: array of shape (count, height, width)
+
+        """
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+        block_h, block_w = self.block_shape(dataset)
+
+        data = np.empty((dataset.count, height, width), dtype=dataset.dtypes[0])
+        mask = np.empty((dataset.count, height, width), dtype=bool)
+        if height <= 0 or width <= 0:
+            return np.ma.masked_array(data, mask=mask)
+
+        for block_row in range(row_off // block_h, (row_off + height - 1) // block_h + 1):
+            for block_col in range(col_off // block_w, (col_off + width - 1) // block_w + 1):
+                block = self._get_block(dataset, block_row, block_col, block_h, block_w)
+
+                # overlap of window and block in dataset pixel coordinates
+                top = max(row_off, block_row * block_h)
+                bottom = min(row_off + height, (block_row + 1) * block_h)
+                left = max(col_off, block_col * block_w)
+                right = min(col_off + width, (block_col + 1) * block_w)
+
+                src = (
+                    slice(None),
+                    slice(top - block_row * block_h, bottom - block_row * block_h),
+                    slice(left - block_col * block_w, right - block_col * block_w),
+                )
+                dst = (
+                    slice(None),
+                    slice(top - row_off, bottom - row_off),
+                    slice(left - col_off, right - col_off),
+                )
+                data[dst] = block.data[src]
+                mask[dst] = np.ma.getmaskarray(block)[src]
+
+        return np.ma.masked_array(data, mask=mask)
+
+    def _get_block(self, dataset, block_row, block_col, block_h, block_w):
+        pooled = self._handles.get(dataset.name)
+        version = pooled[0] if pooled is not None and pooled[1] is dataset else file_version(dataset.name)
+        key = (dataset.name, version, block_row, block_col)
+        block = self._blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return block
+
+        self.misses += 1
+        block_window = Window(
+            block_col * block_w,
+            block_row * block_h,
+            min(block_w, dataset.width - block_col * block_w),
+            min(block_h, dataset.height - block_row * block_h),
+        )
+        block = dataset.read(window=block_window, masked=True)
+        block.mask = np.ma.getmaskarray(block)  # expand nomask for slicing
+
+        size = block.data.nbytes + block.mask.nbytes
+        if size > self.budget:
+            return block  # larger than budget, serve without caching
+
+        self._blocks[key] = block
+        self.nbytes += size
+        self._evict()
+
+        return block
+
+    def _evict(self):
+        while self.nbytes > self.budget and self._blocks:
+            _, block = self._blocks.popitem(last=False)
+            self.nbytes -= block.data.nbytes + block.mask.nbytes
+            self.evictions += 1
+
+    def _drop_blocks(self, raster_file):
+        for key in [key for key in self._blocks if key[0] == raster_file]:
+            block = self._blocks.pop(key)
+            self.nbytes -= block.data.nbytes + block.mask.nbytes
+        self._block_shapes.pop(raster_file, None)
+
+    def stats(self):
+        """Return cache counters, used to size the memory budget."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "blocks": len(self._blocks),
+            "cached_mb": self.nbytes / 1024 / 1024,
+            "budget_mb": self.budget / 1024 / 1024,
+            "opens": self.opens,
+        }
+
+    def clear(self):
+        """Close all handles and drop all cached blocks."""
+        for _, dataset in self._handles.values():
+            dataset.close()
+        self._handles.clear()
+        self._blocks.clear()
+        self._block_shapes.clear()
+        self.nbytes = 0
+
+
+def file_version(raster_file):
+    """Return (modification time in ns, size) of raster file, None when it is not a local file."""
+    try:
+        stat = os.stat(raster_file)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+# process-local cache, workers forked from parent get their own instance
+_raster_cache = None
+_raster_cache_pid = None
+
+
+def get_raster_cache():
+    """Return raster block cache of current process."""
+    global _raster_cache, _raster_cache_pid
+
+    if _raster_cache is None or _raster_cache_pid != os.getpid():
+        # handles inherited from parent process are not safe to use
+        _raster_cache = RasterBlockCache()
+        _raster_cache_pid = os.getpid()
+
+    return _raster_cache
+
+
+def set_raster_cache_budget(budget_mb):
+    """Change memory budget of current process cache, evict blocks when needed."""
+    cache = get_raster_cache()
+    cache.budget = int(budget_mb * 1024 * 1024)
+    cache._evict()
+
+
+def raster_cache_stats():
+    """Return hit/miss counters of current process cache."""
+    return get_raster_cache().stats()
+
+
+def clear_raster_cache():
+    """Close handles and drop cached blocks of current process."""
+    get_raster_cache().clear()
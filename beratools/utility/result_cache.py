@@ -0,0 +1,163 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the persistent result cache of execute_multiprocessing.
+    Result of each work item is saved to file named by hash of the item
+    (line coordinates), tool parameters and fingerprint of rasters.
+    Unchanged lines of later runs are served from cache, only new or edited
+    lines are processed. Least recently used results are evicted when cache
+    exceeds its size limit.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+import beratools
+import beratools.core.constants as bt_const
+
+
+def raster_fingerprint(in_raster):
+    """Return path, modification time, size and transform of raster, None when in_raster is None."""
+    if not in_raster:
+        return None
+
+    stat = os.stat(in_raster)
+    with rasterio.open(in_raster) as src:
+        transform = tuple(src.transform)[:6]
+
+    return [Path(in_raster).resolve().as_posix(), stat.st_mtime_ns, stat.st_size, transform]
+
+
+def item_content(item):
+    """
+    Return bytes of item content hashed into its key.
+
+    Line work items, such as SeedLine, are hashed by their coordinates. Their
+    index in LineTable is left out, so inserting or deleting lines doesn't
+    change keys of other lines. Raster and parameters are part of tool
+    parameters. Other items are pickled.
+    """
+    coords = getattr(item, "coords", None)
+    if isinstance(coords, np.ndarray):
+        coords = np.ascontiguousarray(coords)
+        return json.dumps([type(item).__name__, coords.dtype.str, coords.shape]).encode() + coords.tobytes()
+
+    return pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def open_result_cache(params):
+    """Return ResultCache of tool parameters, None when bt_const.RESULT_CACHE_DIR is not set."""
+    if not bt_const.RESULT_CACHE_DIR:
+        return None
+
+    return ResultCache(params)
+
+
+class ResultCache(object):
+    """
+    Content addressed on-disk cache of work item results.
+
+    Args:
+        params (dict): tool parameters and raster fingerprints, part of each key
+        cache_dir: cache directory shared by all tools
+        max_mb: cache size limit, least recently used results are evicted
+            when the cache is closed
+
+    """
+
+    name = "result cache"
+
+    def __init__(self, params, cache_dir=None, max_mb=None):
+        self.cache_dir = Path(cache_dir or bt_const.RESULT_CACHE_DIR).as_posix()
+        self.max_bytes = int((max_mb or bt_const.RESULT_CACHE_MB) * 1024 * 1024)
+        params = {**params, "beratools": beratools.__version__}
+        self.params = json.dumps(params, sort_keys=True, default=str)
+
+    def item_key(self, item):
+        """Return hash of tool parameters and item content, see item_content."""
+        digest = hashlib.sha256(self.params.encode())
+        digest.update(item_content(item))
+        return digest.hexdigest()
+
+    def item_keys(self, in_data):
+        return [self.item_key(item) for item in in_data]
+
+    def file(self, key):
+        return Path(self.cache_dir, key[:2], key + ".pkl")
+
+    def contains(self, keys):
+        """Return keys whose result files exist, results are not read until results() is called."""
+        return {key for key in keys if self.file(key).exists()}
+
+    def results(self, keys):
+        """
+        Yield cached result of each key, read one at a time, and mark it as recently used.
+
+        None is yielded for missing or unreadable file, such as evicted by
+        concurrent run, execute_multiprocessing processes its item again.
+        """
+        for key in keys:
+            path = self.file(key)
+            try:
+                with open(path, "rb") as f:
+                    result = pickle.load(f)
+                os.utime(path)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                print(f"ResultCache: {path} not read: {e}")
+                result = None
+
+            yield result
+
+    def writer(self):
+        """Return picklable writer appending results in worker processes."""
+        return self
+
+    def append(self, key, result):
+        """Save result of key, written to temporary file first so readers never see partial file."""
+        path = self.file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_file.replace(path)
+
+    def evict(self):
+        """Remove least recently used results until cache size is within limit."""
+        entries = []
+        for path in Path(self.cache_dir).glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(item[1] for item in entries)
+        removed = 0
+        for _, size, path in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        if removed:
+            print(f"ResultCache: evicted {removed} results, {total / 1024 / 1024:.1f} MB left")
+
+    def close(self):
+        self.evict()
@@ -0,0 +1,129 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the streaming result writer used by execute_multiprocessing.
+    Results are converted to GeoDataFrames as they arrive from workers, buffered
+    by output layer and appended to GeoPackage or GeoParquet in batches, so
+    results of all lines are never held in memory together.
+"""
+
+import json
+import os
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+import beratools.core.constants as bt_const
+
+
+class ResultWriter:
+    """
+    Buffer results by output layer and append them to files in batches.
+
+    to_layers converts one result to a dict of {(out_file, layer): GeoDataFrame}.
+    Files with .parquet suffix are written as GeoParquet, one file per layer
+    (layer is ignored), other files are written by GeoDataFrame.to_file.
+    Existing layers are replaced by the first batch written to them.
+    """
+
+    def __init__(self, to_layers, batch_size=bt_const.RESULT_BATCH_SIZE):
+        self.to_layers = to_layers
+        self.batch_size = max(1, int(batch_size))
+
+        self._buffers = defaultdict(list)  # (out_file, layer) -> list of GeoDataFrames
+        self._buffered_rows = defaultdict(int)
+        self._parquet_writers = {}  # (out_file, layer) -> pyarrow ParquetWriter
+        self._written = set()  # layers replaced by first batch
+
+        self.results = 0
+        self.rows = defaultdict(int)  # (out_file, layer) -> rows written
+        self.batches = 0
+
+    def add(self, result):
+        """Convert result to layers and buffer them, write full buffers."""
+        self.results += 1
+        for key, gdf in self.to_layers(result).items():
+            if gdf is None or gdf.empty:
+                continue
+
+            key = (os.fspath(key[0]), key[1])
+            self._buffers[key].append(gdf)
+            self._buffered_rows[key] += len(gdf)
+            if self._buffered_rows[key] >= self.batch_size:
+                self.flush(key)
+
+    def flush(self, key=None):
+        """Write buffered rows of one layer, or of all layers when key is None."""
+        keys = [key] if key else list(self._buffers.keys())
+        for item in keys:
+            frames = self._buffers.pop(item, [])
+            self._buffered_rows.pop(item, None)
+            if not frames:
+                continue
+
+            gdf = pd.concat(frames, ignore_index=True)
+            if Path(item[0]).suffix.lower() == ".parquet":
+                self._write_parquet(item, gdf)
+            else:
+                mode = "a" if item in self._written else "w"
+                gdf.to_file(item[0], layer=item[1], mode=mode)
+
+            self._written.add(item)
+            self.rows[item] += len(gdf)
+            self.batches += 1
+
+    def _write_parquet(self, key, gdf):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(f"ResultWriter: pyarrow is required to write {key[0]}") from e
+
+        table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+        writer = self._parquet_writers.get(key)
+        if writer is None:
+            # GeoParquet metadata is written once for all batches, so it has no bbox
+            geo = {
+                "version": "1.0.0",
+                "primary_column": gdf.geometry.name,
+                "columns": {
+                    gdf.geometry.name: {
+                        "encoding": "WKB",
+                        "geometry_types": [],
+                        "crs": gdf.crs.to_json_dict() if gdf.crs else None,
+                    }
+                },
+            }
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"geo"] = json.dumps(geo).encode("utf-8")
+
+            schema = table.schema.with_metadata(metadata)
+            writer = pq.ParquetWriter(key[0], schema)
+            self._parquet_writers[key] = writer
+
+        writer.write_table(table.cast(writer.schema))
+
+    def close(self):
+        """Write remaining buffers and close GeoParquet files."""
+        self.flush()
+        for writer in self._parquet_writers.values():
+            writer.close()
+        self._parquet_writers.clear()
+
+    def __enter__(self):
+        """Return writer, it is closed on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close writer, write remaining buffers."""
+        self.close()
@@ -0,0 +1,209 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the SLURM job array backend of execute_multiprocessing.
+    Work items are split into spatially coherent shards and saved to a work
+    directory with a job array script. Each array task processes one shard
+    with the local process pool and saves its results, which are merged
+    when all tasks are finished.
+
+    Array tasks run this file as module:
+        python -m beratools.utility.slurm_array <work_dir>
+"""
+
+import os
+import pickle
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import beratools.core.constants as bt_const
+from beratools.core.tool_base import execute_multiprocessing, item_location
+
+JOB_FILE = "job.pkl"
+SCRIPT_FILE = "job_array.sh"
+
+
+def _bisect(points, indices, count):
+    if count <= 1:
+        return [indices]
+    if len(indices) == 0:
+        return [indices] * count
+
+    # split along longer side at item count proportional to shard count
+    axis = np.argmax(np.ptp(points[indices], axis=0))
+    indices = indices[np.argsort(points[indices, axis], kind="stable")]
+    left_count = count // 2
+    split = len(indices) * left_count // count
+    return _bisect(points, indices[:split], left_count) + _bisect(points, indices[split:], count - left_count)
+
+
+def spatial_shards(in_data, shard_count):
+    """
+    Split work items into shards of nearby items by recursive bisection of item locations.
+
+    Items without location are distributed over shards in input order.
+
+    Returns:
+        list: shard_count lists of item indices
+
+    """
+    shard_count = max(1, min(int(shard_count), len(in_data)))
+    locations = [item_location(item) for item in in_data]
+    located = np.array([i for i, loc in enumerate(locations) if loc is not None], dtype=np.int64)
+    unlocated = np.array([i for i, loc in enumerate(locations) if loc is None], dtype=np.int64)
+
+    if len(located) > 0:
+        points = np.full((len(in_data), 2), np.nan)
+        points[located] = [locations[i] for i in located]
+        shards = _bisect(points, located, shard_count)
+    else:
+        shards = [np.array([], dtype=np.int64)] * shard_count
+
+    return [
+        np.concatenate([shard, extra]).tolist()
+        for shard, extra in zip(shards, np.array_split(unlocated, shard_count))
+    ]
+
+
+def job_script(work_dir, app_name, shard_count, processes):
+    """Return SLURM job array script running one shard per array task."""
+    work_dir = Path(work_dir).resolve()
+    package_root = Path(__file__).resolve().parents[2]
+    job_name = "bt_" + "".join(c if c.isalnum() else "_" for c in app_name)
+    lines = [
+        "#!/bin/bash",
+        f"#SBATCH --job-name={job_name}",
+        f"#SBATCH --array=0-{shard_count - 1}",
+        f"#SBATCH --cpus-per-task={processes}",
+        f"#SBATCH --output={work_dir.joinpath('shard_%a.log').as_posix()}",
+    ]
+    lines += [f"#SBATCH {option}" for option in shlex.split(bt_const.SLURM_SBATCH_OPTIONS)]
+    lines += [
+        "",
+        f"cd {shlex.quote(os.getcwd())}",
+        f"export PYTHONPATH={shlex.quote(package_root.as_posix())}${{PYTHONPATH:+:$PYTHONPATH}}",
+        f"{shlex.quote(sys.executable)} -m beratools.utility.slurm_array {shlex.quote(work_dir.as_posix())}",
+        "",
+    ]
+
+    return "\n".join(lines)
+
+
+def prepare_job(in_func, in_data, app_name, processes, work_dir, shared_args=None, task_timeout=None):
+    """
+    Save shards of in_data, in_func with shared arguments and job array script to work_dir.
+
+    Returns:
+        str: path of job array script
+
+    """
+    shard_count = int(np.ceil(len(in_data) / max(1, bt_const.SLURM_SHARD_SIZE)))
+    shards = spatial_shards(in_data, shard_count)
+    with open(Path(work_dir).joinpath(JOB_FILE), "wb") as f:
+        job = {
+            "in_func": in_func,
+            "shared_args": shared_args,
+            "app_name": app_name,
+            "processes": processes,
+            "task_timeout": task_timeout,
+        }
+        pickle.dump(job, f)
+
+    for shard_id, indices in enumerate(shards):
+        with open(Path(work_dir).joinpath(f"shard_{shard_id}.pkl"), "wb") as f:
+            pickle.dump([in_data[i] for i in indices], f)
+
+    script = Path(work_dir).joinpath(SCRIPT_FILE)
+    script.write_text(job_script(work_dir, app_name, len(shards), processes))
+    print(f"{len(in_data)} items split into {len(shards)} shards in {work_dir}", flush=True)
+
+    return script.as_posix()
+
+
+def run_shard(work_dir, shard_id):
+    """Process one shard by local process pool, save valid results and failed items, run by array task."""
+    work_dir = Path(work_dir)
+    with open(work_dir.joinpath(JOB_FILE), "rb") as f:
+        job = pickle.load(f)
+    with open(work_dir.joinpath(f"shard_{shard_id}.pkl"), "rb") as f:
+        shard = pickle.load(f)
+
+    processes = int(os.environ.get("SLURM_CPUS_PER_TASK", job["processes"]))
+    failures = []
+    result = execute_multiprocessing(
+        job["in_func"],
+        shard,
+        f"{job['app_name']} shard {shard_id}",
+        processes,
+        mode=bt_const.ParallelMode.MULTIPROCESSING,
+        verbose=True,
+        shared_args=job["shared_args"],
+        failures=failures,
+        task_timeout=job["task_timeout"],
+    )
+    if result is None:
+        return 1
+
+    # rename after writing, so incomplete results are never merged
+    out_file = work_dir.joinpath(f"shard_{shard_id}.out.pkl")
+    tmp_file = out_file.with_suffix(".tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump({"results": result, "failures": failures}, f)
+    tmp_file.replace(out_file)
+
+    return 0
+
+
+def slurm_results(in_func, in_data, app_name, processes, shared_args=None, task_timeout=None):
+    """
+    Run in_func on in_data as SLURM job array, yield results and TaskFailure of all shards.
+
+    Job is submitted by bt_const.SLURM_SBATCH with --wait, results are
+    merged when all array tasks are finished. Work directory is removed
+    when all shards succeed, it is kept with task logs otherwise.
+    """
+    work_root = bt_const.SLURM_WORK_DIR or os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="bt_slurm_", dir=work_root)
+    script = prepare_job(in_func, in_data, app_name, processes, work_dir, shared_args, task_timeout)
+
+    submit = shlex.split(bt_const.SLURM_SBATCH) + ["--wait", script]
+    completed = subprocess.run(submit)
+    if completed.returncode != 0:
+        print(f"slurm_results: job array returned {completed.returncode}, logs are in {work_dir}")
+
+    failed = []
+    for shard_file in sorted(Path(work_dir).glob("shard_*[0-9].pkl")):
+        out_file = shard_file.with_suffix(".out.pkl")
+        if not out_file.exists():
+            failed.append(shard_file.stem)
+            continue
+
+        with open(out_file, "rb") as f:
+            shard = pickle.load(f)
+
+        yield from shard["results"]
+        yield from shard["failures"]
+
+    if failed:
+        print(f"slurm_results: no results of {', '.join(failed)}, logs are in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(run_shard(sys.argv[1], int(os.environ["SLURM_ARRAY_TASK_ID"])))
@@ -21,11 +21,16 @@ import geopandas as gpd
 import numpy as np
 import pyproj
 import rasterio
+import rasterio.features
+import rasterio.windows
+import shapely
 from osgeo import gdal, osr, version_info
 from pyogrio import set_gdal_config_options
 from rasterio import mask
+from rasterio.enums import MergeAlg
 
 import beratools.core.constants as bt_const
+import beratools.utility.raster_cache as raster_cache
 
 # suppress pandas UserWarning: Geometry column contains no geometry when splitting lines
 warnings.simplefilter(action="ignore", category=UserWarning)
@@ -47,42 +52,66 @@ def clip_raster(
     buffer=0.0,
     out_raster_file=None,
     default_nodata=bt_const.BT_NODATA,
+    use_cache=bt_const.RASTER_CACHE_ENABLED,
 ):
+    """
+    Clip raster by buffered geometry.
+
+    Args:
+        in_raster_file: raster file path
+        clip_geom: shapely geometry used to clip
+        buffer (float): buffer distance of clip_geom
+        out_raster_file: save clipped raster when provided
+        default_nodata: nodata value of output raster
+        use_cache (bool): read through process-local dataset pool and block cache,
+            see beratools.utility.raster_cache
+
+    Returns:
+        tuple: (masked array of shape (count, height, width), raster meta)
+
+    """
     out_meta = None
-    with rasterio.open(in_raster_file) as raster_file:
-        out_meta = raster_file.meta
-        ras_nodata = out_meta["nodata"]
-        if ras_nodata is None:
-            ras_nodata = default_nodata
-
-        clip_geo_buffer = [clip_geom.buffer(buffer)]
-        out_image = None
-        out_image, out_transform = mask.mask(
-            raster_file, clip_geo_buffer, crop=True, nodata=ras_nodata, filled=True
-        )
-        if np.isnan(ras_nodata):
-            out_image[np.isnan(out_image)] = default_nodata
+    clip_geo_buffer = [clip_geom.buffer(buffer)]
+    if use_cache:
+        raster_file = raster_cache.get_raster_cache().open(in_raster_file)
+        out_meta, out_image, out_transform = _mask_cached(raster_file, clip_geo_buffer, default_nodata)
+    else:
+        with rasterio.open(in_raster_file) as raster_file:
+            out_meta = raster_file.meta
+            ras_nodata = out_meta["nodata"]
+            if ras_nodata is None:
+                ras_nodata = default_nodata
+
+            out_image, out_transform = mask.mask(
+                raster_file, clip_geo_buffer, crop=True, nodata=ras_nodata, filled=True
+            )
+
+    ras_nodata = out_meta["nodata"]
+    if ras_nodata is None:
+        ras_nodata = default_nodata
 
-        elif np.isinf(ras_nodata):
-            out_image[np.isinf(out_image)] = default_nodata
-        else:
-            out_image[out_image == ras_nodata] = default_nodata
+    if np.isnan(ras_nodata):
+        out_image[np.isnan(out_image)] = default_nodata
+    elif np.isinf(ras_nodata):
+        out_image[np.isinf(out_image)] = default_nodata
+    else:
+        out_image[out_image == ras_nodata] = default_nodata
 
-        out_image = np.ma.masked_where(out_image == default_nodata, out_image)
-        out_image.fill_value = default_nodata
-        ras_nodata = default_nodata
+    out_image = np.ma.masked_where(out_image == default_nodata, out_image)
+    out_image.fill_value = default_nodata
+    ras_nodata = default_nodata
 
-        height, width = out_image.shape[1:]
+    height, width = out_image.shape[1:]
 
-        out_meta.update(
-            {
-                "driver": "GTiff",
-                "height": height,
-                "width": width,
-                "transform": out_transform,
-                "nodata": ras_nodata,
-            }
-        )
+    out_meta.update(
+        {
+            "driver": "GTiff",
+            "height": height,
+            "width": width,
+            "transform": out_transform,
+            "nodata": ras_nodata,
+        }
+    )
 
     if out_raster_file:
         with rasterio.open(out_raster_file, "w", **out_meta) as dest:
@@ -92,6 +121,280 @@ def clip_raster(
     return out_image, out_meta
 
 
+def _mask_cached(raster_file, shapes, default_nodata):
+    """Mask raster same as rasterio.mask.mask(crop=True, filled=True), pixels read from block cache."""
+    out_meta = raster_file.meta
+    ras_nodata = out_meta["nodata"]
+    if ras_nodata is None:
+        ras_nodata = default_nodata
+
+    shape_mask, out_transform, window = mask.raster_geometry_mask(raster_file, shapes, crop=True)
+    out_image = raster_cache.get_raster_cache().read(raster_file, window)
+    out_image.mask = out_image.mask | shape_mask
+    out_image = out_image.filled(ras_nodata)
+
+    return out_meta, out_image, out_transform
+
+
+def zonal_percentiles(
+    in_raster_file,
+    zones,
+    q=50,
+    default_nodata=bt_const.BT_NODATA,
+    use_cache=bt_const.RASTER_CACHE_ENABLED,
+    index=None,
+):
+    """
+    Percentile of raster cells in each zone polygon, from one window read.
+
+    Cells of zone are the same as of clip_raster(in_raster_file, zone): cells
+    with center in zone, except nodata. Window covering all zones is read
+    once and zones are rasterized to label array, zones overlapping each
+    other are rasterized one by one. Zones are expected to be close together,
+    such as rings of one line or lines of one tile.
+
+    Args:
+        in_raster_file: raster file path, first band is used
+        zones: array of polygons
+        q (float): percentile in range of 0-100
+        default_nodata: nodata value of raster without nodata
+        use_cache (bool): read through process-local block cache, see clip_raster
+        index: PercentileIndex of raster for approximate percentiles, blocks
+            covered by one zone are taken from index and not read, see
+            beratools.utility.percentile_index
+
+    Returns:
+        tuple: (percentiles, inside) arrays, percentile is nan for zone without
+            valid cells, inside is False for empty zone or zone not overlapping raster
+
+    """
+    zones = shapely.buffer(shapely.force_2d(np.asarray(zones, dtype=object)), 0)
+    if use_cache:
+        cache = raster_cache.get_raster_cache()
+        return _zonal_percentiles(cache.open(in_raster_file), zones, q, default_nodata, cache.read, index)
+
+    with rasterio.open(in_raster_file) as raster_file:
+        return _zonal_percentiles(
+            raster_file,
+            zones,
+            q,
+            default_nodata,
+            lambda dataset, window: dataset.read(window=window, masked=True),
+            index,
+        )
+
+
+def _zone_windows(raster_file, zones):
+    """
+    Window of each zone within raster, same as rasterio.features.geometry_window for all zones at once.
+
+    Returns:
+        tuple: (row_off, col_off, height, width) arrays, height and width
+            are 0 for empty zone or zone outside raster
+
+    """
+    pixels = shapely.transform(zones, lambda coords: np.column_stack(~raster_file.transform * coords.T))
+    col_min, row_min, col_max, row_max = shapely.bounds(pixels).T
+
+    with np.errstate(invalid="ignore"):
+        row_start, col_start = np.floor(row_min), np.floor(col_min)
+        row_end = row_start + np.maximum(np.ceil(row_max) - row_start, 0)
+        col_end = col_start + np.maximum(np.ceil(col_max) - col_start, 0)
+
+        # intersection with raster, nan bounds of empty zones give empty window
+        row_off, col_off = np.maximum(row_start, 0), np.maximum(col_start, 0)
+        height = np.nan_to_num(np.minimum(row_end, raster_file.height) - row_off).clip(0)
+        width = np.nan_to_num(np.minimum(col_end, raster_file.width) - col_off).clip(0)
+        empty = (height == 0) | (width == 0)
+
+    row_off, col_off = np.where(empty, 0, row_off), np.where(empty, 0, col_off)
+    height, width = np.where(empty, 0, height), np.where(empty, 0, width)
+    return row_off.astype(int), col_off.astype(int), height.astype(int), width.astype(int)
+
+
+def invalid_cells(image, ras_nodata, default_nodata=bt_const.BT_NODATA):
+    """Boolean array of masked and nodata cells of masked image, same as cells masked by clip_raster."""
+    values = np.ma.getdata(image)
+    if ras_nodata is None:
+        ras_nodata = default_nodata
+
+    invalid = np.ma.getmaskarray(image) | (values == default_nodata) | np.isnan(values)
+    if np.isinf(ras_nodata):
+        invalid |= np.isinf(values)
+    elif not np.isnan(ras_nodata):
+        invalid |= values == ras_nodata
+
+    return invalid
+
+
+def _read_blocks(raster_file, window, read, needed, block_size):
+    """
+    Read blocks of window with needed cells, cells of other blocks are masked.
+
+    Blocks are aligned to raster, whole window is read when blocks to read
+    cover more than half of it.
+    """
+    height, width = needed.shape
+    row_start, col_start = int(window.row_off), int(window.col_off)
+    row_edges = np.unique(np.r_[0, np.arange(-row_start % block_size, height, block_size), height])
+    col_edges = np.unique(np.r_[0, np.arange(-col_start % block_size, width, block_size), width])
+    block_needed = np.add.reduceat(np.add.reduceat(needed, row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    block_rows, block_cols = np.nonzero(block_needed)
+    if len(block_rows) * block_size * block_size * 2 > height * width:
+        return read(raster_file, window)[0]
+
+    image = np.ma.masked_all(needed.shape, dtype=raster_file.dtypes[0])
+    for i, j in zip(block_rows, block_cols):
+        row_0, row_1 = row_edges[i], row_edges[i + 1]
+        col_0, col_1 = col_edges[j], col_edges[j + 1]
+        block_window = rasterio.windows.Window(
+            col_start + col_0, row_start + row_0, col_1 - col_0, row_1 - row_0
+        )
+        image[row_0:row_1, col_0:col_1] = read(raster_file, block_window)[0]
+
+    return image
+
+
+def _zonal_percentiles(raster_file, zones, q, default_nodata, read, index=None):
+    row_off, col_off, height, width = _zone_windows(raster_file, zones)
+    inside = height > 0
+    if not inside.any():
+        return np.full(len(zones), np.nan), inside
+
+    zone_ids = np.flatnonzero(inside)
+    row_start, col_start = row_off[zone_ids].min(), col_off[zone_ids].min()
+    window = rasterio.windows.Window(
+        col_start,
+        row_start,
+        (col_off + width)[zone_ids].max() - col_start,
+        (row_off + height)[zone_ids].max() - row_start,
+    )
+
+    out_shape = (int(window.height), int(window.width))
+    transform = raster_file.window_transform(window)
+    labels = rasterio.features.rasterize(
+        zip(zones[zone_ids], zone_ids + 1), out_shape, fill=0, transform=transform, dtype="int32"
+    )
+    coverage = rasterio.features.rasterize(
+        ((zone, 1) for zone in zones[zone_ids]),
+        out_shape,
+        fill=0,
+        transform=transform,
+        merge_alg=MergeAlg.add,
+        dtype="int32",
+    )
+
+    # zones with cells covered by other zones are rasterized one by one
+    shared_rows, shared_cols = np.nonzero(coverage > 1)
+    shared_zones = []
+    for zone_id in zone_ids:
+        rows = shared_rows - (row_off[zone_id] - row_start)
+        cols = shared_cols - (col_off[zone_id] - col_start)
+        in_window = (rows >= 0) & (rows < height[zone_id]) & (cols >= 0) & (cols < width[zone_id])
+        if in_window.any():
+            shared_zones.append(zone_id)
+
+    labels[np.isin(labels, np.add(shared_zones, 1))] = 0
+    zone_masks = [
+        rasterio.features.geometry_mask([zones[zone_id]], out_shape, transform, invert=True)
+        for zone_id in shared_zones
+    ]
+
+    # blocks covered by one zone are summarized by index, only other cells are read
+    covered = np.zeros(out_shape, dtype=bool)
+    summary = None
+    if index is not None:
+        covered, *summary = index.summarize(labels, row_start, col_start)
+
+    if covered.any():
+        needed = np.logical_or.reduce([(labels > 0) & ~covered] + zone_masks)
+        image = _read_blocks(raster_file, window, read, needed, index.block_size)
+    else:
+        image = read(raster_file, window)[0]
+
+    values = np.ma.getdata(image)
+    invalid = invalid_cells(image, raster_file.nodata, default_nodata)
+
+    cells = [np.flatnonzero((labels > 0) & ~covered & ~invalid)]
+    cell_labels = [labels.ravel()[cells[0]] - 1]
+    for zone_id, zone_mask in zip(shared_zones, zone_masks):
+        cells.append(np.flatnonzero(zone_mask & ~invalid))
+        cell_labels.append(np.full(len(cells[-1]), zone_id))
+
+    cells = np.concatenate(cells)
+    cell_labels = np.concatenate(cell_labels)
+    cell_values = values.ravel()[cells]
+    weights = None
+    if summary is not None:
+        hist_labels, hist_values, hist_counts = summary
+        cell_labels = np.concatenate([cell_labels, hist_labels - 1])
+        cell_values = np.concatenate([cell_values, hist_values.astype(values.dtype)])
+        weights = np.concatenate([np.ones(len(cells), dtype=np.int64), hist_counts])
+
+    return label_percentiles(cell_labels, cell_values, len(zones), q, weights), inside
+
+
+def label_percentiles(labels, values, label_count, q=50, weights=None):
+    """
+    Percentile of values of each label, same as numpy.percentile of values of label.
+
+    Values are sorted by label and value in one pass, then percentile of
+    each label is interpolated between its neighbouring sorted values.
+
+    Args:
+        labels: label in range of 0 to label_count - 1 of each value
+        values: values without nan
+        label_count: number of labels
+        q (float): percentile in range of 0-100
+        weights: integer count of each value, percentile is the same as of
+            values repeated by their counts, such as bins of histograms
+
+    Returns:
+        np.ndarray: percentile of each label, nan for label without values
+
+    """
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+
+    order = np.lexsort((values, labels))
+    labels = np.asarray(labels)[order]
+    values = values[order]
+    starts = np.searchsorted(labels, np.arange(label_count))
+    ends = np.searchsorted(labels, np.arange(label_count), side="right")
+    if weights is not None:
+        # positions in values repeated by weights, found by cumulative weights
+        cum_weights = np.cumsum(np.asarray(weights, dtype=np.int64)[order])
+        repeated_ends = np.r_[0, cum_weights]
+        starts, ends = repeated_ends[starts], repeated_ends[ends]
+
+    counts = ends - starts
+
+    # virtual index and weight in float64, interpolation in dtype of values as numpy.percentile does
+    has_values = counts > 0
+    starts = starts[has_values]
+    counts = counts[has_values]
+    virtual = (counts - 1) * (q / 100)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = np.minimum(previous.astype(np.intp), counts - 1)
+    below = starts + previous
+    above = starts + np.minimum(previous + 1, counts - 1)
+    if weights is not None:
+        below = np.searchsorted(cum_weights, below, side="right")
+        above = np.searchsorted(cum_weights, above, side="right")
+
+    below, above = values[below], values[above]
+    diff = above - below
+    result = below + diff * gamma.astype(values.dtype)
+    upper = gamma >= 0.5
+    result[upper] = (above - diff * (1 - gamma).astype(values.dtype))[upper]
+
+    percentiles = np.full(label_count, np.nan, dtype=values.dtype)
+    percentiles[has_values] = result
+    return percentiles
+
+
 def check_arguments():
     # Get tool arguments
     parser = argparse.ArgumentParser()
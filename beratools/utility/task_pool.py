@@ -0,0 +1,150 @@
+"""
+Copyright (C) 2025 Applied Geospatial Research Group.
+
+This script is licensed under the GNU General Public License v3.0.
+See <https://gnu.org/licenses/gpl-3.0> for full license details.
+
+Author: Richard Zeng
+
+Description:
+    This script is part of the BERA Tools.
+    Webpage: https://github.com/appliedgrg/beratools
+
+    This file hosts the supervised process pool of execute_multiprocessing,
+    used when task timeout is set. Each worker has its own pipe, so a worker
+    running one item longer than timeout can be killed and replaced without
+    losing results of other workers. Remaining items of its chunk are sent
+    to the next free worker.
+"""
+
+import collections
+import multiprocessing as mp
+import time
+from multiprocessing.connection import wait
+
+import beratools.core.constants as bt_const
+import beratools.utility.raster_cache as raster_cache
+from beratools.core.tool_base import TaskFailure, call_task, init_worker
+
+
+def worker_loop(in_func, shared_args, conn):
+    """Receive chunks from conn, send back result and raster cache stats of each item as it finishes."""
+    init_worker(in_func, shared_args)
+    while True:
+        items = conn.recv()
+        if items is None:
+            break
+
+        for item in items:
+            result = call_task(item)
+            try:
+                conn.send((result, time.time(), raster_cache.raster_cache_stats()))
+            except Exception as e:  # result can't be pickled
+                failure = TaskFailure(item, "error", f"result not sent: {e}", 0.0)
+                conn.send((failure, time.time(), raster_cache.raster_cache_stats()))
+
+    conn.close()
+
+
+class Worker(object):
+    """Worker process, its pipe and the chunk it is processing."""
+
+    def __init__(self, ctx, in_func, shared_args):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_loop, args=(in_func, shared_args, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.items = []
+        self.pos = 0
+        self.started = 0.0
+
+    def send(self, items):
+        self.items = items
+        self.pos = 0
+        self.started = time.time()
+        self.conn.send(items)
+
+    @property
+    def busy(self):
+        return self.pos < len(self.items)
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+        self.conn.close()
+
+
+def supervised_results(in_func, chunk_items, processes, shared_args, task_timeout):
+    """
+    Run in_func on chunks by supervised workers, yield (pid, end time, cache stats, result) of each item.
+
+    Item running longer than task_timeout seconds yields TaskFailure with reason
+    "timeout", its worker is killed and replaced. Item whose worker exits
+    unexpectedly, such as by crash in native code, yields reason "crash".
+    Remaining items of the killed worker's chunk are processed by other workers.
+    """
+    ctx = mp.get_context()
+    pending = collections.deque(chunk_items)
+    workers = [Worker(ctx, in_func, shared_args) for _ in range(max(1, min(processes, len(pending))))]
+    poll = min(bt_const.TASK_POLL_INTERVAL, task_timeout) if task_timeout else bt_const.TASK_POLL_INTERVAL
+
+    def replace(worker, reason, message):
+        item = worker.items[worker.pos]
+        failure = TaskFailure(item, reason, message, time.time() - worker.started)
+        remaining = worker.items[worker.pos + 1 :]
+        if remaining:
+            pending.appendleft(remaining)
+
+        pid = worker.process.pid
+        worker.kill()
+        workers[workers.index(worker)] = Worker(ctx, in_func, shared_args)
+        return pid, time.time(), None, failure
+
+    try:
+        while True:
+            for worker in workers:
+                if not worker.busy and pending:
+                    worker.send(pending.popleft())
+
+            busy = [worker for worker in workers if worker.busy]
+            if not busy:
+                break
+
+            for conn in wait([worker.conn for worker in busy], timeout=poll):
+                worker = next(item for item in busy if item.conn is conn)
+                try:
+                    result, end, stats = conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(timeout=1)
+                    yield replace(worker, "crash", f"worker exited with code {worker.process.exitcode}")
+                    continue
+
+                worker.pos += 1
+                worker.started = end
+                yield worker.process.pid, end, stats, result
+
+            if not task_timeout:
+                continue
+
+            now = time.time()
+            for worker in [item for item in workers if item.busy and now - item.started > task_timeout]:
+                yield replace(worker, "timeout", f"exceeded task timeout of {task_timeout} s")
+    finally:
+        for worker in workers:
+            if worker.busy:
+                worker.kill()
+            else:
+                worker.stop()
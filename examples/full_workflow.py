@@ -6,6 +6,9 @@ usage:n
 
     PARALLEL_MODE: MULTIPROCESSING = 2
                    SLURM = 5
+
+    SLURM mode submits one job array per tool from the login node, each array task
+    runs processes cores. Set BT_SBATCH_OPTIONS for account, partition, time etc.
 """
 
 import os
@@ -0,0 +1,39 @@
+"""
+Fake sbatch running job array tasks as local subprocesses, for testing SLURM mode.
+
+usage:
+    python fake_sbatch.py --wait job_array.sh
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+
+def main(argv):
+    script = argv[-1]
+    with open(script) as f:
+        text = f.read()
+
+    first, last = map(int, re.search(r"^#SBATCH --array=(\d+)-(\d+)", text, re.M).groups())
+    cpus = re.search(r"^#SBATCH --cpus-per-task=(\d+)", text, re.M).group(1)
+    output = re.search(r"^#SBATCH --output=(.+)$", text, re.M).group(1)
+
+    tasks = []
+    for task_id in range(first, last + 1):
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(task_id), SLURM_CPUS_PER_TASK=cpus)
+        log = open(output.replace("%a", str(task_id)), "w")
+        tasks.append((subprocess.Popen(["bash", script], env=env, stdout=log, stderr=subprocess.STDOUT), log))
+
+    print("Submitted batch job 1", flush=True)
+    return_code = 0
+    for process, log in tasks:
+        return_code = max(return_code, process.wait())
+        log.close()
+
+    return return_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,51 @@
 """Test functions and command lines."""
 
+import functools
+import math
+import os
+import pickle
+import re
+import sys
+import time
+import warnings
+from pathlib import Path
+
 import geopandas as gpd
+import numpy as np
+import pandas as pd
 import pytest
+import rasterio
+import shapely.affinity
+import shapely.geometry as sh_geom
+import skimage.graph as sk_graph
 from label_centerlines import get_centerline
+from rasterio import mask
+from rasterio.windows import Window
+
+import beratools.core.algo_centerline as algo_centerline
+import beratools.core.algo_common as algo_common
+import beratools.core.algo_cost as algo_cost
+import beratools.core.algo_dijkstra as algo_dijkstra
+import beratools.core.canopy_threshold_relative as canopy_threshold_relative
+import beratools.core.constants as bt_const
+import beratools.tools.centerline as centerline
+import beratools.utility.percentile_index as pct_index
+import beratools.utility.raster_cache as raster_cache
+import beratools.utility.slurm_array as slurm_array
+import beratools.utility.spatial_common as sp_common
+from beratools.core.algo_dijkstra import MinCostPathHelper
+from beratools.core.tool_base import (
+    ResultRecord,
+    estimate_line_cost,
+    execute_multiprocessing,
+    records_to_gdf,
+    spatial_order,
+    task_chunks,
+)
+from beratools.tools.common import remove_nan_from_array
+from beratools.utility.checkpoint import CheckpointStore, file_fingerprint, item_keys
+from beratools.utility.result_cache import ResultCache
+from beratools.utility.result_writer import ResultWriter
 
 
 # Fixture to load the 'alps.geojson' shape using geopandas
@@ -18,4 +61,795 @@ def footprint_shape(testdata_dir):
 def test_centerline(footprint_shape):
     cl = get_centerline(footprint_shape)
     assert cl.is_valid
-    assert cl.geom_type == "MultiLineString"
\ No newline at end of file
+    assert cl.geom_type == "MultiLineString"
+
+def test_cost_focal_stats_matches_generic_filter():
+    """Vectorized focal statistics give the same result as generic_filter."""
+    rng = np.random.default_rng(0)
+    chm = rng.uniform(0, 6, (60, 45))
+    chm[5:20, 3:25] = bt_const.BT_NODATA
+    chm = np.ma.masked_where(chm == bt_const.BT_NODATA, chm)
+    canopy = algo_cost.dyn_np_cc_map(chm, 2.5)
+    kernel = algo_cost.circle_kernel_refactor(17, 8)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        std_ref, mean_ref = algo_cost.cost_focal_stats_generic(canopy, kernel)
+
+    std, mean = algo_cost.cost_focal_stats(canopy, kernel)
+    assert np.allclose(std, std_ref, equal_nan=True)
+    assert np.allclose(mean, mean_ref, equal_nan=True)
+
+
+def test_raster_block_cache_matches_direct_read(testdata_dir):
+    """Windows served from block cache equal direct reads, also under eviction."""
+    chm_file = testdata_dir.joinpath("chm.tif").as_posix()
+    cache = raster_cache.RasterBlockCache(budget_mb=1, min_block_size=64)
+    dataset = cache.open(chm_file)
+
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        row_off = int(rng.integers(0, dataset.height - 50))
+        col_off = int(rng.integers(0, dataset.width - 50))
+        window = Window(col_off, row_off, int(rng.integers(1, 300)), int(rng.integers(1, 300)))
+        window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+
+        expected = dataset.read(window=window, masked=True)
+        result = cache.read(dataset, window)
+        assert np.array_equal(result.filled(0), expected.filled(0))
+        assert np.array_equal(np.ma.getmaskarray(result), np.ma.getmaskarray(expected))
+
+    stats = cache.stats()
+    assert stats["hits"] > 0 and stats["evictions"] > 0
+    assert stats["cached_mb"] <= stats["budget_mb"]
+    cache.clear()
+
+
+def test_raster_block_cache_reopens_rewritten_raster(tmp_path):
+    """Raster rewritten after it is cached is opened and read again."""
+    raster_file = tmp_path.joinpath("values.tif").as_posix()
+    meta = {
+        "driver": "GTiff",
+        "height": 100,
+        "width": 100,
+        "count": 1,
+        "dtype": "float32",
+        "transform": rasterio.transform.from_origin(0, 100, 1, 1),
+    }
+    cache = raster_cache.RasterBlockCache(min_block_size=64)
+    window = Window(10, 10, 20, 20)
+    for value, mtime in ((1.0, 1_000_000_000), (2.0, 2_000_000_000)):
+        with rasterio.open(raster_file, "w", **meta) as dst:
+            dst.write(np.full((1, 100, 100), value, dtype=np.float32))
+        os.utime(raster_file, ns=(mtime, mtime))  # same size, modification time tells rewrite
+
+        result = cache.read(cache.open(raster_file), window)
+        assert np.all(result == value)
+
+    assert cache.stats()["opens"] == 2
+    cache.clear()
+
+
+def test_cost_raster_tiled_matches_whole_raster(testdata_dir, tmp_path):
+    """Cost surface computed by tiles with halo equals whole raster computation."""
+    chm_file = testdata_dir.joinpath("chm.tif").as_posix()
+    cost_file = tmp_path.joinpath("cost.tif").as_posix()
+    algo_cost.cost_raster_tiled(chm_file, cost_file, tile_size=256)
+
+    with rasterio.open(chm_file) as dataset:
+        chm = algo_cost._read_chm_tile(dataset, Window(0, 0, dataset.width, dataset.height))
+        meta = dataset.meta.copy()
+
+    expected, _ = algo_cost.cost_raster(chm, meta)
+    with rasterio.open(cost_file) as dataset:
+        assert dataset.profile["tiled"]
+        result = dataset.read(1)
+
+    assert np.allclose(result, expected, equal_nan=True, atol=1e-5)
+
+def test_corridor_raster_bounded_matches_full():
+    """Bounded corridor search gives the same corridor as the full search."""
+    rng = np.random.default_rng(1)
+    cost = rng.uniform(0.2, 5.0, (120, 150))
+    cost[30:90, 70] = np.nan  # barrier with a gap
+    cost[:, 140:] = np.nan
+    source = [(60, 10)]
+    destination = [(55, 120), (65, 121)]
+
+    args = (source, destination, (0.3, 0.3), 2.5)
+    full = algo_common.corridor_raster(cost.copy(), None, *args, bounded=False)
+    bounded = algo_common.corridor_raster(cost.copy(), None, *args, bounded=True)
+
+    assert np.array_equal(np.ma.getmaskarray(full), np.ma.getmaskarray(bounded))
+    assert np.array_equal(full.filled(-1), bounded.filled(-1))
+
+def test_clip_cost_window_matches_clip(testdata_dir):
+    """Sub-window of a clip holds the same cells as clipping raster again."""
+    line = sh_geom.LineString([(-30, 20), (15, -10)])
+    with rasterio.open(testdata_dir.joinpath("chm.tif")) as dataset:
+        center = sh_geom.box(*dataset.bounds).centroid
+        line = shapely.affinity.translate(line, center.x, center.y)
+        clip, transform = mask.mask(dataset, [line.buffer(15)], crop=True, nodata=np.nan)
+        meta = dict(dataset.meta, transform=transform)
+        expected, expected_transform = mask.mask(dataset, [line.buffer(13.5)], crop=True, nodata=np.nan)
+
+    result, result_meta = algo_common.clip_cost_window(clip, meta, line, 13.5)
+
+    # clip by mask.mask may keep extra nodata border rows and columns
+    col_off, row_off = ~expected_transform * (result_meta["transform"].c, result_meta["transform"].f)
+    row_off, col_off = round(row_off), round(col_off)
+    expected = expected[0, row_off : row_off + result.shape[0], col_off : col_off + result.shape[1]]
+    assert np.array_equal(result, expected, equal_nan=True)
+
+def test_normalize_nodata():
+    """NaN and nodata cells are replaced in place and negative cells reported."""
+    matrix = np.array([[1.0, np.nan, -9999.0], [2.0, -10000.0, 3.0]])
+    assert algo_cost.normalize_nodata(matrix, -9999.0)
+    assert np.array_equal(matrix, [[1.0, np.inf, np.inf], [2.0, -10000.0, 3.0]])
+
+    matrix = np.array([[1.0, np.nan], [-10000.0, 3.0]])
+    assert not algo_cost.normalize_nodata(matrix, -9999.0, below_nodata=True)
+    assert np.array_equal(matrix, [[1.0, np.inf], [np.inf, 3.0]])
+
+    block, contains_negative = MinCostPathHelper.block2matrix_numpy(
+        np.array([[1.0, np.nan, -9999.0], [-2.0, -10000.0, 3.0]]), -9999.0
+    )
+    assert contains_negative
+    assert np.array_equal(block, [[1.0, 9999.0, 9999.0], [-2.0, 9999.0, 3.0]])
+
+    matrix, contains_negative = MinCostPathHelper.block2matrix(
+        np.array([[1.0, -9999.0], [2.0, 3.0]]), -9999.0
+    )
+    assert not contains_negative
+    assert matrix == [[1.0, None], [2.0, 3.0]]
+
+
+@pytest.mark.parametrize(
+    "normalize",
+    [
+        lambda matrix: remove_nan_from_array(matrix, bt_const.BT_NODATA),
+        lambda matrix: MinCostPathHelper.block2matrix_numpy(matrix, bt_const.BT_NODATA),
+        lambda matrix: MinCostPathHelper.block2matrix(matrix, bt_const.BT_NODATA),
+    ],
+)
+def test_normalize_nodata_is_vectorized(normalize):
+    """Nodata normalization runs at numpy speed, per-pixel Python loops are far slower."""
+    rng = np.random.default_rng(0)
+    matrix = rng.uniform(0, 10, (1000, 1000))
+    matrix[::7] = np.nan
+    matrix[::11] = bt_const.BT_NODATA
+
+    def best_time(func):
+        elapsed = []
+        for _ in range(3):
+            in_matrix = matrix.copy()
+            start = time.perf_counter()
+            func(in_matrix)
+            elapsed.append(time.perf_counter() - start)
+        return min(elapsed)
+
+    # single numpy pass over the array, per-pixel iteration is hundreds of times slower
+    baseline = best_time(lambda in_matrix: np.where(np.isnan(in_matrix), 0.0, in_matrix))
+    assert best_time(normalize) < 100 * baseline
+
+def test_astar_matches_route_through_array():
+    """A* finds the same path and cost as skimage route_through_array."""
+    rng = np.random.default_rng(2)
+    cost = rng.uniform(0.1, 5.0, (80, 120))
+    cost[rng.random(cost.shape) < 0.2] = np.inf
+    start, end, far_end = (5, 5), (70, 110), (79, 0)
+    cost[start] = cost[end] = cost[far_end] = 1.0
+
+    expected_path, expected_cost = sk_graph.route_through_array(cost, start, end)
+    [(path, costs, target)] = algo_dijkstra.astar(cost, start, [end])
+    assert target == end
+    assert path == [tuple(int(i) for i in cell) for cell in expected_path]
+    assert costs[-1] == expected_cost
+
+    # nearest target only, or all targets in order of cost
+    far_cost = sk_graph.route_through_array(cost, start, far_end)[1]
+    nearest = end if expected_cost < far_cost else far_end
+    assert [item[2] for item in algo_dijkstra.astar(cost, start, [end, far_end])] == [nearest]
+    result = algo_dijkstra.astar(cost, start, [end, far_end], find_nearest=False)
+    assert sorted(item[1][-1] for item in result) == sorted([expected_cost, far_cost])
+
+def test_route_through_pyramid():
+    """Coarse to fine path follows a clear low cost channel and reports deviation."""
+    rng = np.random.default_rng(3)
+    cost = rng.uniform(5.0, 10.0, (120, 160))
+    rows = (40 + 30 * np.sin(np.arange(160) / 25)).astype(int)
+    for offset in range(-4, 5):
+        cost[rows + offset, np.arange(160)] = 0.1  # channel of 9 cells wide
+    start, end = (int(rows[0]), 0), (int(rows[-1]), 159)
+
+    exact_path, exact_cost = sk_graph.route_through_array(cost, start, end)
+    assert algo_dijkstra.route_through_pyramid(cost, start, end, ()) == (exact_path, exact_cost)
+
+    path, path_cost = algo_dijkstra.route_through_pyramid(cost, start, end, (8, 4, 2), 1)
+    assert (path[0], path[-1]) == (start, end)
+    assert path_cost == pytest.approx(exact_cost)
+
+    report = algo_dijkstra.pyramid_path_deviation(cost, start, end, (4,), 1, cell_size=0.3)
+    assert report["cost_increase"] == pytest.approx(0.0, abs=1e-9)
+    assert report["hausdorff"] < 1.0
+
+def test_find_centerline_skeleton():
+    """Skeleton centerline follows the middle of a corridor raster."""
+    corridor = np.ones((60, 200))
+    corridor[20:41, :] = 0.0  # corridor along row 30
+    corridor = np.ma.masked_array(corridor, mask=np.zeros(corridor.shape, dtype=bool))
+    transform = rasterio.transform.from_origin(0, 60, 1, 1)
+    lc_path = sh_geom.LineString([(2.5, 35.5), (100.5, 25.5), (197.5, 33.5)])
+
+    centerline, status = algo_centerline.find_centerline_skeleton(corridor, transform, lc_path)
+    assert status == algo_centerline.CenterlineStatus.SUCCESS
+    assert centerline.coords[0] == lc_path.coords[0] and centerline.coords[-1] == lc_path.coords[-1]
+
+    # away from snapped ends, centerline is on the middle row
+    middle = sh_geom.LineString([(0, 29.5), (200, 29.5)])
+    inner = centerline.intersection(sh_geom.box(20, 0, 180, 60))
+    assert middle.hausdorff_distance(inner) < 21
+    assert max(abs(y - 29.5) for _, y in inner.coords) <= 1.0
+
+
+def point_result(i):
+    return gpd.GeoDataFrame({"value": [i, i]}, geometry=[sh_geom.Point(i, 0), sh_geom.Point(i, 1)], crs=2956)
+
+
+def test_result_writer_appends_batches(tmp_path):
+    """Streamed results are written in batches and match the in-memory results."""
+    out_file = tmp_path.joinpath("out.gpkg").as_posix()
+    writer = ResultWriter(
+        lambda gdf: {(out_file, "points"): gdf, (out_file, "first"): gdf.iloc[:1]}, batch_size=5
+    )
+    result = execute_multiprocessing(
+        point_result, list(range(10)), "Test", 1, mode=bt_const.ParallelMode.SEQUENTIAL, sink=writer
+    )
+
+    assert result == []
+    assert writer.results == 10
+    assert writer.rows[(out_file, "points")] == 20
+    assert writer.batches == 6  # 4 batches of 6/6/6/2 points and 2 batches of 5 first points
+
+    points = gpd.read_file(out_file, layer="points")
+    assert sorted(points["value"]) == sorted(list(range(10)) * 2)
+    assert gpd.read_file(out_file, layer="first")["value"].tolist() == list(range(10))
+
+    # writer is closed when processing fails, buffered results are written
+    def failing_layers(gdf):
+        if gdf["value"].iloc[0] == 7:
+            raise ValueError("layer conversion failed")
+        return {(out_file, "partial"): gdf}
+
+    writer = ResultWriter(failing_layers, batch_size=100)
+    result = execute_multiprocessing(
+        point_result, list(range(10)), "Test", 1, mode=bt_const.ParallelMode.SEQUENTIAL, sink=writer
+    )
+
+    assert result is None
+    assert sorted(gpd.read_file(out_file, layer="partial")["value"]) == sorted(list(range(7)) * 2)
+
+
+def test_execute_dask_matches_sequential():
+    """Dask mode returns the same results as sequential mode, with shared arguments."""
+    pytest.importorskip("dask.distributed")
+
+    in_data = [i + 0.123456 for i in range(20)]
+    results = {}
+    for mode in (bt_const.ParallelMode.SEQUENTIAL, bt_const.ParallelMode.DASK):
+        results[mode] = execute_multiprocessing(
+            round, in_data, "Test", 2, mode=mode, verbose=True, shared_args={"ndigits": 2}
+        )
+
+    assert results[bt_const.ParallelMode.SEQUENTIAL] == [round(i, 2) for i in in_data]
+    assert sorted(results[bt_const.ParallelMode.DASK]) == results[bt_const.ParallelMode.SEQUENTIAL]
+
+
+def test_spatial_shards():
+    """Shards have about equal size and group nearby items."""
+    points = [sh_geom.Point(x, y) for x in range(8) for y in range(4)]
+    items = [(None, point) for point in points] + [None, None]
+    shards = slurm_array.spatial_shards(items, 4)
+
+    assert sorted(i for shard in shards for i in shard) == list(range(len(items)))
+    assert [len(shard) for shard in shards] == [9, 9, 8, 8]
+    for shard in shards:
+        bounds = sh_geom.MultiPoint([points[i] for i in shard if i < len(points)]).bounds
+        assert bounds[2] - bounds[0] <= 1 and bounds[3] - bounds[1] <= 3
+
+
+def test_execute_slurm_with_fake_sbatch(monkeypatch, tmp_path):
+    """SLURM mode runs shards as job array tasks and merges their results."""
+    fake_sbatch = Path(__file__).parent.joinpath("fake_sbatch.py").as_posix()
+    monkeypatch.setattr(bt_const, "SLURM_SBATCH", f"{sys.executable} {fake_sbatch}")
+    monkeypatch.setattr(bt_const, "SLURM_WORK_DIR", tmp_path.as_posix())
+    monkeypatch.setattr(bt_const, "SLURM_SHARD_SIZE", 7)
+
+    in_data = [i + 0.123456 for i in range(20)]
+    result = execute_multiprocessing(
+        round, in_data, "Test", 2, mode=bt_const.ParallelMode.SLURM, verbose=True, shared_args={"ndigits": 2}
+    )
+
+    assert sorted(result) == [round(i, 2) for i in in_data]
+    assert list(tmp_path.iterdir()) == []  # work directory is removed when all shards succeed
+
+
+@pytest.mark.parametrize(
+    "mode",
+    [
+        bt_const.ParallelMode.SEQUENTIAL,
+        bt_const.ParallelMode.MULTIPROCESSING,
+        bt_const.ParallelMode.CONCURRENT,
+    ],
+)
+def test_execute_shared_args(mode):
+    """Shared arguments are passed with each item, by Pool initializer in process modes."""
+    in_data = [i + 0.123456 for i in range(20)]
+    result = execute_multiprocessing(
+        round, in_data, "Test", 2, mode=mode, verbose=True, shared_args={"ndigits": 2}
+    )
+    assert sorted(result) == [round(i, 2) for i in in_data]
+
+
+def test_line_table(testdata_dir):
+    """Line table splits lines at vertices, work items pickle without attributes."""
+    in_line = testdata_dir.joinpath("seed_lines.gpkg").as_posix()
+    gdf = algo_common.read_geospatial_file(in_line).explode(index_parts=False)
+    table = algo_common.prepare_line_table(in_line, None, True)
+    segments = [
+        (row, sh_geom.LineString(pair))
+        for row, line in enumerate(gdf.geometry)
+        for pair in zip(line.coords[:-1], line.coords[1:])
+    ]
+    assert len(table) == len(segments)
+    assert all(table.geometry(i).equals(seg) for i, (_, seg) in enumerate(segments))
+
+    out = table.to_gdf(table.geometries()[::-1], np.arange(len(table))[::-1], {"cl_status": 1})
+    expected = gdf.iloc[[row for row, _ in segments][::-1]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(out.drop(columns=["geometry", "cl_status"])), expected.drop(columns="geometry")
+    )
+    assert (out.crs, out["cl_status"].iloc[0]) == (gdf.crs, 1)
+
+    whole = algo_common.prepare_line_table(in_line, None, False)
+    assert all(whole.geometry(i).equals(line) for i, line in enumerate(gdf.geometry))
+
+    seed_line = algo_centerline.SeedLine(3, table.line_coords(3), "chm.tif", 15)
+    restored = pickle.loads(pickle.dumps(seed_line))
+    assert not hasattr(restored, "__dict__")
+    assert restored.geometry.equals(table.geometry(3))
+    assert (restored.index, restored.raster, restored.line_radius) == (3, "chm.tif", 15)
+    assert len(pickle.dumps(seed_line)) < len(pickle.dumps(table.to_gdf([table.geometry(3)], [3]))) / 3
+
+
+def test_ring_buffer_table():
+    """Ring table matches rings buffered one by one, in order of line, side and ring."""
+    lines = [
+        sh_geom.LineString([(0, 0), (40, 0), (40, 30)]),
+        sh_geom.LineString([(0, 0), (10, 10), (10, 0), (0, 10)]),
+    ]
+    table = algo_common.ring_buffer_table(lines, ring_count=5, ring_width=2)
+
+    expected = []
+    for i, line in enumerate(lines):
+        for side, sign in (("left", 1), ("right", -1)):
+            rings = []
+            for k in range(5):
+                big = line.buffer(sign * 2 * (k + 1), single_sided=True, cap_style="flat")
+                ring = big.difference(line.buffer(sign * 2 * k, single_sided=True, cap_style="flat"))
+                parts = ring.geoms if ring.geom_type == "GeometryCollection" else [ring]
+                rings += [part for part in parts if part.geom_type != "LineString"]
+            expected += [(i, side, k, ring) for k, ring in enumerate(rings)]
+
+    assert table[["line", "side", "iRing"]].values.tolist() == [list(item[:3]) for item in expected]
+    assert all(geom.equals_exact(item[3], 0) for geom, item in zip(table.geometry, expected))
+    assert algo_common.ring_buffer_table([]).empty
+
+
+def test_rate_of_change_cuts():
+    """Cut distance and height of padded rows of ring percentiles."""
+    rows = [
+        [1, 2, 3.6, 4, 4],  # rise of 1.6 at third ring
+        [2, 3.25, 3.3, 3.3],  # rise of 1.25 found by lowered threshold
+        [16, 16, 16, 16, 16, 18, 18],  # high canopy far from line
+        [7, 7.2, 7.5, 8],  # no rise, estimated from median
+        [np.nan] * 5,
+        [],
+    ]
+    percentiles = np.full((len(rows), 8), 99.0)
+    for i, row in enumerate(rows):
+        percentiles[i, : len(row)] = row
+
+    cut_dist, cut_percentile = algo_common.rate_of_change_cuts(percentiles, [len(row) for row in rows])
+    assert cut_dist.tolist() == [3.0, 2.0, 6.0, 5.5, 1.0, 0.0]
+    assert cut_percentile.tolist() == [3.0, 3.0, 15.5, 7.0, 0.5, 0.5]
+
+
+def test_zonal_percentiles(testdata_dir):
+    """Percentiles of rings from one window read match percentile of each clipped ring."""
+    in_chm = testdata_dir.joinpath("chm.tif").as_posix()
+    with rasterio.open(in_chm) as src:
+        left, bottom, right, top = src.bounds
+
+    # line crossing raster edge, its outer rings are outside raster
+    lines = [
+        sh_geom.LineString([(left + 30, bottom + 30), (left + 60, bottom + 50), (left + 70, bottom + 20)]),
+        sh_geom.LineString([(right - 20, top - 10), (right + 40, top + 30)]),
+    ]
+    rings = algo_common.ring_buffer_table(lines).geometry.values
+    percentiles, inside = sp_common.zonal_percentiles(in_chm, rings, 50, use_cache=False)
+
+    assert not inside.all() and inside.any()
+    for ring, percentile, is_inside in zip(rings, percentiles, inside):
+        try:
+            clipped, _ = sp_common.clip_raster(in_chm, ring, 0, use_cache=False)
+        except ValueError:
+            assert not is_inside
+            continue
+
+        expected = np.nanpercentile(np.ma.filled(clipped, np.nan), 50)
+        assert is_inside and (percentile == expected or np.isnan(percentile) and np.isnan(expected))
+
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 6, 500)
+    values = rng.random(500).astype(np.float32)
+    result = sp_common.label_percentiles(labels, values, 7, 37.3)
+    assert result.tobytes() == np.array(
+        [np.percentile(values[labels == i], 37.3) for i in range(6)] + [np.nan], dtype=np.float32
+    ).tobytes()
+
+
+def test_percentile_index(testdata_dir, tmp_path):
+    """Percentiles from block histograms are within error bound of exact ones, index is rebuilt when stale."""
+    in_chm = tmp_path.joinpath("chm.tif").as_posix()
+    with rasterio.open(testdata_dir.joinpath("chm.tif")) as src:
+        meta = src.meta
+        image = src.read()
+        left, bottom, right, top = src.bounds
+    with rasterio.open(in_chm, "w", **meta) as dst:
+        dst.write(image)
+
+    assert pct_index.open_percentile_index(in_chm, error=0.05) is None
+    index = pct_index.open_percentile_index(in_chm, error=0.05, build=True)
+    assert index.error == 0.05 and pct_index.PercentileIndex.load(in_chm, 0.01) is None
+
+    rng = np.random.default_rng(0)
+    zones = [
+        sh_geom.Point(rng.uniform(left, right), rng.uniform(bottom, top)).buffer(rng.uniform(5, 40))
+        for _ in range(20)
+    ]
+    line = sh_geom.LineString([(left + 30, bottom + 30), (left + 60, top)])
+    zones += list(algo_common.ring_buffer_table([line]).geometry)
+    exact, inside = sp_common.zonal_percentiles(in_chm, zones, 50, use_cache=False)
+    approx, approx_inside = sp_common.zonal_percentiles(in_chm, zones, 50, use_cache=False, index=index)
+    assert np.array_equal(inside, approx_inside)
+    assert np.array_equal(np.isnan(exact), np.isnan(approx))
+    assert np.nanmax(np.abs(exact - approx)) <= 0.05 + 1e-5
+
+    labels = rng.integers(0, 4, 300)
+    values = rng.random(300).astype(np.float32)
+    weights = rng.integers(1, 4, 300)
+    result = sp_common.label_percentiles(labels, values, 4, 40, weights)
+    expected = [np.percentile(np.repeat(values[labels == i], weights[labels == i]), 40) for i in range(4)]
+    assert result.tobytes() == np.array(expected, dtype=np.float32).tobytes()
+
+    # index of changed raster is not used
+    with rasterio.open(in_chm, "r+") as dst:
+        dst.write(image + 1)
+    os.utime(in_chm, ns=(0, 0))
+    assert pct_index.PercentileIndex.load(in_chm, 0.05) is None
+
+
+def test_copyparallel_lines(testdata_dir):
+    """Vectorized offsets match parallel_offset of each line, rows without geometry are dropped."""
+    lines = gpd.read_file(testdata_dir.joinpath("seed_lines.gpkg")).explode(ignore_index=True)
+    lines.loc[len(lines)] = lines.iloc[0]
+    lines.loc[len(lines) - 1, "geometry"] = None
+    dfL, dfR = canopy_threshold_relative.copyparallel_lineLRC(lines, lines.copy(), 10, 5)
+
+    assert len(dfL) == len(dfR) == len(lines) - 1
+    for i, line in lines.geometry.iloc[:-1].items():
+        line = line.simplify(tolerance=0.05, preserve_topology=True)
+        left = line.parallel_offset(distance=10, side="left", join_style=shapely.BufferJoinStyle.mitre)
+        right = line.parallel_offset(distance=-5, side="right", join_style=shapely.BufferJoinStyle.mitre)
+        assert dfL.geometry[i].equals_exact(left, 0) and dfR.geometry[i].equals_exact(right, 0)
+
+
+def test_result_record(testdata_dir, monkeypatch, tmp_path):
+    """Workers return WKB records, line attributes are attached in main process."""
+    table = algo_common.prepare_line_table(testdata_dir.joinpath("seed_lines.gpkg").as_posix(), None, True)
+    records = []
+    for i in (2, 0):
+        record = ResultRecord(i, attributes={"timings": {"clip_cost": 0.1}})
+        record.add_rows("centerline", [table.geometry(i)], cl_status=[i])
+        records.append(pickle.loads(pickle.dumps(record)))
+    records.append(ResultRecord(1))  # failed line without rows
+
+    out = records_to_gdf(records, "centerline", line_table=table)
+    expected = table.to_gdf([table.geometry(2), table.geometry(0)], [2, 0], {"cl_status": [2, 0]})
+    pd.testing.assert_frame_equal(pd.DataFrame(out), pd.DataFrame(expected))
+    assert records_to_gdf(records, "corridor_polygon", crs=table.crs).empty
+    assert len(records[-1].geometries("centerline")) == 0
+
+    raster = np.ones((4, 5), dtype=np.float32)
+    meta = {"crs": table.crs, "transform": rasterio.transform.from_origin(0, 5, 1, 1)}
+    algo_common.save_debug_raster("item_0_cost", raster, meta)
+    assert not tmp_path.joinpath("item_0_cost.tif").exists()
+    monkeypatch.setattr(bt_const, "DEBUG_RASTER_DIR", tmp_path.as_posix())
+    algo_common.save_debug_raster("item_0_cost", np.ma.masked_less(raster, 0), meta)
+    with rasterio.open(tmp_path.joinpath("item_0_cost.tif")) as src:
+        assert np.array_equal(src.read(1), raster)
+
+
+@pytest.mark.parametrize("order", [bt_const.SpatialOrder.HILBERT, bt_const.SpatialOrder.ZORDER])
+def test_spatial_order(order):
+    """Items are ordered along curve of their locations, items without location go last."""
+    rng = np.random.default_rng(0)
+    cells = [(x, y) for x in range(16) for y in range(16)]
+    items = [{"line": sh_geom.Point(cells[i]).buffer(0.1)} for i in rng.permutation(len(cells))] + [{}]
+
+    ordered = spatial_order(items, order)
+    assert sorted(ordered) == list(range(len(items))) and ordered[-1] == len(items) - 1
+
+    # both curves fill square blocks of 2x2, 4x4 and 8x8 cells first
+    centers = np.array([items[i]["line"].centroid.coords[0] for i in ordered[:-1]])
+    for size in (2, 4, 8):
+        assert np.ptp(centers[: size * size], axis=0).max() == pytest.approx(size - 1)
+
+    if order == bt_const.SpatialOrder.HILBERT:
+        steps = np.abs(np.diff(centers, axis=0)).sum(axis=1)
+        assert np.allclose(steps, 1.0)  # Hilbert curve moves to neighbour cell each step
+
+    # spatial chunks are contiguous runs of the curve, capped by item count
+    chunks = task_chunks(items, 2, order)
+    assert [i for chunk in chunks for i in chunk] == ordered
+    assert len(chunks[0]) == len(items) // (2 * bt_const.SPATIAL_CHUNKS_PER_WORKER)
+
+    chunks = task_chunks(items * 8, 1, order)
+    assert max(len(chunk) for chunk in chunks) == bt_const.SPATIAL_MAX_CHUNK_ITEMS
+
+
+def test_task_chunks_longest_first():
+    """Items are chunked by descending cost, chunks get smaller as remaining cost drops."""
+    lengths = [10, 400, 30, 5, 200, 20] * 10
+    lines = [sh_geom.LineString([(i, 0), (i, length)]) for i, length in enumerate(lengths)]
+    assert estimate_line_cost(lines[0], buffer_width=2, cell_area=4) == pytest.approx((10 + 2) * 2 / 4)
+
+    chunks = task_chunks(lines, 2, cost_estimator=estimate_line_cost)
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(len(lines)))
+
+    costs = [[estimate_line_cost(lines[i]) for i in chunk] for chunk in chunks]
+    assert all(min(chunk) >= max(next_chunk) for chunk, next_chunk in zip(costs, costs[1:]))
+    chunk_costs = [sum(chunk) for chunk in costs]
+    assert chunk_costs[0] <= sum(chunk_costs) / 4 + max(costs[0])
+    assert chunk_costs == sorted(chunk_costs, reverse=True)
+
+    # chunks of uniform items are capped by item count
+    uniform = [sh_geom.LineString([(i, 0), (i, 10)]) for i in range(200)]
+    chunks = task_chunks(uniform, 2, cost_estimator=estimate_line_cost)
+    assert max(len(chunk) for chunk in chunks) == bt_const.LOAD_BALANCE_MAX_CHUNK_ITEMS
+
+    # with spatial order, chunks are contiguous runs of the curve sent by descending cost
+    ordered = spatial_order(lines, bt_const.SpatialOrder.HILBERT)
+    chunks = task_chunks(lines, 2, bt_const.SpatialOrder.HILBERT, estimate_line_cost)
+    positions = {i: position for position, i in enumerate(ordered)}
+    runs = sorted(chunks, key=lambda chunk: positions[chunk[0]])
+    assert [i for chunk in runs for i in chunk] == ordered
+    assert max(len(chunk) for chunk in chunks) <= bt_const.LOAD_BALANCE_MAX_CHUNK_ITEMS
+    chunk_costs = [sum(estimate_line_cost(lines[i]) for i in chunk) for chunk in chunks]
+    assert chunk_costs == sorted(chunk_costs, reverse=True)
+
+    result = execute_multiprocessing(
+        estimate_line_cost,
+        lines,
+        "test",
+        2,
+        mode=bt_const.ParallelMode.MULTIPROCESSING,
+        verbose=True,
+        cost_estimator=estimate_line_cost,
+    )
+    assert sorted(result) == sorted(estimate_line_cost(line) for line in lines)
+
+
+@pytest.mark.parametrize(
+    "mode",
+    [
+        bt_const.ParallelMode.SEQUENTIAL,
+        bt_const.ParallelMode.MULTIPROCESSING,
+        bt_const.ParallelMode.CONCURRENT,
+    ],
+)
+def test_execute_keeps_results_of_failed_items(mode):
+    """Item raising exception is reported as failure, results of other items are kept."""
+    failures = []
+    result = execute_multiprocessing(
+        math.sqrt, [4.0, -1.0, 9.0], "Test", 2, mode=mode, verbose=True, failures=failures
+    )
+    assert sorted(result) == [2.0, 3.0]
+    assert [(item.item, item.reason) for item in failures] == [(-1.0, "error")]
+    assert failures[0].message.startswith("ValueError")
+
+
+def test_execute_task_timeout():
+    """Stuck and crashed workers are replaced, their items are reported as failures."""
+    failures = []
+    start = time.time()
+    mode = bt_const.ParallelMode.MULTIPROCESSING
+    in_data = [0.01] * 5 + [60] + [0.01] * 5
+    execute_multiprocessing(
+        time.sleep, in_data, "Test", 2, mode=mode, verbose=True, failures=failures, task_timeout=1
+    )
+    assert time.time() - start < 30
+    assert [(item.item, item.reason) for item in failures] == [(60, "timeout")]
+
+    failures = []
+    result = execute_multiprocessing(
+        os._exit, [3], "Test", 1, mode=mode, verbose=True, failures=failures, task_timeout=10
+    )
+    assert result == [] and [(item.item, item.reason) for item in failures] == [(3, "crash")]
+
+
+@pytest.mark.parametrize(
+    "mode, task_timeout",
+    [
+        (bt_const.ParallelMode.MULTIPROCESSING, None),
+        (bt_const.ParallelMode.CONCURRENT, None),
+        (bt_const.ParallelMode.MULTIPROCESSING, 60),
+    ],
+)
+def test_execute_prints_worker_cache_stats(testdata_dir, capsys, mode, task_timeout):
+    """Raster cache counters of workers are returned with their results and summed after the run."""
+    chm_file = testdata_dir.joinpath("chm.tif").as_posix()
+    with rasterio.open(chm_file) as dataset:
+        center = sh_geom.box(*dataset.bounds).centroid
+
+    lines = [sh_geom.LineString([(center.x + i, center.y), (center.x + i, center.y + 20)]) for i in range(12)]
+    execute_multiprocessing(
+        functools.partial(sp_common.clip_raster, chm_file),
+        lines,
+        "Test",
+        2,
+        mode=mode,
+        verbose=True,
+        shared_args={"buffer": 5},
+        task_timeout=task_timeout,
+    )
+    stats = re.search(r"Raster cache: (\d+) hits, (\d+) misses", capsys.readouterr().out)
+    assert stats and int(stats[1]) > 0 and int(stats[2]) > 0
+
+
+def test_checkpoint_resume(tmp_path):
+    """Items completed in checkpoint are skipped on resume, their stored results are merged."""
+    path = tmp_path.joinpath("out.checkpoint.sqlite")
+    mode = bt_const.ParallelMode.MULTIPROCESSING
+    checkpoint = CheckpointStore(path, {"radius": 15})
+    in_data = [4.0, 9.0, 16.0]
+    result = execute_multiprocessing(math.sqrt, in_data, "Test", 2, mode=mode, checkpoint=checkpoint)
+    assert sorted(result) == [2.0, 3.0, 4.0]
+    checkpoint.close()
+
+    # items 0-2 are skipped, math.sqrt would fail on them
+    checkpoint = CheckpointStore(path, {"radius": 15}, resume=True)
+    failures = []
+    in_data = [-4.0, -9.0, -16.0, 25.0]
+    result = execute_multiprocessing(
+        math.sqrt, in_data, "Test", 2, mode=mode, checkpoint=checkpoint, failures=failures
+    )
+    assert sorted(result) == [2.0, 3.0, 4.0, 5.0] and not failures
+
+    checkpoint.close()
+
+    # stored results are read in batches of keys and yielded in order of keys
+    checkpoint = CheckpointStore(path, {"radius": 15}, resume=True)
+    results = checkpoint.results(["3", "0", "missing", "1", "2"], batch_size=2)
+    assert list(results) == [5.0, 2.0, None, 3.0, 4.0]
+    checkpoint.close()
+
+    # other parameters don't resume
+    checkpoint = CheckpointStore(path, {"radius": 10}, resume=True)
+    execute_multiprocessing(
+        math.sqrt, in_data, "Test", 2, mode=mode, checkpoint=checkpoint, failures=failures
+    )
+    assert sorted(item.item for item in failures) == sorted(in_data[:3])
+    checkpoint.remove()
+    assert not path.exists()
+
+    lines = [
+        gpd.GeoDataFrame({"OLnFID": [i], "OLnSEG": [0]}, geometry=[sh_geom.Point(i, 0)]) for i in range(3)
+    ]
+    assert item_keys(lines) == ["0/0", "1/0", "2/0"]
+    assert item_keys(lines + [lines[0]]) == ["0", "1", "2", "3"]
+
+    # work items are keyed by line IDs from LineTable, segments by their part number
+    in_line = tmp_path.joinpath("lines.gpkg")
+    gpd.GeoDataFrame(
+        {"OLnFID": [7, 3], "OLnSEG": [0, 0]},
+        geometry=[sh_geom.LineString([(0, 0), (1, 0), (2, 0)]), sh_geom.LineString([(0, 1), (1, 1)])],
+        crs="EPSG:2956",
+    ).to_file(in_line)
+    table = algo_common.prepare_line_table(in_line.as_posix(), None, True)
+    seed_lines = pickle.loads(pickle.dumps(centerline.generate_line_class_list(table)))
+    assert item_keys(seed_lines) == ["7/0/0", "7/0/1", "3/0/0"]
+
+    # edited input has new fingerprint, so it is not resumed with stored results
+    fingerprint = file_fingerprint(in_line)
+    gpd.read_file(in_line).iloc[:1].to_file(in_line)
+    assert file_fingerprint(in_line) != fingerprint and file_fingerprint(None) is None
+
+
+def line_record(line):
+    """Record of line with its vertex count, to check records served from cache."""
+    return ResultRecord(line.index, attributes={"vertices": len(line.coords)})
+
+
+def test_result_cache(tmp_path):
+    """Unchanged items are served from cache, least recently used results are evicted."""
+    mode = bt_const.ParallelMode.MULTIPROCESSING
+    cache = ResultCache({"radius": 15}, tmp_path, max_mb=1)
+    result = execute_multiprocessing(math.sqrt, [4.0, 9.0], "Test", 2, mode=mode, result_cache=cache)
+    assert sorted(result) == [2.0, 3.0]
+    assert cache.contains(cache.item_keys([4.0, 9.0, 16.0])) == set(cache.item_keys([4.0, 9.0]))
+
+    # keys depend on parameters
+    other = ResultCache({"radius": 10}, tmp_path)
+    assert not other.contains(other.item_keys([4.0]))
+
+    result = execute_multiprocessing(math.sqrt, [4.0, 9.0, 16.0], "Test", 2, mode=mode, result_cache=cache)
+    assert sorted(result) == [2.0, 3.0, 4.0]
+
+    key_4, key_9, key_16 = cache.item_keys([4.0, 9.0, 16.0])
+    for age, key in enumerate((key_9, key_4, key_16)):
+        os.utime(cache.file(key), (1000 + age, 1000 + age))
+
+    cache.max_bytes = cache.file(key_4).stat().st_size * 2
+    cache.evict()
+    assert cache.contains([key_4, key_9, key_16]) == {key_4, key_16}
+    assert list(cache.results([key_4, key_9])) == [2.0, None]  # evicted file is read as None
+
+    # unreadable result is computed again, failed item is not cached
+    cache.file(key_16).write_bytes(b"")
+    cache = ResultCache({"radius": 15}, tmp_path, max_mb=1)
+    failures = []
+    result = execute_multiprocessing(
+        math.sqrt, [4.0, 16.0, -1.0], "Test", 2, mode=mode, result_cache=cache, failures=failures
+    )
+    assert sorted(result) == [2.0, 4.0] and len(failures) == 1
+    assert cache.contains(cache.item_keys([16.0, -1.0])) == {key_16}
+
+    # lines are keyed by coordinates, records served from cache take current line index
+    lines = [algo_centerline.SeedLine(i, np.array([[0.0, i], [1.0, i]] + [[2.0, i]] * i)) for i in range(3)]
+    execute_multiprocessing(line_record, lines, "Test", 2, mode=mode, result_cache=cache)
+    lines = [algo_centerline.SeedLine(0, np.array([[5.0, 5.0], [6.0, 6.0]]))] + [
+        algo_centerline.SeedLine(i + 1, line.coords) for i, line in enumerate(lines)
+    ]
+    assert cache.contains(cache.item_keys(lines)) == set(cache.item_keys(lines[1:]))
+    result = execute_multiprocessing(line_record, lines, "Test", 2, mode=mode, result_cache=cache)
+    records = sorted((item.index, item.attributes["vertices"]) for item in result)
+    assert records == [(0, 2), (1, 2), (2, 3), (3, 4)]
+
+
+def test_result_cache_misses_changed_settings(tmp_path, monkeypatch):
+    """Results computed with other algorithm settings are not served from cache."""
+    lines = [algo_centerline.SeedLine(0, np.array([[0.0, 0.0], [1.0, 1.0]]))]
+
+    def tool_caches():
+        return [
+            ResultCache({"tool": "centerline", **algo_centerline.centerline_settings()}, tmp_path),
+            ResultCache({"tool": "canopy_footprint_abs", **algo_common.corridor_settings()}, tmp_path),
+        ]
+
+    for cache in tool_caches():
+        execute_multiprocessing(
+            line_record, lines, "Test", 1, mode=bt_const.ParallelMode.SEQUENTIAL, result_cache=cache
+        )
+        assert cache.contains(cache.item_keys(lines))
+
+    monkeypatch.setattr(bt_const, "CORRIDOR_BOUNDED_SEARCH", not bt_const.CORRIDOR_BOUNDED_SEARCH)
+    for cache in tool_caches():
+        assert not cache.contains(cache.item_keys(lines))
+
+    monkeypatch.undo()
+    monkeypatch.setattr(bt_const, "LCP_PYRAMID_FACTORS", (4,))
+    centerline_cache, footprint_cache = tool_caches()
+    assert not centerline_cache.contains(centerline_cache.item_keys(lines))
+    assert footprint_cache.contains(footprint_cache.item_keys(lines))